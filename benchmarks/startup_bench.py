@@ -0,0 +1,71 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how much activating bocado adds to interpreter startup.
+
+Run with `python -m benchmarks.startup_bench`. Output is one JSON object per
+line with the fields:
+
+  variant: what the interpreter ran at startup.
+  best_ms, median_ms: wall time of the whole interpreter run.
+  added_ms: best_ms minus the best_ms of a bare interpreter.
+"""
+
+import argparse
+import compileall
+import json
+import os
+import subprocess
+import sys
+import time
+
+import bocado
+
+variants = [
+    ("bare", "pass"),
+    ("bootstrap", "import bocado.bootstrap as b; b.install()"),
+    ("eager", "import bocado.bootstrap as b; from bocado import output; "
+              "b.install()"),
+    ]
+
+
+def time_variant(code, runs):
+  times = []
+  for _ in range(runs):
+    start = time.time()
+    subprocess.check_call([sys.executable, "-c", code])
+    times.append((time.time() - start) * 1000)
+  times.sort()
+  return times[0], times[len(times) / 2]
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--runs", type=int, default=20,
+                      help="Interpreter launches per variant.")
+  args = parser.parse_args(argv)
+  # Installed packages ship bytecode; don't measure compiling bocado.
+  compileall.compile_dir(os.path.dirname(bocado.__file__), quiet=True)
+  bare = None
+  for name, code in variants:
+    best, median = time_variant(code, args.runs)
+    if bare is None:
+      bare = best
+    sys.stdout.write("%s\n" % json.dumps(
+        {"variant": name, "best_ms": best, "median_ms": median,
+         "added_ms": best - bare},
+        sort_keys=True))
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
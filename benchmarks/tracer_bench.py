@@ -0,0 +1,211 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the overhead of the tracer on representative workloads.
+
+Run with `python -m benchmarks.tracer_bench`. Every (workload, mode) pair runs
+in a fresh interpreter so that peak memory and sampler state are not shared.
+Output is one JSON object per line with the fields:
+
+  workload, mode: what was run.
+  calls: Python function calls made by one run of the workload.
+  seconds: best wall time over the repetitions.
+  slowdown: seconds divided by the untraced seconds.
+  ns_per_call: added nanoseconds per function call relative to untraced.
+  peak_rss_kb: peak resident set size of the child interpreter.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from bocado import classes
+from bocado import value_sampler
+
+
+# Workloads. Each takes no arguments; they mirror the shapes in
+# tests/value_sampler_test.py at a size where timing is meaningful.
+
+def _ulam(n, steps=0):
+  if n == 1:
+    return steps
+  elif (n % 2) == 0:
+    return _ulam(n / 2, steps + 1)
+  else:
+    return _ulam((3 * n) + 1, steps + 1)
+
+
+def recursive():
+  for n in xrange(1, 2000):
+    _ulam(n)
+
+
+def _wide(a, b, c, d, e, f, g, h, i, j):
+  return a + b + c + d + e + f + g + h + i + j
+
+
+def wide():
+  for n in xrange(20000):
+    _wide(n, 1, 2.0, 3, 4L, 5, 6.0, 7, 8, 9)
+
+
+class _Point(object):
+
+  def __init__(self, x, y):
+    self.x = x
+    self.y = y
+
+  def l1_distance(self, other):
+    return abs(self.x - other.x) + abs(self.y - other.y)
+
+
+def objects():
+  origin = _Point(0, 0)
+  for n in xrange(10000):
+    _Point(n, -n).l1_distance(origin)
+
+
+def _total(values, weights, names):
+  return sum(values) + len(weights) + len(names)
+
+
+def containers():
+  values = range(50)
+  for n in xrange(10000):
+    _total(values, (n, n + 1, float(n)), {"a": n, "b": str(n)})
+
+
+def _countdown(n):
+  while n > 0:
+    yield n
+    n -= 1
+
+
+def generators():
+  for n in xrange(200):
+    for _ in _countdown(100):
+      pass
+
+
+workloads = {
+    "recursive": recursive,
+    "wide": wide,
+    "objects": objects,
+    "containers": containers,
+    "generators": generators,
+    }
+
+
+# Tracing modes. Each configures the sampler; None means no tracing at all.
+
+def _retention(mode):
+  return lambda: value_sampler.reset_retention(mode)
+
+
+modes = {
+    "untraced": None,
+    "strong": _retention(classes.STRONG),
+    "fingerprint": _retention(classes.FINGERPRINT),
+    "weak": _retention(classes.WEAK),
+    "statistics": lambda: value_sampler.reset_value_statistics(True),
+    "stats": value_sampler.enable_stats,
+    "callsites": lambda: value_sampler.reset_callsites(True),
+    "signatures": lambda: value_sampler.reset_signatures(True),
+    "latency": lambda: value_sampler.reset_latency(True, by_signature=True),
+    "governed": lambda: value_sampler.set_overhead_budget(0.02, window=0.01),
+    # Every workload function is rejected by the filters.
+    "filtered": lambda: value_sampler.set_filters(exclude=["*/benchmarks/*"]),
+    }
+
+
+def count_calls(workload):
+  """Returns the number of Python calls (including resumptions) workload makes."""
+  counter = [0]
+  def profile(frame, event, arg):
+    if event == "call":
+      counter[0] += 1
+  sys.setprofile(profile)
+  workload()
+  sys.setprofile(None)
+  # The workload's own frame is not a call we are measuring.
+  return counter[0] - 1
+
+
+def run_child(workload_name, mode_name, repeat):
+  """Times one workload in one mode in this process; returns a result dict."""
+  workload = workloads[workload_name]
+  setup = modes[mode_name]
+  best = None
+  for _ in range(repeat):
+    if setup is not None:
+      classes.FunctionRef.all_fns = classes.ValueCollectionDict(dict)
+      classes.ArgRef.all_args = classes.ValueCollectionDict(dict)
+      value_sampler.reset()
+      setup()
+      sys.settrace(value_sampler.get_fn_arg_values)
+    start = time.time()
+    workload()
+    elapsed = time.time() - start
+    sys.settrace(None)
+    best = elapsed if best is None else min(best, elapsed)
+  return {
+      "workload": workload_name,
+      "mode": mode_name,
+      "seconds": best,
+      "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+      }
+
+
+def run(workload_names, mode_names, repeat, stream):
+  for workload_name in workload_names:
+    calls = count_calls(workloads[workload_name])
+    baseline = None
+    for mode_name in ["untraced"] + [m for m in mode_names if m != "untraced"]:
+      child = subprocess.Popen(
+          [sys.executable, "-m", "benchmarks.tracer_bench", "--child",
+           "--workloads", workload_name, "--modes", mode_name,
+           "--repeat", str(repeat)],
+          stdout=subprocess.PIPE)
+      result = json.loads(child.communicate()[0])
+      if baseline is None:
+        baseline = result["seconds"]
+      result["calls"] = calls
+      result["slowdown"] = result["seconds"] / baseline
+      result["ns_per_call"] = (result["seconds"] - baseline) * 1e9 / calls
+      stream.write("%s\n" % json.dumps(result, sort_keys=True))
+      stream.flush()
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument("--workloads", default=",".join(sorted(workloads)),
+                      help="Comma-separated workloads to run.")
+  parser.add_argument("--modes", default=",".join(sorted(modes)),
+                      help="Comma-separated tracing modes to compare.")
+  parser.add_argument("--repeat", type=int, default=3,
+                      help="Runs per measurement; the fastest is reported.")
+  parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+  args = parser.parse_args(argv)
+  workload_names = args.workloads.split(",")
+  mode_names = args.modes.split(",")
+  if args.child:
+    sys.stdout.write(json.dumps(
+        run_child(workload_names[0], mode_names[0], args.repeat)))
+  else:
+    run(workload_names, mode_names, args.repeat, sys.stdout)
+
+
+if __name__ == "__main__":
+  main(sys.argv[1:])
@@ -0,0 +1,86 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Installs the tracer at startup with only the sampling path loaded."""
+# Importing this module loads value_sampler (and through it classes and
+# sketches) but not output, which is only imported by dump(). To trace every
+# program started with BOCADO_TRACE set, add this to sitecustomize.py or to a
+# .pth file on the path:
+#
+#   import bocado.bootstrap; bocado.bootstrap.install_from_env()
+import atexit
+import os
+import sys
+
+import value_sampler
+
+# Environment variables read by install_from_env: the file to dump to,
+# optionally its format (one of `formats`), and optionally an address to
+# serve the live profile on (see server.parse_address).
+env_var = "BOCADO_TRACE"
+format_env_var = "BOCADO_FORMAT"
+serve_env_var = "BOCADO_SERVE"
+formats = ("pretty", "csv", "json")
+
+
+def install():
+  """Starts sampling calls made by the current thread."""
+  # Tracing must stop before interpreter shutdown tears down module globals.
+  atexit.register(uninstall)
+  sys.settrace(value_sampler.get_fn_arg_values)
+
+
+def uninstall():
+  sys.settrace(None)
+
+
+def dump(filename, fmt="pretty"):
+  """Replaces filename with the whole profile in one of `formats`."""
+  # Tracing is suspended so that the exporters are not sampled, and the file
+  # is renamed into place so readers never see a partial dump.
+  import output
+  tracer = sys.gettrace()
+  sys.settrace(None)
+  try:
+    tmpname = "%s.tmp" % filename
+    with open(tmpname, "w") as f:
+      if fmt == "pretty":
+        output.pretty_print_types(stream=f, repeat=True)
+      elif fmt == "csv":
+        output.print_csv(stream=f)
+      elif fmt == "json":
+        output.print_json(stream=f)
+      else:
+        raise Exception("Unknown dump format: %s" % fmt)
+    os.rename(tmpname, filename)
+  finally:
+    sys.settrace(tracer)
+
+
+def _dump_at_exit(filename, fmt):
+  uninstall()
+  dump(filename, fmt)
+
+
+def install_from_env():
+  """Installs the tracer if BOCADO_TRACE names an output file."""
+  # The profile is written to that file when the interpreter exits.
+  filename = os.environ.get(env_var)
+  if not filename:
+    return False
+  atexit.register(_dump_at_exit, filename,
+                  os.environ.get(format_env_var) or "pretty")
+  if os.environ.get(serve_env_var):
+    import server
+    server.start(server.parse_address(os.environ[serve_env_var]))
+  install()
+  return True
@@ -14,25 +14,146 @@
 
 import sys
 import types
+import weakref
+
+import sketches
+
+# Sample retention modes for ArgRef.
+# STRONG keeps the sampled values themselves.
+# FINGERPRINT keeps only a Fingerprint (type descriptor and value hash).
+# WEAK keeps a Fingerprint that also holds a weak reference to the value,
+# where the value's type supports one.
+# A Fingerprint describes its value when it is sampled, so for objects the
+# sorted dir() that STRONG only computes at export is paid per sample.
+STRONG = "strong"
+FINGERPRINT = "fingerprint"
+WEAK = "weak"
+retention_modes = (STRONG, FINGERPRINT, WEAK)
+
+# Parameter kinds for ArgRef: a named parameter, *args or **kwargs. Return
+# values have kind None. RECEIVER marks a method's self or cls, which the
+# sampler records with FunctionRef.add_receiver instead of an ArgRef.
+POSITIONAL = "positional"
+VARARGS = "varargs"
+VARKEYWORDS = "varkeywords"
+RECEIVER = "receiver"
+
+# Samples summarized by ArgRef.magnitudes and ArgRef.lengths respectively.
+numeric_types = frozenset([int, long, float])
+sized_types = frozenset([str, unicode, list, tuple, dict, set, frozenset,
+                         bytearray])
+# How many elements of each list or tuple a Fingerprint classifies. As with
+# sketches.value_hash, only a prefix is looked at, so fingerprinting a large
+# container costs no more than a small one.
+fingerprint_maxitems = 16
+# Each descriptor of a class instance, so samples with the same class and
+# dir() share one; see describe.
+_descriptors = {}
+
+
+def describe(sample, maxitems=None):
+  """Returns the descriptor instance_set uses to classify a single sample.
+
+  With maxitems, only the first maxitems elements of lists and tuples (at
+  every level) are classified.
+  """
+  # Collections are described by their parameterized type. Everything else is
+  # described by a 3-tuple of its type, its class and its sorted dir().
+  class_or_type = type(sample)
+  if class_or_type is Fingerprint:
+    return sample.descriptor
+  elif class_or_type is list or class_or_type is tuple:
+    if maxitems is not None:
+      sample = sample[:maxitems]
+    tags = count_instances(sample, maxitems)[0]
+    if class_or_type is list:
+      return ParameterizedList(tags)
+    return ParameterizedTuple(tags)
+  # Fingerprints describe values in the tracer, where no exception raised by
+  # a value's __class__ or __dir__ may reach the traced program; such values
+  # are described by their type alone.
+  try:
+    descriptor = (class_or_type, sample.__class__,
+                  tuple(sorted(dir(sample))))
+  except Exception:
+    descriptor = (class_or_type, class_or_type, ())
+  return _descriptors.setdefault(descriptor, descriptor)
+
+
+def count_instances(samples, maxitems=None):
+  """Returns instance_set(samples) and the number of samples of each tag."""
+  # The two lists are parallel. Samples of the same class with different
+  # dir()s get separate tags (so a class can appear more than once), as do
+  # distinct parameterized types.
+  tags = []
+  counts = []
+  positions = {}
+  for sample in samples:
+    descriptor = describe(sample, maxitems)
+    if type(descriptor) is tuple:
+      class_or_type, cls, dir_tuple = descriptor
+      key = (cls, dir_tuple)
+    else:
+      class_or_type = key = descriptor
+    position = positions.get(key)
+    if position is None:
+      positions[key] = len(tags)
+      tags.append(class_or_type)
+      counts.append(1)
+    else:
+      counts[position] += 1
+  return tags, counts
 
 
 def instance_set(samples):
-  unique_classes = []
-  dirs_by_class = ValueCollectionDict(set)
-  type_set = set()
-  for sample in samples:
-    class_or_type = type(sample)
-    if class_or_type is list:
-      type_set.add(ParameterizedList(instance_set(sample)))
-    elif class_or_type is tuple:
-      type_set.add(ParameterizedTuple(instance_set(sample)))
-    else:
-      dir_tuple = tuple(sorted(dir(sample)))
-      if (sample.__class__ not in dirs_by_class or
-          dir_tuple not in dirs_by_class[sample.__class__]):
-        dirs_by_class[sample.__class__] = dir_tuple
-        unique_classes.append(class_or_type)
-  return unique_classes + list(type_set)
+  return count_instances(samples)[0]
+
+
+class Fingerprint(object):
+  """Lightweight stand-in for a sampled value."""
+  # Holds everything instance_set needs to classify the value, plus its
+  # sketches.value_hash for counting distinct values. The value itself is only
+  # reachable through `ref`, a weak reference that is None unless the sample
+  # was taken in WEAK mode and the value's type supports weak references.
+
+  __slots__ = ("type", "descriptor", "valuehash", "ref")
+
+  def __init__(self, sample, valuehash, keepref=False):
+    self.type = type(sample)
+    self.descriptor = describe(sample, fingerprint_maxitems)
+    self.valuehash = valuehash
+    self.ref = None
+    if keepref:
+      try:
+        self.ref = weakref.ref(sample)
+      except TypeError:
+        pass
+
+  def value(self):
+    """Returns the sampled value if it is still alive, otherwise None."""
+    if self.ref is None:
+      return None
+    return self.ref()
+
+  def __eq__(self, other):
+    return (type(other) is Fingerprint and
+            self.valuehash == other.valuehash and
+            self.descriptor == other.descriptor)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return self.valuehash
+
+  def __repr__(self):
+    return "Fingerprint(%s, %s)@%d" % (self.descriptor[0].__name__
+                                       if type(self.descriptor) is tuple
+                                       else self.descriptor.__name__,
+                                       self.valuehash,
+                                       id(self))
+
+# class Fingerprint
 
 
 class ValueCollectionDict(dict):
@@ -95,26 +216,64 @@ class ArgRef(object):
   """Argument container."""
 
   all_args = ValueCollectionDict(dict)
-
-  def __new__(cls, owner, argname):
+  # Indexes kept up to date as samples arrive; see query. by_type maps the
+  # name of each concrete (type()) type to the ArgRefs that have seen it, and
+  # by_degree maps a number of distinct concrete types to the ArgRefs that
+  # have seen exactly that many.
+  by_type = ValueCollectionDict(set)
+  by_degree = ValueCollectionDict(set)
+  # One of retention_modes; see value_sampler.reset_retention.
+  retention = STRONG
+  # Whether to keep ValueSummary statistics; see
+  # value_sampler.reset_value_statistics.
+  collect_statistics = False
+  # Precision the distinct value sketch is folded to by compact: 64 bytes,
+  # for a relative error of about 13%.
+  compacted_precision = 6
+
+  def __new__(cls, owner, argname, position=None, kind=POSITIONAL):
     if owner in ArgRef.all_args and argname in ArgRef.all_args[owner]:
       return ArgRef.all_args[owner][argname]
     retval = super(ArgRef, cls).__new__(cls, owner, argname)
     retval._init = False
     return retval
 
-  def __init__(self, owner, argname):
+  def __init__(self, owner, argname, position=None, kind=POSITIONAL):
+    # position is the parameter's index in the function's signature; by
+    # default, the next one. The return value is argname "", position -1.
     if self._init:
         return
     self.owner = owner
     self.argname = argname
-    if argname:
-      self.position = owner.arity()
-    else:
+    if not argname:
       self.position = -1
+      self.kind = None
+    else:
+      self.position = owner.arity() if position is None else position
+      self.kind = kind
     self.samples = []
+    # Running total of sys.getsizeof of the samples; see nbytes.
+    self.sample_bytes = 0
+    # Estimates the number of distinct values without retaining them.
+    self.distinct = sketches.HyperLogLog()
+    # ValueSummary of numeric samples and of sample lengths, created on
+    # demand when ArgRef.collect_statistics is set.
+    self.magnitudes = None
+    self.lengths = None
+    # Inferred type |-> number of samples, for the samples dropped by compact.
+    self.compacted = {}
+    # Number of samples per concrete (type()) type, their total, and the
+    # number of those types seen exactly once. The counts can cover more
+    # samples than are held, e.g. after snapshot.restore.
+    self.type_counts = {}
+    self.counted = 0
+    self.singletons = 0
+    # get_type and get_type_counts, cached until the next sample arrives.
+    self._type = None
+    self._counts = None
     self.key = hash((self.owner.funcname, self.argname, self.position))
     owner.args[self.key] = self
+    owner._stale = True
     ArgRef.all_args[owner][argname] = self
     self._init = True
 
@@ -126,41 +285,198 @@ class ArgRef(object):
                                       )
 
   def get_type(self):
-    if not self.samples:
-      return types.NoneType
-    else:
-      first_type = type(self.samples[0])
-      tags = instance_set(self.samples)
-      if len(tags) == 0:
-        raise Exception("No types inferred for %d samples." % len(self.samples))
-      elif len(tags) == 1:
-        return tags[0]
-      else:
-        return TaggedUnion(tags)
+    if self._type is None:
+      self._type, self._counts = self._infer()
+    return self._type
+
+  def get_type_counts(self, cached=True):
+    """Returns a dict of each inferred type to the number of its samples.
+
+    With cached False, the counts are inferred from copies of the samples and
+    counts, and the cache is neither used nor filled, so other threads can
+    call this while samples are being added.
+    """
+    if not cached:
+      return self._infer(list(self.samples), dict(self.type_counts),
+                         dict(self.compacted))[1]
+    if self._counts is None:
+      self._type, self._counts = self._infer()
+    return dict(self._counts)
 
   def get_type_prob(self):
-    sample_types = instance_set(self.samples)
-    n = float(len(sample_types))
-    type_dict = {}
-    for sample_type in sample_types:
-      if sample_type in type_dict:
-        type_dict[sample_type] += 1
-      else:
-        type_dict[sample_type] = 1
-    for k, v in type_dict.items():
-      type_dict[k] = v/n
-    return type_dict
+    """Returns a dict of each inferred type to the fraction of its samples."""
+    if self._counts is None:
+      self._type, self._counts = self._infer()
+    n = float(sum(self._counts.values()))
+    return dict([(t, count / n) for t, count in self._counts.items()])
+
+  def _infer(self, samples=None, concrete_counts=None, compacted=None):
+    # Returns the inferred type and the counts of each inferred type, from
+    # the given copies or the argument's own samples and counts. One pass
+    # over the samples yields both. Without samples, e.g. after
+    # snapshot.restore, the concrete types counted are used instead.
+    if samples is None:
+      samples = self.samples
+      concrete_counts = self.type_counts
+      compacted = self.compacted
+    if samples or not concrete_counts or compacted:
+      tags, counts = count_instances(samples)
+    else:
+      tags, counts = concrete_counts.keys(), concrete_counts.values()
+    type_counts = dict(compacted)
+    for tag, count in zip(tags, counts):
+      type_counts[tag] = type_counts.get(tag, 0) + count
+    if compacted:
+      tags = type_counts.keys()
+    if not tags:
+      if samples:
+        raise Exception("No types inferred for %d samples." % len(samples))
+      return types.NoneType, type_counts
+    elif len(tags) == 1:
+      return tags[0], type_counts
+    return TaggedUnion(tags), type_counts
+
+  def compact(self):
+    """Drops the samples, keeping the types inferred from them."""
+    if not self.samples:
+      return
+    if self._counts is None:
+      self._type, self._counts = self._infer()
+    self.compacted = dict(self._counts)
+    self.samples = []
+    self.sample_bytes = 0
+    self.distinct.fold(ArgRef.compacted_precision)
+
+  def nbytes(self):
+    """Estimates the memory held by this argument's samples and sketches."""
+    # sample_bytes is added up as samples arrive, so this costs the same
+    # however many samples are held.
+    total = (sys.getsizeof(self.__dict__) + sys.getsizeof(self.samples) +
+             self.sample_bytes + self.distinct.nbytes() +
+             sys.getsizeof(self.compacted) + sys.getsizeof(self.type_counts))
+    for summary in (self.magnitudes, self.lengths):
+      if summary is not None:
+        total += summary.nbytes()
+    return total
+
+  def unseen_type_prob(self):
+    """Good-Turing estimate of the chance the next sample has a new type."""
+    if not self.counted:
+      return 1.0
+    return self.singletons / float(self.counted)
+
+  def add_type_count(self, sample_type, n=1):
+    """Counts n samples of the concrete type sample_type."""
+    self._type = self._counts = None
+    self.owner._stale = True
+    self.owner.generation = FunctionRef.generation = FunctionRef.generation + 1
+    count = self.type_counts.get(sample_type, 0)
+    self.type_counts[sample_type] = count + n
+    self.counted += n
+    self.singletons += (count + n == 1) - (count == 1)
+    if count == 0:
+      self._index_type(sample_type)
+
+  def _index_type(self, sample_type):
+    # Only runs the first time each type is seen, so it costs nothing per
+    # sample once an argument's types are stable.
+    degree = len(self.type_counts)
+    ArgRef.by_type[sample_type.__name__] = self
+    if degree > 1:
+      ArgRef.by_degree[degree - 1].discard(self)
+    ArgRef.by_degree[degree] = self
+
+  def num_distinct(self):
+    """Returns the estimated number of distinct values sampled."""
+    return len(self.distinct)
+
+  def _summarize(self, sample):
+    sample_type = type(sample)
+    if sample_type in numeric_types:
+      if self.magnitudes is None:
+        self.magnitudes = sketches.ValueSummary()
+      self.magnitudes.add(sample)
+    elif sample_type in sized_types:
+      if self.lengths is None:
+        self.lengths = sketches.ValueSummary()
+      self.lengths.add(len(sample))
+
+  def get_statistics(self):
+    """Returns a dict of the summaries collected for this argument."""
+    statistics = {}
+    if self.magnitudes is not None:
+      statistics["magnitude"] = self.magnitudes.to_dict()
+    if self.lengths is not None:
+      statistics["length"] = self.lengths.to_dict()
+    return statistics
 
   def add_sample(self, sample):
+    retention = ArgRef.retention
+    sample_type = type(sample)
+    if sample_type is Fingerprint:
+      self.add_type_count(sample.type)
+      self.distinct.add_hash(sample.valuehash)
+      self.samples.append(sample)
+      self.sample_bytes += sys.getsizeof(sample) + sketches._refbytes
+      return
+    self.add_type_count(sample_type)
+    valuehash = sketches.value_hash(sample)
+    self.distinct.add_hash(valuehash)
+    if ArgRef.collect_statistics:
+      self._summarize(sample)
+    if retention is not STRONG:
+      sample = Fingerprint(sample, valuehash, keepref=retention is WEAK)
     self.samples.append(sample)
+    self.sample_bytes += sys.getsizeof(sample) + sketches._refbytes
 
 # class ArgRef
 
 
+class CallSite(object):
+  """Types observed for a function's calls from one line of one caller."""
+
+  def __init__(self, filename, lineno, caller):
+    # All None for the overflow site that collects calls from the call sites
+    # past FunctionRef.maxcallsites.
+    self.filename = filename
+    self.lineno = lineno
+    self.caller = caller
+    self.calls = 0
+    # argname |-> type() |-> count; the return value is under "".
+    self.type_counts = ValueCollectionDict(dict)
+
+  def __repr__(self):
+    return "CallSite(%s, %s, %s)@%d" % (self.filename, self.lineno,
+                                        self.caller, id(self))
+
+  def add_call(self, items):
+    self.calls += 1
+    for argname, value in items:
+      self.add_value(argname, value)
+
+  def add_value(self, argname, value):
+    counts = self.type_counts[argname]
+    value_type = type(value)
+    counts[value_type] = counts.get(value_type, 0) + 1
+
+# class CallSite
+
+
 class FunctionRef(object):
   """Container for Function information."""
 
   all_fns = ValueCollectionDict(dict)
+  # funcname |-> set of FunctionRefs; see query.
+  by_name = ValueCollectionDict(set)
+  # Distinct call sites kept per function; calls from any others are counted
+  # together under the key None.
+  maxcallsites = 16
+  # Likewise for distinct signatures; see add_signature.
+  maxsignatures = 64
+  # Incremented whenever any function's samples or profiles change, and
+  # copied to that function's `generation`, so readers can ask for what
+  # changed since they last looked; see server.
+  generation = 0
 
   def __new__(cls, filename, lineno, funcname, method=False):
     if (filename in FunctionRef.all_fns
@@ -188,8 +504,37 @@ class FunctionRef(object):
     self.args = {}
     # string of argname |-> tuple of position * type
     self.signature = {}
+    # Whether signature needs recomputing; set by ArgRef when it changes.
+    self._stale = True
+    # (caller filename, caller line) |-> CallSite; see get_callsite.
+    self.callsites = {}
+    # Number of sampled calls, and LogHistograms of their durations in
+    # seconds, overall and per argument type signature (a tuple of type()s),
+    # created on demand; see value_sampler.reset_latency.
+    self.calls = 0
+    self.latency = None
+    self.latency_by_signature = {}
+    # (tuple of argument type()s, return type()) |-> number of calls; see
+    # value_sampler.reset_signatures.
+    self.signatures = {}
+    # Exception type |-> number of sampled calls that raised it, and
+    # (tuple of argument type()s, exception type) |-> number of calls when
+    # signatures are counted.
+    self.exceptions = {}
+    self.exceptions_by_signature = {}
+    # For methods: the name of the self or cls parameter, the name of the
+    # class that defines the method, and receiver class |-> number of
+    # sampled calls; see add_receiver.
+    self.receiver = None
+    self.classname = None
+    self.receivers = {}
+    # Whether the function is a generator, whose sampled return values are
+    # the values it yields.
+    self.generator = False
+    self.generation = 0
     self.key = self.__hash__()
     FunctionRef.all_fns[filename][lineno] = self
+    FunctionRef.by_name[funcname] = self
     self._init = False
 
   def __hash__(self):
@@ -236,6 +581,124 @@ class FunctionRef(object):
     else:
       return None, types.NoneType
 
+  def get_callsite(self, caller):
+    """Returns the CallSite for a call made by the frame caller."""
+    # The key is only the caller's filename and current line: two functions
+    # cannot share a line, so the caller's name adds nothing to the key.
+    key = (caller.f_code.co_filename, caller.f_lineno)
+    site = self.callsites.get(key)
+    if site is not None:
+      return site
+    if len(self.callsites) < FunctionRef.maxcallsites:
+      site = CallSite(key[0], key[1], caller.f_code.co_name)
+      self.callsites[key] = site
+      return site
+    site = self.callsites.get(None)
+    if site is None:
+      site = CallSite(None, None, None)
+      self.callsites[None] = site
+    return site
+
+  def add_latency(self, seconds, signature=None):
+    self.generation = FunctionRef.generation = FunctionRef.generation + 1
+    if self.latency is None:
+      self.latency = sketches.LogHistogram()
+    self.latency.add(seconds)
+    if signature is not None:
+      histogram = self.latency_by_signature.get(signature)
+      if histogram is None:
+        histogram = self.latency_by_signature[signature] = (
+            sketches.LogHistogram())
+      histogram.add(seconds)
+
+  def add_signature(self, argtypes, returntype):
+    self.generation = FunctionRef.generation = FunctionRef.generation + 1
+    key = (argtypes, returntype)
+    if key not in self.signatures:
+      if len(self.signatures) >= FunctionRef.maxsignatures:
+        key = None
+      self.signatures.setdefault(key, 0)
+    self.signatures[key] += 1
+
+  def get_signatures(self):
+    """Returns (argtypes, returntype, count) tuples, most common first."""
+    # Calls past maxsignatures distinct signatures are reported with None
+    # for both types.
+    return sorted([(key or (None, None)) + (count,)
+                   for key, count in self.signatures.items()],
+                  key=lambda signature: -signature[2])
+
+  def add_exception(self, exctype, argtypes=None):
+    self.generation = FunctionRef.generation = FunctionRef.generation + 1
+    self.exceptions[exctype] = self.exceptions.get(exctype, 0) + 1
+    if argtypes is not None:
+      key = (argtypes, exctype)
+      count = self.exceptions_by_signature.get(key, 0)
+      if (not count and
+          len(self.exceptions_by_signature) >= FunctionRef.maxsignatures):
+        key = None
+        count = self.exceptions_by_signature.get(key, 0)
+      self.exceptions_by_signature[key] = count + 1
+
+  def compact(self):
+    """Drops the samples of every argument; see ArgRef.compact."""
+    for arg in self.args.values():
+      arg.compact()
+
+  def nbytes(self):
+    """Estimates the memory held by this function's profile."""
+    total = sum([sys.getsizeof(d) for d in (
+        self.__dict__, self.args, self.callsites, self.signatures,
+        self.exceptions, self.exceptions_by_signature, self.receivers,
+        self.latency_by_signature)])
+    for arg in self.args.values():
+      total += arg.nbytes()
+    for site in self.callsites.values():
+      total += sys.getsizeof(site.__dict__) + sys.getsizeof(site.type_counts)
+      for counts in site.type_counts.values():
+        total += sys.getsizeof(counts)
+    if self.latency is not None:
+      total += self.latency.nbytes()
+    for histogram in self.latency_by_signature.values():
+      total += histogram.nbytes()
+    return total
+
+  def evict(self):
+    """Removes this function and its arguments from the registries."""
+    fns = FunctionRef.all_fns[self.filename]
+    if fns.get(self.lineno) is self:
+      del fns[self.lineno]
+    if not fns:
+      del FunctionRef.all_fns[self.filename]
+    FunctionRef.by_name.get(self.funcname, set()).discard(self)
+    for arg in self.args.values():
+      for sample_type in arg.type_counts:
+        ArgRef.by_type.get(sample_type.__name__, set()).discard(arg)
+      ArgRef.by_degree.get(len(arg.type_counts), set()).discard(arg)
+    ArgRef.all_args.pop(self, None)
+
+  def add_call(self):
+    """Counts a sampled call."""
+    self.generation = FunctionRef.generation = FunctionRef.generation + 1
+    self.calls += 1
+
+  def add_receiver(self, argname, cls, n=1):
+    """Counts n sampled calls of this method with a receiver of class cls."""
+    self.generation = FunctionRef.generation = FunctionRef.generation + 1
+    count = self.receivers.get(cls, 0)
+    if not count:
+      self.method = True
+      self.receiver = argname
+      self._stale = True
+    self.receivers[cls] = count + n
+
+  def get_receiver_type(self):
+    """Returns the receiver class, or a TaggedUnion of several."""
+    receivers = self.receivers.keys()
+    if len(receivers) == 1:
+      return receivers[0]
+    return TaggedUnion(receivers)
+
   def arity(self):
     # Arity is a function that that returns the number of arguments
     # to a function.
@@ -247,9 +710,14 @@ class FunctionRef(object):
     return sorted(self.args.values(), key=lambda arg: arg.position)
 
   def set_signature(self):
+    if not self._stale:
+      return
     args = self.get_sorted_arg_list()
     for arg in args:
       self.signature[arg.argname] = (arg.position, arg.get_type())
+    if self.receivers:
+      self.signature[self.receiver] = (0, self.get_receiver_type())
+    self._stale = False
 
 # class FunctionRef
 
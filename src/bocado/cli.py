@@ -0,0 +1,246 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Command-line entry point: python -m bocado run|replay [options] ..."""
+import argparse
+import atexit
+import os
+import runpy
+import signal
+import sys
+
+import bootstrap
+import classes
+import value_sampler
+
+# Modules that load the target. They run under the tracer, but are never part
+# of its profile.
+_runner_modules = ("runpy", "pkgutil")
+
+
+def _add_run_parser(subparsers):
+  run = subparsers.add_parser(
+      "run", help="Run a script or module under the tracer.",
+      description="Runs a script (or, with -m, a module) under the tracer and "
+      "writes the profile when it exits, and on demand when sent the dump "
+      "signal.")
+  run.add_argument("-m", dest="module",
+                   help="Run library module as a script, like python -m.")
+  run.add_argument("-o", "--output",
+                   default=os.environ.get(bootstrap.env_var) or
+                   "bocado_types.txt",
+                   help="File the profile is written to (default: "
+                   "$%s or bocado_types.txt)." % bootstrap.env_var)
+  run.add_argument("-f", "--format", choices=bootstrap.formats,
+                   default="pretty", help="Output format.")
+  run.add_argument("--stubs", metavar="DIR",
+                   help="Also write .pyi stubs for the sampled source files "
+                   "under DIR when the program exits.")
+  run.add_argument("--snapshot", metavar="FILE",
+                   help="Restore the sampler's state from FILE, if it "
+                   "exists, and save it there when the program exits.")
+  run.add_argument("--serve", metavar="ADDRESS",
+                   help="Serve the live profile over HTTP on ADDRESS: PORT, "
+                   "HOST:PORT or the path of a Unix socket; see server.")
+  run.add_argument("--record", metavar="PREFIX",
+                   help="Also log sampled calls to PREFIX.00000, "
+                   "PREFIX.00001, ..., for the replay command.")
+  run.add_argument("--record-max-bytes", type=int, default=64 << 20,
+                   metavar="BYTES",
+                   help="Start a new log file after this many bytes.")
+  run.add_argument("--record-max-files", type=int, metavar="N",
+                   help="Keep only the newest N log files.")
+  run.add_argument("--dump-signal", default="USR1",
+                   help="Signal that writes the profile without stopping "
+                   "(default: USR1; 'none' to disable).")
+  run.add_argument("--numsamples", type=int, default=value_sampler.numsamples,
+                   help="Sampled calls after which a function is always "
+                   "saturated.")
+  run.add_argument("--minsamples", type=int,
+                   default=value_sampler.minsamples,
+                   help="Samples before the early stopping rule applies.")
+  run.add_argument("--unseen-threshold", type=float,
+                   default=value_sampler.unseen_threshold,
+                   help="Stop early once the estimated chance of an unseen "
+                   "type is below this (0 disables).")
+  run.add_argument("--guard-stride", type=int,
+                   default=value_sampler.guard_stride,
+                   help="Check saturated functions for new argument types "
+                   "on one in every this many calls.")
+  run.add_argument("--reservoirsize", type=int,
+                   default=value_sampler.reservoirsize,
+                   help="Maximum number of functions sampled at once.")
+  run.add_argument("--retention", choices=classes.retention_modes,
+                   default=classes.STRONG,
+                   help="How sampled values are held.")
+  run.add_argument("--statistics", action="store_true",
+                   help="Summarize value ranges and lengths.")
+  run.add_argument("--sample-receivers", action="store_true",
+                   help="Sample methods' self and cls like other arguments, "
+                   "instead of counting only their classes.")
+  run.add_argument("--callsites", action="store_true",
+                   help="Also profile types per calling line.")
+  run.add_argument("--signatures", action="store_true",
+                   help="Count the joint argument and return types of calls.")
+  run.add_argument("--latency", action="store_true",
+                   help="Time sampled calls.")
+  run.add_argument("--latency-by-signature", action="store_true",
+                   help="Time sampled calls per argument type signature.")
+  run.add_argument("--include", action="append", default=[],
+                   help="Only sample functions matching this rule "
+                   "(repeatable); see value_sampler.set_filters.")
+  run.add_argument("--exclude", action="append", default=[],
+                   help="Never sample functions matching this rule "
+                   "(repeatable).")
+  run.add_argument("--overhead-budget", type=float,
+                   help="Throttle sampling to keep tracer time under this "
+                   "fraction of wall time.")
+  run.add_argument("--memory-budget", type=int, metavar="BYTES",
+                   help="Compact, then evict, saturated functions to keep "
+                   "the profile under this many bytes.")
+  run.add_argument("args", nargs=argparse.REMAINDER,
+                   help="The script (unless -m is given) and its arguments.")
+  run.set_defaults(command=_run)
+
+
+def _add_replay_parser(subparsers):
+  replay = subparsers.add_parser(
+      "replay", help="Write the profile of calls logged by run --record.",
+      description="Reads logs written by run --record, in parallel worker "
+      "processes, and writes the profile of the calls they logged.")
+  replay.add_argument("-o", "--output", default="bocado_types.txt",
+                      help="File the profile is written to (default: "
+                      "bocado_types.txt).")
+  replay.add_argument("-f", "--format", choices=bootstrap.formats,
+                      default="pretty", help="Output format.")
+  replay.add_argument("-j", "--processes", type=int,
+                      help="Worker processes (default: one per CPU).")
+  replay.add_argument("--include", action="append", default=[],
+                      help="Only replay functions matching this rule "
+                      "(repeatable); see value_sampler.set_filters.")
+  replay.add_argument("--exclude", action="append", default=[],
+                      help="Never replay functions matching this rule "
+                      "(repeatable).")
+  replay.add_argument("logs", nargs="+", metavar="LOG",
+                      help="Log files, e.g. PREFIX.*.")
+  replay.set_defaults(command=_replay)
+
+
+def configure(args):
+  """Applies the sampling options in args to value_sampler."""
+  value_sampler.numsamples = args.numsamples
+  value_sampler.reset_stopping_rule(args.minsamples, args.unseen_threshold,
+                                    args.guard_stride)
+  value_sampler.reset_reservoirsize(args.reservoirsize)
+  value_sampler.reset_retention(args.retention)
+  value_sampler.reset_value_statistics(args.statistics)
+  value_sampler.reset_receivers(not args.sample_receivers)
+  value_sampler.reset_callsites(args.callsites)
+  value_sampler.reset_signatures(args.signatures)
+  value_sampler.reset_latency(args.latency or args.latency_by_signature,
+                              by_signature=args.latency_by_signature)
+  value_sampler.set_filters(
+      include=args.include,
+      exclude=args.exclude + ["module:%s" % m for m in _runner_modules])
+  if args.overhead_budget is not None:
+    value_sampler.set_overhead_budget(args.overhead_budget)
+  if args.memory_budget is not None:
+    value_sampler.set_memory_budget(args.memory_budget)
+
+
+def _write_stubs(outdir, main):
+  # Imported here, like output in bootstrap.dump, to keep startup light.
+  import stubs
+  stubs.write_stubs(outdir, main=main)
+
+
+def _main_file(args):
+  # The source file the target runs from as __main__, or None.
+  if args.module is None:
+    return args.args[0]
+  import pkgutil
+  loader = pkgutil.get_loader(args.module)
+  if loader is not None and loader.is_package(args.module):
+    # python -m package runs package.__main__.
+    loader = pkgutil.get_loader(args.module + ".__main__")
+    return loader and loader.get_filename(args.module + ".__main__")
+  return loader and loader.get_filename(args.module)
+
+
+def _save_snapshot(filename):
+  import snapshot
+  snapshot.save(filename)
+
+
+def _run(args):
+  if args.module is None and not args.args:
+    raise SystemExit("run: a script or -m module is required")
+  configure(args)
+  dump = lambda *unused: bootstrap.dump(args.output, args.format)
+  if args.dump_signal.lower() != "none":
+    signal.signal(getattr(signal, "SIG" + args.dump_signal.upper()), dump)
+  # SIGTERM normally kills the process without running atexit handlers.
+  if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+    signal.signal(signal.SIGTERM,
+                  lambda *unused: sys.exit(128 + signal.SIGTERM))
+  atexit.register(dump)
+  if args.stubs:
+    atexit.register(_write_stubs, args.stubs, _main_file(args))
+  if args.serve:
+    import server
+    server.start(server.parse_address(args.serve))
+  if args.record:
+    import recorder
+    log = recorder.Recorder(args.record, maxbytes=args.record_max_bytes,
+                            maxfiles=args.record_max_files)
+    value_sampler.set_recorder(log)
+    atexit.register(log.close)
+  if args.snapshot:
+    if os.path.exists(args.snapshot):
+      import snapshot
+      snapshot.restore(args.snapshot)
+    atexit.register(_save_snapshot, args.snapshot)
+  # The target sees itself as argv[0] and, for scripts, its directory as
+  # sys.path[0], as if it were run directly.
+  if args.module is not None:
+    sys.argv = [args.module] + args.args
+    bootstrap.install()
+    try:
+      runpy.run_module(args.module, run_name="__main__", alter_sys=True)
+    finally:
+      bootstrap.uninstall()
+  else:
+    sys.argv = args.args
+    sys.path[0] = os.path.dirname(os.path.abspath(args.args[0]))
+    bootstrap.install()
+    try:
+      runpy.run_path(args.args[0], run_name="__main__")
+    finally:
+      bootstrap.uninstall()
+  return 0
+
+
+def _replay(args):
+  import recorder
+  recorder.replay(args.logs, include=args.include, exclude=args.exclude,
+                  processes=args.processes)
+  bootstrap.dump(args.output, args.format)
+  return 0
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(prog="python -m bocado")
+  subparsers = parser.add_subparsers()
+  _add_run_parser(subparsers)
+  _add_replay_parser(subparsers)
+  args = parser.parse_args(argv)
+  return args.command(args)
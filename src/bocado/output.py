@@ -10,6 +10,7 @@
  # See the License for the specific language governing permissions and
  # limitations under the License.
 """This module contains functions for sending data to other sources."""
+import json
 from operator import attrgetter
 import sys
 
@@ -29,6 +30,19 @@ _table = "table"
 _json = "json"
 _proto = "proto"
 _id = "id"
+_statistics = "statistics"
+_callsites = "callsites"
+_caller = "caller"
+_calls = "calls"
+_count = "count"
+_latency = "latency"
+_latency_by_signature = "latency_by_signature"
+_signature = "signature"
+_signatures = "signatures"
+_return = "return"
+_exceptions = "exceptions"
+_exceptions_by_signature = "exceptions_by_signature"
+_class = "class"
 intern(_filename)
 intern(_functions)
 intern(_lineno)
@@ -39,14 +53,27 @@ intern(_empirical_probability)
 intern(_table)
 intern(_json)
 intern(_proto)
+intern(_statistics)
+intern(_callsites)
+intern(_caller)
+intern(_calls)
+intern(_count)
+intern(_latency)
+intern(_latency_by_signature)
+intern(_signature)
+intern(_signatures)
+intern(_return)
+intern(_exceptions)
+intern(_exceptions_by_signature)
+intern(_class)
 
 
-def print_csv(stream=sys.stdout, printheader=True):
+def print_csv(stream=sys.stdout, printheader=True, since=None, cached=True):
   """Prints out the serialized version of our type samples as a csv."""
   if stream.closed:
     raise Exception("Stream is closed; management must be performed by the "
                     "caller.")
-  tuples = serialize(fmt="table")
+  tuples = serialize(fmt="table", since=since, cached=cached)
   if printheader:
     headerline = ",".join([k for k, v in serialize.headers])
     stream.write("%s\n" % headerline)
@@ -54,6 +81,25 @@ def print_csv(stream=sys.stdout, printheader=True):
     stream.write("%s\n" % ",".join([str(t) for t in tupe]))
   stream.flush()
 
+def print_json(stream=sys.stdout, since=None, cached=True):
+  """Prints out the serialized version of our type samples as json."""
+  if stream.closed:
+    raise Exception("Stream is closed; management must be performed by the "
+                    "caller.")
+  json.dump(serialize(fmt="json", since=since, cached=cached), stream)
+  stream.write("\n")
+  stream.flush()
+
+def print_stats(stream=sys.stdout):
+  """Prints the sampler's counters, timers and sample memory."""
+  if stream.closed:
+    raise Exception("Stream is closed; management must be performed by the "
+                    "caller.")
+  from value_sampler import get_stats
+  for name, value in sorted(get_stats().items()):
+    stream.write("%s: %s\n" % (name, value))
+  stream.flush()
+
 def pretty_print_types(stream=sys.stdout, onlycompleted=False, repeat=False):
   """Prints out type information for functions to an output stream."""
   # """
@@ -90,13 +136,60 @@ def pretty_print_types(stream=sys.stdout, onlycompleted=False, repeat=False):
 
   def _strunion(arg, v):
     if isinstance(v, TaggedUnion):
-      types = arg.get_type_prob().items()
-      unions = ["\n\t\t%s (%0.2f)" % (t.__name__, prob) for t, prob in types]
+      types = arg.get_type_counts().items()
+      n = float(sum([count for _, count in types]))
+      unions = ["\n\t\t%s (%0.2f, x%d)" % (t.__name__, count / n, count)
+                for t, count in types]
       return "".join(unions)
     else:
       return ""
 
-  # Print stuff.
+  def _strsignatures(f):
+    lines = []
+    for argtypes, returntype, count in f.get_signatures():
+      if argtypes is None:
+        lines.append("\n\tother signatures x%d" % count)
+      else:
+        lines.append("\n\tsignature (%s) -> %s x%d" % (
+            ", ".join(_typenames(argtypes)), returntype.__name__, count))
+    return "".join(lines)
+
+  def _strcallsites(f):
+    lines = []
+    for site in sorted(f.callsites.values(), key=attrgetter(_calls),
+                       reverse=True):
+      if site.filename is None:
+        where = "other call sites"
+      else:
+        where = "%s:%d (%s)" % (site.filename, site.lineno, site.caller)
+      argtypes = ["%s: %s" % (argname or "return",
+                              "|".join(sorted([t.__name__ for t in counts])))
+                  for argname, counts in sorted(site.type_counts.items())]
+      lines.append("\n\tcalled from %s x%d" % (where, site.calls))
+      if argtypes:
+        lines.append(": %s" % ", ".join(argtypes))
+    return "".join(lines)
+
+  def _strexceptions(f):
+    return "".join(["\n\traises %s x%d" % (exctype.__name__, count)
+                    for exctype, count in sorted(f.exceptions.items(),
+                                                 key=lambda item: -item[1])])
+
+  def _strlatency(f):
+    if f.latency is None:
+      return ""
+    lines = ["\n\tcalls: %d, seconds p50 <= %.3g, p90 <= %.3g, p99 <= %.3g" % (
+        f.calls, f.latency.quantile(0.5), f.latency.quantile(0.9),
+        f.latency.quantile(0.99))]
+    for signature, histogram in sorted(f.latency_by_signature.items(),
+                                       key=lambda item: -item[1].count):
+      lines.append("\n\t\t(%s) x%d: mean %.3g, p50 <= %.3g" % (
+          ", ".join([t.__name__ for t in signature]), histogram.count,
+          histogram.mean(), histogram.quantile(0.5)))
+    return "".join(lines)
+
+  # Print stuff. Methods are grouped by class within each file.
+  samples.sort(key=lambda f: (f.filename, f.classname or "", f.lineno))
   for f in samples:
 
     if onlycompleted and f.key not in inactive:
@@ -106,26 +199,32 @@ def pretty_print_types(stream=sys.stdout, onlycompleted=False, repeat=False):
     if not repeat and not _progress(f):
       continue
 
-    strsig = [""]*(len(f.args) + 1)
     returnarg, returntype = f.get_return()
-    strsig[0] = "\n\n%s:%d@%d\n%s returns %s%s" % (
+    funcname = f.funcname
+    if f.classname is not None:
+      funcname = "%s.%s" % (f.classname, funcname)
+    strsig = ["\n\n%s:%d@%d\n%s returns %s%s" % (
         f.filename, f.lineno, id(pretty_print_types.num_samples),
-        f.funcname, returntype.__name__,
-        _strunion(returnarg, returntype))
+        funcname, returntype.__name__,
+        _strunion(returnarg, returntype))]
 
+    params = []
+    if f.receivers:
+      receivertype = f.get_receiver_type()
+      params.append((0, "\n\t(0) %s : %s\t (#/calls: %d)" % (
+          f.receiver, receivertype.__name__, sum(f.receivers.values()))))
     for arg, (i, v) in [(arg, f.signature[arg.argname]) for arg in f.args.values()]:
       if i == -1:
         continue
-      try:
-        unique_ct = len(set(arg.samples))
-      except TypeError:
-        unique_ct = -1
-      except AttributeError:
-        # TODO(etosch): This is a hack to run okay for LGeoInfo
-        unique_ct = -2
-      strsig[i+1] = "\n\t(%d) %s : %s\t (#/samples: %d, #/distinct: %d)%s" % (
-          i, arg.argname, v.__name__, len(arg.samples), unique_ct,
-          _strunion(arg, v))
+      # Samples counted, including those compacted or restored.
+      params.append((i, "\n\t(%d) %s : %s\t (#/samples: %d, #/distinct: %d)%s"
+                     % (i, arg.argname, v.__name__, arg.counted,
+                        arg.num_distinct(), _strunion(arg, v))))
+    strsig.extend([line for _, line in sorted(params)])
+    strsig.append(_strsignatures(f))
+    strsig.append(_strexceptions(f))
+    strsig.append(_strlatency(f))
+    strsig.append(_strcallsites(f))
     stream.write("".join(strsig))
     stream.flush()
 
@@ -135,7 +234,22 @@ def _protoize(samples):
   pass
 
 
-def _jsonize(container, filename, lineno, funcname, argname, argtype, typeprob, functionmem):
+def _jsonarg(argname, argtype, typeprob, typecount, argstats):
+  arg = {
+      _name: argname,
+      _types: [{
+          _name: argtype,
+          _empirical_probability: typeprob,
+          _count: typecount
+          }]
+      }
+  if argstats:
+    arg[_statistics] = argstats
+  return arg
+
+
+def _jsonize(container, filename, lineno, funcname, argname, argtype, typeprob,
+             typecount, functionmem, argstats=None):
   # Wanted to use ValueCollectionDict here, but that doesn't work with the
   # schema.
   module = [m for m in container if m[_filename] == filename]
@@ -146,36 +260,27 @@ def _jsonize(container, filename, lineno, funcname, argname, argtype, typeprob,
   arg = fn and [a for a in fn[0][_arguments] if a[_name] == argname]
   tt = arg and [t for t in arg[0][_types] if t[_name] == argtype]
   if tt:
-    # Just replace type probability.
+    # Just replace type probability and count.
     tt[0][_empirical_probability] = typeprob
+    tt[0][_count] = typecount
   elif arg:
     # If the type wasn't found, add it.
     arg[0][_types].append({
         _name: argtype,
-        _empirical_probability: typeprob
+        _empirical_probability: typeprob,
+        _count: typecount
         })
   elif fn:
     # If the argument wasn't found, add it.
-    fn[0][_arguments].append({
-        _name: argname,
-        _id: functionmem,
-        _types: [{
-            _name: argtype,
-            _empirical_probability: typeprob
-            }]
-        })
+    newarg = _jsonarg(argname, argtype, typeprob, typecount, argstats)
+    newarg[_id] = functionmem
+    fn[0][_arguments].append(newarg)
   elif module:
     # If the function wasn't found, add it.
     module[0][_functions].append({
         _lineno: lineno,
         _name: funcname,
-        _arguments: [{
-            _name: argname,
-            _types: [{
-                _name: argtype,
-                _empirical_probability: typeprob
-                }]
-            }]
+        _arguments: [_jsonarg(argname, argtype, typeprob, typecount, argstats)]
         })
   else:
     # If the module wasn't found, add it.
@@ -184,22 +289,92 @@ def _jsonize(container, filename, lineno, funcname, argname, argtype, typeprob,
         _functions: [{
             _lineno: lineno,
             _name: funcname,
-            _arguments: [{
-                _name: argname,
-                _types: [{
-                    _name: argtype,
-                    _empirical_probability: typeprob
-                    }]
-                }]
+            _arguments: [_jsonarg(argname, argtype, typeprob, typecount,
+                                  argstats)]
             }]
         })
 
 
-def _tuplize(container, filename, lineno, funcname, argname, argtype, typeprob, functionmem):
-  container.append((filename, lineno, funcname, argname, argtype, typeprob, functionmem))
+def _jsonfn(container, filename, lineno, funcname, create=False):
+  # Returns the entry _jsonize made for the function. There is none if no
+  # argument has a type (e.g. a function without parameters that always
+  # raised); with create, an entry without arguments is added, else None.
+  module = None
+  for m in container:
+    if m[_filename] == filename:
+      module = m
+      for fn in m[_functions]:
+        if fn[_lineno] == lineno:
+          return fn
+  if not create:
+    return None
+  fn = {_lineno: lineno, _name: funcname, _arguments: []}
+  if module is None:
+    container.append({_filename: filename, _functions: [fn]})
+  else:
+    module[_functions].append(fn)
+  return fn
+
+
+def _jsonlatency(func):
+  fn = {_calls: func.calls}
+  if func.latency is not None:
+    fn[_latency] = func.latency.to_dict()
+  if func.latency_by_signature:
+    fn[_latency_by_signature] = [{
+        _signature: [t.__name__ for t in signature],
+        _latency: histogram.to_dict()
+        } for signature, histogram in func.latency_by_signature.items()]
+  return fn
+
+
+def _typenames(argtypes):
+  if argtypes is None:
+    return None
+  return [t.__name__ for t in argtypes]
+
 
+def _jsonsignatures(func):
+  return [{
+      _arguments: _typenames(argtypes),
+      _return: returntype and returntype.__name__,
+      _count: count
+      } for argtypes, returntype, count in func.get_signatures()]
 
-def serialize(fmt=_table):
+
+def _jsonexceptions(func):
+  fn = {_exceptions: [{_name: exctype.__name__, _count: count}
+                      for exctype, count in func.exceptions.items()]}
+  if func.exceptions_by_signature:
+    fn[_exceptions_by_signature] = [{
+        _arguments: _typenames(key and key[0]),
+        _name: key and key[1].__name__,
+        _count: count
+        } for key, count in func.exceptions_by_signature.items()]
+  return fn
+
+
+def _jsoncallsites(callsites):
+  return [{
+      _filename: site.filename,
+      _lineno: site.lineno,
+      _caller: site.caller,
+      _calls: site.calls,
+      _arguments: [{
+          _name: argname,
+          _types: [{_name: t.__name__, _count: count}
+                   for t, count in counts.items()]
+          } for argname, counts in site.type_counts.items()]
+      } for site in callsites.values()]
+
+
+def _tuplize(container, filename, lineno, funcname, argname, argtype, typeprob,
+             typecount, functionmem):
+  container.append((filename, lineno, funcname, argname, argtype, typeprob,
+                    functionmem, typecount))
+
+
+def serialize(fmt=_table, since=None, cached=True):
   """Serializes type information for use elsewhere (e.g., an IDE)."""
   # """
   # Serializes type information for use elsewhere (e.g., an IDE).
@@ -224,33 +399,65 @@ def serialize(fmt=_table):
 
   # :param samples: A dictionary of samples, defined using the `FunctionRef`.
   # :param fmt: One of "table", "proto",  or "json".
+  # :param since: If given, only functions whose FunctionRef.generation is
+  # greater, i.e. that changed after FunctionRef.generation was `since`.
+  # :param cached: If false, types are inferred without reading or filling
+  # the ArgRef caches (see ArgRef.get_type_counts), for other threads.
   # :return: A list of tuples.
   # """
   if not hasattr(serialize, "headers"):
     serialize.headers = ((_filename, str), (_lineno, int), ("funcname", str),
                          ("argname", str), ("argtype", str), ("typeprob", float),
-                         ("id", int))
+                         ("id", int), (_count, int))
   # Make some container that we can pass as a reference
   generic_return_value = []
   samples = FunctionRef.all_fns
   for filename, innerdict in samples.items():
     for lineno, func in innerdict.items():
+      if since is not None and func.generation <= since:
+        continue
       funcname = func.funcname
       functionmem = id(func)
-      for arg in func.args.values():
-        argname = arg.argname
-        argtypes = arg.get_type_prob()
-        for argtype, typeprob in argtypes.items():
+      # A method's receiver is reported like an argument, with the counts of
+      # its classes.
+      typecounts = [(arg.argname, arg.get_type_counts(cached),
+                     arg.get_statistics())
+                    for arg in func.args.values()]
+      if func.receivers:
+        typecounts.append((func.receiver, dict(func.receivers), {}))
+      for argname, argtypes, argstats in typecounts:
+        # Probabilities are fractions of the argument's samples, so they sum
+        # to 1 and come with the counts they were computed from.
+        n = float(sum(argtypes.values()))
+        for argtype, typecount in argtypes.items():
+          typeprob = typecount / n
           if fmt is _table:
             _tuplize(generic_return_value,
-                     filename, lineno, funcname, argname, argtype, typeprob, functionmem)
+                     filename, lineno, funcname, argname, argtype, typeprob,
+                     typecount, functionmem)
           elif fmt is _json:
             _jsonize(generic_return_value,
-                     filename, lineno, funcname, argname, argtype, typeprob, functionmem)
+                     filename, lineno, funcname, argname, argtype.__name__,
+                     typeprob, typecount, functionmem, argstats=argstats)
           elif fmt is _proto:
             assert False, "PROTO NOT YET IMPLEMENTED"
           else:
             raise Exception("Unknown serialization format: %s" % fmt)
+      # Functions are exported with no typed argument if they were called.
+      fn = fmt is _json and _jsonfn(
+          generic_return_value, filename, lineno, funcname,
+          create=bool(func.calls or func.exceptions or
+                      func.latency is not None))
+      if fn:
+        if func.classname is not None:
+          fn[_class] = func.classname
+        fn.update(_jsonlatency(func))
+        if func.signatures:
+          fn[_signatures] = _jsonsignatures(func)
+        if func.exceptions:
+          fn.update(_jsonexceptions(func))
+        if func.callsites:
+          fn[_callsites] = _jsoncallsites(func.callsites)
   return generic_return_value
 
 
@@ -0,0 +1,108 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Finds functions and arguments in the collected types."""
+# Queries are answered from indexes that classes keeps up to date as samples
+# arrive: FunctionRef.all_fns (by filename), FunctionRef.by_name, and
+# ArgRef.by_type and ArgRef.by_degree (by concrete type name and by number of
+# distinct concrete types). Types here are those of type(), e.g. "list"
+# rather than "List of ( int )", so no types are inferred to answer a query.
+from classes import ArgRef
+from classes import FunctionRef
+
+
+def rebuild():
+  """Recomputes the indexes from FunctionRef.all_fns, e.g. once replaced."""
+  FunctionRef.by_name.clear()
+  ArgRef.by_type.clear()
+  ArgRef.by_degree.clear()
+  for fns in FunctionRef.all_fns.values():
+    for fn in fns.values():
+      FunctionRef.by_name[fn.funcname] = fn
+      for arg in fn.args.values():
+        for sample_type in arg.type_counts:
+          ArgRef.by_type[sample_type.__name__] = arg
+        if arg.type_counts:
+          ArgRef.by_degree[len(arg.type_counts)] = arg
+
+
+def _intersect(candidates, matches):
+  if candidates is None:
+    return set(matches)
+  return candidates.intersection(matches)
+
+
+def _in_files(filename):
+  # Functions in files whose name starts with filename, so a directory
+  # matches everything under it.
+  fns = set()
+  for name, innerdict in FunctionRef.all_fns.items():
+    if name.startswith(filename):
+      fns.update(innerdict.values())
+  return fns
+
+
+def arguments(typename=None, mindegree=None, filename=None, funcname=None,
+              returns=False):
+  """Returns the set of ArgRefs that match all of the given criteria.
+
+  typename: the name of a type the argument has been seen with.
+  mindegree: the least number of distinct types it has been seen with.
+  filename, funcname: see functions.
+  returns: if True, return values are searched instead of parameters.
+  """
+  candidates = None
+  if typename is not None:
+    candidates = _intersect(candidates, ArgRef.by_type.get(typename, ()))
+  if mindegree is not None:
+    polymorphic = set()
+    for degree, args in ArgRef.by_degree.items():
+      if degree >= mindegree:
+        polymorphic.update(args)
+    candidates = _intersect(candidates, polymorphic)
+  if candidates is None or filename is not None or funcname is not None:
+    fns = functions(filename=filename, name=funcname)
+    candidates = _intersect(
+        candidates, [arg for fn in fns for arg in fn.args.values()])
+  return set([arg for arg in candidates if (arg.position == -1) == returns])
+
+
+def functions(filename=None, name=None, argtype=None, returns=None,
+              mindegree=None):
+  """Returns the set of FunctionRefs that match all of the given criteria.
+
+  filename: a prefix of the function's filename.
+  name: the function's name.
+  argtype: the name of a type some parameter has been seen with.
+  returns: the name of a type the return value has been seen with, e.g.
+    "NoneType" for the functions that have returned None.
+  mindegree: the least number of distinct types some parameter has been
+    seen with; 2 finds the functions with a Union parameter.
+  """
+  candidates = None
+  if name is not None:
+    candidates = _intersect(candidates, FunctionRef.by_name.get(name, ()))
+  if argtype is not None:
+    candidates = _intersect(
+        candidates, [arg.owner for arg in arguments(typename=argtype)])
+  if mindegree is not None:
+    candidates = _intersect(
+        candidates, [arg.owner for arg in arguments(mindegree=mindegree)])
+  if returns is not None:
+    candidates = _intersect(
+        candidates,
+        [arg.owner for arg in arguments(typename=returns, returns=True)])
+  if filename is not None or candidates is None:
+    if filename is None:
+      filename = ""
+    candidates = _intersect(candidates, _in_files(filename))
+  return candidates
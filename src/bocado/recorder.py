@@ -0,0 +1,285 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Logs sampled calls, and replays the logs into the profile offline."""
+# A log is a series of files prefix.00000, prefix.00001, ... Each starts with
+# a marshalled version number, followed by marshalled lists of records:
+#
+#   (_FUNCTION, key, filename, lineno, funcname, module, classname, names,
+#    kinds)        the first time a function appears in the file,
+#   (_CALL, key, fingerprints)  a sampled call, one fingerprint per parameter,
+#   (_RETURN, key, fingerprint) its return value.
+#
+# A fingerprint is (typeref, code, valuehash): the (module, name) of the
+# value's type(), its shallow code (see _code) and its sketches.value_hash.
+# A receiver's fingerprint is its class's typeref, with code None. Values
+# are fingerprinted when sampled, at a cost bounded however large they are;
+# their tags (see classes.count_instances) are only worked out on replay.
+#
+# Each file defines every function it mentions, so files are replayed
+# independently, in parallel worker processes.
+import itertools
+import marshal
+import os
+import sys
+
+import classes
+import sketches
+import snapshot
+import value_sampler
+
+_version = 2
+_FUNCTION, _CALL, _RETURN = range(3)
+# Stand-ins for recorded types that cannot be imported where the log is
+# replayed; see _type.
+_placeholders = {}
+
+
+def _code(value, depth=0):
+  # The code snapshot._code gives the value's tag, from type()s alone: a
+  # list or tuple has the distinct codes of its first
+  # classes.fingerprint_maxitems elements, down to sketches._maxdepth
+  # levels; anything else, including a deeper list or tuple, is its type().
+  value_type = type(value)
+  if ((value_type is list or value_type is tuple) and
+      depth < sketches._maxdepth):
+    codes = []
+    for element in itertools.islice(value, classes.fingerprint_maxitems):
+      code = _code(element, depth + 1)
+      if code not in codes:
+        codes.append(code)
+    return ("l" if value_type is list else "t", tuple(codes))
+  return ("c", snapshot._typeref(value_type))
+
+
+class Recorder(object):
+  """Appends sampled calls to a rotating log; see value_sampler.set_recorder.
+
+  Records are buffered and written buffersize at a time. Once a file grows
+  past maxbytes, the log moves on to the next one; with maxfiles, only the
+  newest maxfiles files are kept.
+  """
+
+  def __init__(self, prefix, maxbytes=64 << 20, maxfiles=None,
+               buffersize=4096):
+    self.prefix = prefix
+    self.maxbytes = maxbytes
+    self.maxfiles = maxfiles
+    self.buffersize = buffersize
+    self.index = -1
+    self.records = []
+    self._file = None
+    self._rotate()
+
+  def filename(self, index):
+    return "%s.%05d" % (self.prefix, index)
+
+  def _rotate(self):
+    if self._file is not None:
+      self._file.close()
+    self.index += 1
+    self._file = open(self.filename(self.index), "wb")
+    marshal.dump(_version, self._file)
+    # Functions defined in the current file.
+    self._known = set()
+    if self.maxfiles and self.index >= self.maxfiles:
+      expired = self.filename(self.index - self.maxfiles)
+      if os.path.exists(expired):
+        os.remove(expired)
+
+  def _fingerprint(self, value):
+    return (snapshot._typeref(type(value)), _code(value),
+            sketches.value_hash(value))
+
+  def record_call(self, frame, fn, parameters, values):
+    names, kinds = parameters
+    if fn.key not in self._known:
+      self._known.add(fn.key)
+      self.records.append(
+          (_FUNCTION, fn.key, fn.filename, fn.lineno, fn.funcname,
+           frame.f_globals.get("__name__") or "", fn.classname, names, kinds))
+    fingerprints = []
+    for kind, value in zip(kinds, values):
+      if kind is classes.RECEIVER:
+        fingerprints.append(
+            (snapshot._typeref(value_sampler._receiver_class(value)), None,
+             0))
+      else:
+        fingerprints.append(self._fingerprint(value))
+    self.records.append((_CALL, fn.key, tuple(fingerprints)))
+    if len(self.records) >= self.buffersize:
+      self.flush()
+
+  def record_return(self, fn, value):
+    self.records.append((_RETURN, fn.key, self._fingerprint(value)))
+    if len(self.records) >= self.buffersize:
+      self.flush()
+
+  def flush(self):
+    """Writes the buffered records."""
+    records, self.records = self.records, []
+    if records:
+      marshal.dump(records, self._file)
+      self._file.flush()
+    if self._file.tell() >= self.maxbytes:
+      self._rotate()
+
+  def close(self):
+    self.flush()
+    self._file.close()
+
+# class Recorder
+
+
+def _read(filename):
+  with open(filename, "rb") as f:
+    version = marshal.load(f)
+    if version != _version:
+      raise Exception("Unknown log version: %s" % version)
+    while True:
+      try:
+        records = marshal.load(f)
+      except (EOFError, ValueError, TypeError):
+        # The end of the file, or records cut short by a crash.
+        return
+      for record in records:
+        yield record
+
+
+def _selected(include, exclude, filename, module, funcname):
+  matches = lambda rule: value_sampler._matches(rule, filename, module,
+                                                funcname)
+  return ((not include or any(map(matches, include))) and
+          not any(map(matches, exclude)))
+
+
+def _count(args, position, fingerprint):
+  typeref, code, valuehash = fingerprint
+  if position not in args:
+    args[position] = ({}, sketches.HyperLogLog())
+  counts, distinct = args[position]
+  counts[typeref, code] = counts.get((typeref, code), 0) + 1
+  if code is not None:
+    distinct.add_hash(valuehash)
+
+
+def _summarize(job):
+  # Counts one file's fingerprints per function and parameter, as
+  # key |-> [function record, calls, position |-> (counts, distinct)]. The
+  # return value has position -1.
+  filename, include, exclude = job
+  summary = {}
+  for record in _read(filename):
+    kind, key = record[:2]
+    if kind == _FUNCTION:
+      fnfilename, _, funcname, module = record[2:6]
+      if (key not in summary and
+          _selected(include, exclude, fnfilename, module, funcname)):
+        summary[key] = [record[2:], 0, {}]
+      continue
+    entry = summary.get(key)
+    if entry is None:
+      # Filtered out, or a return from a call logged in the previous file.
+      continue
+    if kind == _CALL:
+      entry[1] += 1
+      for position, fingerprint in enumerate(record[2]):
+        _count(entry[2], position, fingerprint)
+    else:
+      _count(entry[2], -1, record[2])
+  return summary
+
+
+def _merge(summary, other):
+  for key, (function, calls, args) in other.items():
+    if key not in summary:
+      summary[key] = [function, 0, {}]
+    entry = summary[key]
+    entry[1] += calls
+    for position, (counts, distinct) in args.items():
+      if position not in entry[2]:
+        entry[2][position] = ({}, sketches.HyperLogLog())
+      merged_counts, merged_distinct = entry[2][position]
+      for fingerprint, count in counts.items():
+        merged_counts[fingerprint] = merged_counts.get(fingerprint, 0) + count
+      merged_distinct.merge(distinct)
+  return summary
+
+
+def _type(typeref):
+  # Recorded types are looked up as snapshot.resolve does. Types that are not
+  # importable here get a placeholder class of the same module and name.
+  t = snapshot._resolve_type(*typeref)
+  if t is None:
+    t = _placeholders.get(typeref)
+    if t is None:
+      module, name = typeref
+      t = _placeholders[typeref] = type(name, (object,), {"__module__": module})
+  return t
+
+
+def _apply(summary):
+  # Adds the counts to the profile as compacted samples (see ArgRef.compact).
+  for function, calls, args in summary.values():
+    fnfilename, lineno, funcname, _, classname, names, kinds = function
+    fn = classes.FunctionRef(fnfilename, lineno, funcname)
+    if classname is not None:
+      fn.classname = classname
+    fn.calls += calls
+    for position, (counts, distinct) in args.items():
+      if position == -1:
+        argname, kind = "", None
+      else:
+        argname, kind = names[position], kinds[position]
+      if kind == classes.RECEIVER:
+        for (typeref, _), count in counts.items():
+          fn.add_receiver(argname, _type(typeref), count)
+        continue
+      arg = classes.ArgRef(fn, argname, position, kind)
+      for (typeref, code), count in counts.items():
+        tag = snapshot._tag(code, _type)
+        arg.compacted[tag] = arg.compacted.get(tag, 0) + count
+        arg.add_type_count(_type(typeref), count)
+      # The profile's sketch is coarser if the argument was compacted.
+      arg.distinct.merge(distinct.fold(arg.distinct.precision))
+
+
+def _untrace():
+  sys.settrace(None)
+
+
+def replay(filenames, include=(), exclude=(), processes=None):
+  """Adds the calls logged in filenames to the profile.
+
+  include and exclude are value_sampler.set_filters rules, applied to the
+  logged functions. Files are read by `processes` worker processes (default:
+  one per CPU; 1 reads them in this process), which count the fingerprints;
+  only the counts are added to the profile here. Returns the number of
+  functions replayed.
+  """
+  jobs = [(filename, tuple(include), tuple(exclude))
+          for filename in filenames]
+  summary = {}
+  if processes == 1 or len(jobs) < 2:
+    for job in jobs:
+      _merge(summary, _summarize(job))
+  else:
+    import multiprocessing
+    pool = multiprocessing.Pool(processes, initializer=_untrace)
+    try:
+      for other in pool.imap_unordered(_summarize, jobs):
+        _merge(summary, other)
+    finally:
+      pool.close()
+      pool.join()
+  _apply(summary)
+  return len(summary)
@@ -0,0 +1,159 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Serves the live profile over HTTP, on a local port or a Unix socket."""
+# Paths:
+#
+#   /json, /csv    the profile, as output.print_json and print_csv write it.
+#                  With ?since=N, only the functions that changed after
+#                  FunctionRef.generation was N. Every response carries the
+#                  current generation in its X-Bocado-Generation header, to
+#                  pass as `since` next time.
+#   /stats         value_sampler.get_stats(), as json.
+#   /proto         501; serialize has no proto format yet.
+#
+# e.g. curl localhost:8700/json, or
+# curl --unix-socket /tmp/bocado.sock http://localhost/json?since=1234.
+#
+# The server takes no locks. The tracer keeps running in the other threads
+# while a profile is serialized, so the exporters only iterate over lists
+# and dicts copied from the sampler's (items(), values() and dict()), which
+# the interpreter makes without switching threads, and infer types from
+# copies without touching the ArgRef caches the tracer resets (cached=False).
+# A function that changes while a delta is being written has a generation
+# above the one reported, so the next delta includes it again.
+import BaseHTTPServer
+import cStringIO
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+import urlparse
+
+import classes
+import output
+import value_sampler
+
+generation_header = "X-Bocado-Generation"
+_server = None
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    path, _, query = self.path.partition("?")
+    if path == "/proto":
+      self.send_error(501, "The proto format is not implemented")
+      return
+    if path not in ("/json", "/csv", "/stats"):
+      self.send_error(404)
+      return
+    try:
+      since = urlparse.parse_qs(query).get("since")
+      since = since and int(since[0])
+    except ValueError:
+      self.send_error(400, "since must be a generation number")
+      return
+    # Read first, so nothing that changes from here on is missed by a delta.
+    generation = classes.FunctionRef.generation
+    body = cStringIO.StringIO()
+    if path == "/json":
+      contenttype = "application/json"
+      output.print_json(stream=body, since=since, cached=False)
+    elif path == "/csv":
+      contenttype = "text/csv"
+      output.print_csv(stream=body, since=since, cached=False)
+    else:
+      contenttype = "application/json"
+      json.dump(value_sampler.get_stats(), body)
+      body.write("\n")
+    body = body.getvalue()
+    self.send_response(200)
+    self.send_header("Content-Type", contenttype)
+    self.send_header("Content-Length", str(len(body)))
+    self.send_header(generation_header, str(generation))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def address_string(self):
+    # Unix socket peers have no address.
+    return self.client_address and self.client_address[0] or "unix"
+
+  def log_message(self, *unused):
+    # Requests are not logged to the traced program's stderr.
+    pass
+
+
+class _UnixHTTPServer(BaseHTTPServer.HTTPServer):
+
+  address_family = socket.AF_UNIX
+
+  def server_bind(self):
+    # HTTPServer.server_bind expects a (host, port) address.
+    BaseHTTPServer.SocketServer.TCPServer.server_bind(self)
+    self.server_name = "localhost"
+    self.server_port = 0
+
+  def server_close(self):
+    BaseHTTPServer.HTTPServer.server_close(self)
+    os.remove(self.server_address)
+
+
+def _serve(server):
+  # Nothing this thread runs is sampled, even under threading.settrace.
+  sys.settrace(None)
+  server.serve_forever()
+
+
+def start(address=("127.0.0.1", 0)):
+  """Starts serving the profile from a daemon thread; returns the server.
+
+  address is a (host, port) pair, or the path of a Unix socket to create.
+  Port 0 picks a free port; the one bound is in the server's server_address.
+  """
+  global _server
+  if _server is not None:
+    raise Exception("Already serving on %s" % (_server.server_address,))
+  if isinstance(address, basestring):
+    # A socket left behind by an earlier process is replaced; anything else
+    # at that path is not.
+    if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+      os.remove(address)
+    server = _UnixHTTPServer(address, _Handler)
+  else:
+    server = BaseHTTPServer.HTTPServer(address, _Handler)
+  thread = threading.Thread(target=_serve, args=(server,),
+                            name="bocado-server")
+  thread.daemon = True
+  thread.start()
+  _server = server
+  return server
+
+
+def stop():
+  """Stops the server started by start, if any."""
+  global _server
+  if _server is None:
+    return
+  _server.shutdown()
+  _server.server_close()
+  _server = None
+
+
+def parse_address(address):
+  """Parses "PORT", "HOST:PORT" or a Unix socket path into a start address."""
+  if os.sep in address:
+    return address
+  host, _, port = address.rpartition(":")
+  return (host or "127.0.0.1", int(port))
@@ -0,0 +1,377 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Constant-memory summaries of sampled values."""
+
+import itertools
+import math
+import struct
+import sys
+
+_mask64 = (1 << 64) - 1
+# Sizes of a reference, and of the 64-bit hashes and floats sketches hold,
+# for the nbytes estimates.
+_refbytes = struct.calcsize("P")
+_hashbytes = sys.getsizeof(_mask64) + _refbytes
+_floatbytes = sys.getsizeof(0.0) + _refbytes
+# How far value_hash looks into unhashable containers.
+_maxitems = 16
+_maxdepth = 3
+
+
+def _mix(h):
+  # splitmix64 finalizer: spreads Python's hash (which is the identity for
+  # small ints) over all 64 bits.
+  h &= _mask64
+  h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & _mask64
+  h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & _mask64
+  return h ^ (h >> 31)
+
+
+def value_hash(value, depth=0):
+  """Returns a hash of value, falling back to its contents if unhashable."""
+  # value_hash runs in the tracer, so no exception from a value's __hash__
+  # may reach the traced program: those of values that fail to hash for any
+  # other reason (e.g. unloaded proxies) are hashed by identity.
+  try:
+    return hash(value)
+  except TypeError:
+    pass
+  except Exception:
+    return hash((type(value).__name__, id(value)))
+  # Unhashable values are fingerprinted by type, length and (a bounded prefix
+  # of) their contents, so equal containers usually hash equally.
+  cls = type(value)
+  if depth < _maxdepth:
+    if isinstance(value, (list, tuple)):
+      return hash((cls.__name__, len(value),
+                   tuple([value_hash(item, depth + 1)
+                          for item in value[:_maxitems]])))
+    elif isinstance(value, dict):
+      # Items are combined with xor so iteration order does not matter.
+      h = 0
+      for k, v in itertools.islice(value.iteritems(), _maxitems):
+        h ^= hash((value_hash(k, depth + 1), value_hash(v, depth + 1)))
+      return hash((cls.__name__, len(value), h))
+    elif isinstance(value, (set, frozenset)):
+      h = 0
+      for item in itertools.islice(value, _maxitems):
+        h ^= value_hash(item, depth + 1)
+      return hash((cls.__name__, len(value), h))
+  return hash((cls.__name__, id(value)))
+
+
+class HyperLogLog(object):
+  """Streaming estimate of the number of distinct values observed."""
+  # Standard HyperLogLog over 64-bit hashes: the top `precision` bits pick a
+  # register, which keeps the longest run of leading zeros seen in the
+  # remaining bits. Relative error is about 1.04 / sqrt(2 ** precision).
+  # Until more than `sparse` distinct values are seen, the sketch only keeps
+  # their (mixed) hashes, in `hashes`, and counts them exactly; the
+  # 2 ** precision registers are allocated when it outgrows that.
+
+  def __init__(self, precision=10, registers=None, sparse=16):
+    self.precision = precision
+    self.size = 1 << precision
+    self.sparse = sparse
+    self.hashes = None
+    if registers is None:
+      self.registers = None
+      self.hashes = []
+    elif len(registers) == self.size:
+      self.registers = bytearray(registers)
+    else:
+      raise Exception("Expected %d registers for precision %d, got %d." %
+                      (self.size, precision, len(registers)))
+
+  def add(self, value):
+    self.add_hash(value_hash(value))
+
+  def add_hash(self, h):
+    """Adds a value, given its Python hash."""
+    self._insert(_mix(h))
+
+  def _insert(self, h):
+    hashes = self.hashes
+    if hashes is not None:
+      if h not in hashes:
+        hashes.append(h)
+        if len(hashes) > self.sparse:
+          self._densify()
+      return
+    width = 64 - self.precision
+    index = h >> width
+    rank = width - (h & ((1 << width) - 1)).bit_length() + 1
+    if rank > self.registers[index]:
+      self.registers[index] = rank
+
+  def _densify(self):
+    hashes = self.hashes
+    self.hashes = None
+    self.registers = bytearray(self.size)
+    for h in hashes:
+      self._insert(h)
+
+  def fold(self, precision):
+    """Lowers this sketch's precision to precision, in place, to save space."""
+    # An old register's extra index bits lead the rest of the hash at the
+    # lower precision: if any is set, they alone give the rank.
+    if precision >= self.precision:
+      return self
+    shift = self.precision - precision
+    old, self.precision, self.size = self.registers, precision, 1 << precision
+    if old is None:
+      # Sparse hashes are the same at any precision.
+      return self
+    self.registers = bytearray(self.size)
+    for index, rank in enumerate(old):
+      if rank:
+        low = index & ((1 << shift) - 1)
+        rank = shift - low.bit_length() + 1 if low else rank + shift
+        if rank > self.registers[index >> shift]:
+          self.registers[index >> shift] = rank
+    return self
+
+  def nbytes(self):
+    """Estimates the memory held by the sketch's hashes or registers."""
+    if self.hashes is not None:
+      return sys.getsizeof(self.hashes) + len(self.hashes) * _hashbytes
+    return sys.getsizeof(self.registers)
+
+  def merge(self, other):
+    """Folds another sketch of the same precision into this one."""
+    if other.precision != self.precision:
+      raise Exception("Cannot merge HyperLogLog sketches of precision %d "
+                      "and %d." % (self.precision, other.precision))
+    if other.hashes is not None:
+      for h in other.hashes:
+        self._insert(h)
+      return self
+    if self.hashes is not None:
+      self._densify()
+    registers = self.registers
+    for i, rank in enumerate(other.registers):
+      if rank > registers[i]:
+        registers[i] = rank
+    return self
+
+  def cardinality(self):
+    if self.hashes is not None:
+      return float(len(self.hashes))
+    m = float(self.size)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / sum([2.0 ** -r for r in self.registers])
+    zeros = self.registers.count("\x00")
+    if estimate <= 2.5 * m and zeros:
+      # Small-range correction (linear counting).
+      return m * math.log(m / zeros)
+    return estimate
+
+  def __len__(self):
+    return int(round(self.cardinality()))
+
+# class HyperLogLog
+
+
+class KLL(object):
+  """Streaming quantile sketch (Karnin, Lang and Liberty, 2016)."""
+  # Level h holds items that each stand for 2 ** h observations. When the
+  # sketch is full, the lowest full level is sorted and every other item
+  # (starting at a random offset) is promoted to the level above.
+
+  def __init__(self, k=128, c=2.0 / 3.0):
+    self.k = k
+    self.c = c
+    self.compactors = []
+    self.size = 0
+    self.maxsize = 0
+    self._grow()
+
+  def _capacity(self, height):
+    depth = len(self.compactors) - height - 1
+    return int(math.ceil(self.c ** depth * self.k)) + 1
+
+  def _grow(self):
+    self.compactors.append([])
+    self.maxsize = sum([self._capacity(h)
+                        for h in range(len(self.compactors))])
+
+  def _compress(self):
+    # Imported here: random pulls in hashlib, which is slow to load at startup
+    # and only needed once a sketch fills up.
+    import random
+    for h in range(len(self.compactors)):
+      compactor = self.compactors[h]
+      if len(compactor) >= self._capacity(h):
+        if h + 1 >= len(self.compactors):
+          self._grow()
+        compactor.sort()
+        # Keep the odd item out at this level.
+        leftover = compactor[-1:] if len(compactor) % 2 else []
+        end = len(compactor) - len(leftover)
+        self.compactors[h + 1].extend(compactor[random.randint(0, 1):end:2])
+        self.compactors[h] = leftover
+        self.size = sum([len(c) for c in self.compactors])
+        if self.size < self.maxsize:
+          break
+
+  def add(self, value):
+    self.compactors[0].append(value)
+    self.size += 1
+    if self.size >= self.maxsize:
+      self._compress()
+
+  def merge(self, other):
+    while len(self.compactors) < len(other.compactors):
+      self._grow()
+    for h, compactor in enumerate(other.compactors):
+      self.compactors[h].extend(compactor)
+    self.size = sum([len(c) for c in self.compactors])
+    while self.size >= self.maxsize:
+      self._compress()
+    return self
+
+  def nbytes(self):
+    """Estimates the memory held by the sketch's items."""
+    return (sum([sys.getsizeof(c) for c in self.compactors]) +
+            self.size * _floatbytes)
+
+  def quantile(self, q):
+    """Returns the approximate q-quantile, or None if nothing was added."""
+    weighted = sorted([(item, 1 << h)
+                       for h, compactor in enumerate(self.compactors)
+                       for item in compactor])
+    if not weighted:
+      return None
+    target = q * sum([weight for _, weight in weighted])
+    cumulative = 0
+    for item, weight in weighted:
+      cumulative += weight
+      if cumulative >= target:
+        return item
+    return weighted[-1][0]
+
+# class KLL
+
+
+class ValueSummary(object):
+  """Count, range, mean, variance and quantiles of a numeric stream."""
+  # Mean and variance use Welford's online update.
+
+  quantiles = (0.5, 0.9, 0.99)
+
+  def __init__(self):
+    self.count = 0
+    self.min = None
+    self.max = None
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.sketch = KLL()
+
+  def add(self, x):
+    self.count += 1
+    if self.count == 1:
+      self.min = self.max = x
+    elif x < self.min:
+      self.min = x
+    elif x > self.max:
+      self.max = x
+    delta = x - self.mean
+    self.mean += delta / float(self.count)
+    self.m2 += delta * (x - self.mean)
+    self.sketch.add(x)
+
+  def nbytes(self):
+    return sys.getsizeof(self.__dict__) + self.sketch.nbytes()
+
+  def variance(self):
+    if self.count < 2:
+      return 0.0
+    return self.m2 / (self.count - 1)
+
+  def to_dict(self):
+    summary = {
+        "count": self.count,
+        "min": self.min,
+        "max": self.max,
+        "mean": self.mean,
+        "variance": self.variance()
+        }
+    for q in ValueSummary.quantiles:
+      summary["p%d" % int(q * 100)] = self.sketch.quantile(q)
+    return summary
+
+# class ValueSummary
+
+
+class LogHistogram(object):
+  """Histogram of positive values (e.g. durations) in power-of-two buckets."""
+  # Bucket e counts values in [2**(e-1), 2**e), so quantiles are reported as
+  # the upper bound of their bucket: within a factor of two, in constant
+  # memory. Values at or below 2**minexponent share the lowest bucket.
+
+  minexponent = -30
+
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    # exponent |-> count
+    self.buckets = {}
+
+  def add(self, x):
+    self.count += 1
+    self.total += x
+    if x > 0:
+      exponent = max(math.frexp(x)[1], LogHistogram.minexponent)
+    else:
+      exponent = LogHistogram.minexponent
+    self.buckets[exponent] = self.buckets.get(exponent, 0) + 1
+
+  def merge(self, other):
+    self.count += other.count
+    self.total += other.total
+    for exponent, count in other.buckets.items():
+      self.buckets[exponent] = self.buckets.get(exponent, 0) + count
+
+  def mean(self):
+    if not self.count:
+      return None
+    return self.total / self.count
+
+  def nbytes(self):
+    return sys.getsizeof(self.__dict__) + sys.getsizeof(self.buckets)
+
+  def quantile(self, q):
+    """Returns the upper bound of the bucket holding the q-quantile."""
+    if not self.count:
+      return None
+    rank = q * self.count
+    seen = 0
+    for exponent in sorted(self.buckets):
+      seen += self.buckets[exponent]
+      if seen >= rank:
+        return math.ldexp(1.0, exponent)
+    return math.ldexp(1.0, max(self.buckets))
+
+  def to_dict(self):
+    summary = {
+        "count": self.count,
+        "total": self.total,
+        "mean": self.mean(),
+        "buckets": [[math.ldexp(1.0, exponent), self.buckets[exponent]]
+                    for exponent in sorted(self.buckets)]
+        }
+    for q in ValueSummary.quantiles:
+      summary["p%d" % int(q * 100)] = self.quantile(q)
+    return summary
+
+# class LogHistogram
@@ -0,0 +1,167 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Saves and restores the sampler's state across restarts."""
+# A snapshot is a marshal of one record per sampled function: its filename,
+# line number and name, whether it was saturated (in value_sampler.inactive),
+# for each argument, its position and kind, the number of samples of each
+# concrete (type()) type and of each inferred type (see _code), and for
+# methods, the class name and the number of calls per receiver class (as an
+# argument of kind RECEIVER), and the number of sampled calls. Samples
+# themselves are not saved; restored arguments report the inferred types as
+# compacted samples (see ArgRef.compact). Types are saved by module and
+# name, and resolved when the function is next called; until then a restored
+# function is only a key in value_sampler.restored (and in inactive, if
+# saturated). Types that cannot be resolved then are dropped, so an argument
+# of that type reactivates sampling.
+import __builtin__
+import marshal
+import os
+import sys
+import types
+
+import classes
+import value_sampler
+
+_version = 4
+# Builtin types that are not builtins by name, e.g. NoneType and function.
+_builtin_types = dict([(t.__name__, t) for t in vars(types).values()
+                       if isinstance(t, type)])
+
+
+def _typeref(t):
+  return (getattr(t, "__module__", None) or "__builtin__", t.__name__)
+
+
+def _code(tag):
+  # A tag of classes.count_instances as plain data: ("l", element codes) for
+  # a list, ("t", element codes) for a tuple, and ("c", (module, name))
+  # for anything else.
+  if tag is classes.ParameterizedList.emptytype:
+    return ("l", ())
+  elif tag is classes.ParameterizedTuple.emptytype:
+    return ("t", ())
+  elif isinstance(tag, classes.ParameterizedList):
+    return ("l", tuple([_code(t) for t in tag.tags]))
+  elif isinstance(tag, classes.ParameterizedTuple):
+    return ("t", tuple([_code(t) for t in tag.tags]))
+  return ("c", _typeref(tag))
+
+
+def _tag(code, resolve=None):
+  # The tag _code encoded, or None if one of its types does not resolve.
+  # resolve maps a (module, name) to a type or None; by default, _resolve_type.
+  kind, contents = code
+  if kind == "c":
+    return (resolve or (lambda typeref: _resolve_type(*typeref)))(contents)
+  tags = []
+  for tag in [_tag(element, resolve) for element in contents]:
+    if tag is None:
+      return None
+    # Distinct saved types can resolve to the same one; tags must not repeat.
+    if tag not in tags:
+      tags.append(tag)
+  if kind == "l":
+    return classes.ParameterizedList(tags)
+  return classes.ParameterizedTuple(tags)
+
+
+def _counts(type_counts):
+  return [_typeref(t) + (count,) for t, count in type_counts.items()]
+
+
+def _record(fn):
+  args = [(arg.argname, arg.position, arg.kind, _counts(arg.type_counts),
+           [(_code(tag), count)
+            for tag, count in arg.get_type_counts().items()])
+          for arg in fn.args.values()]
+  if fn.receivers:
+    args.append((fn.receiver, 0, classes.RECEIVER, _counts(fn.receivers), []))
+  return (fn.filename, fn.lineno, fn.funcname, fn.key in value_sampler.inactive,
+          args, fn.classname, fn.calls)
+
+
+def save(filename):
+  """Writes the sampler's state to filename. Returns the number of functions."""
+  # Functions restored but not called since are saved as they were loaded.
+  records = dict(value_sampler.restored)
+  for fns in classes.FunctionRef.all_fns.values():
+    for fn in fns.values():
+      records[fn.key] = _record(fn)
+  # Written to a temporary file first, so a crash never leaves half a snapshot.
+  partial = filename + ".tmp"
+  with open(partial, "wb") as f:
+    marshal.dump((_version, records.values()), f)
+  os.rename(partial, filename)
+  return len(records)
+
+
+def restore(filename):
+  """Loads a snapshot written by save. Returns the number of functions.
+
+  Saturated functions go straight to value_sampler.inactive, so they are not
+  sampled again unless their argument types drift. Functions already known
+  to the sampler are left as they are.
+  """
+  with open(filename, "rb") as f:
+    version, records = marshal.load(f)
+  if version != _version:
+    raise Exception("Unknown snapshot version: %s" % version)
+  restored = 0
+  for record in records:
+    fnfilename, lineno, funcname, saturated = record[:4]
+    # As classes.FunctionRef.get_key.
+    key = hash((fnfilename, funcname, lineno))
+    if (key in value_sampler.active or key in value_sampler.inactive or
+        key in value_sampler.restored):
+      continue
+    value_sampler.restored[key] = record
+    if saturated:
+      value_sampler.inactive.add(key)
+    restored += 1
+  return restored
+
+
+def _resolve_type(module, name):
+  if module == "__builtin__":
+    t = getattr(__builtin__, name, None) or _builtin_types.get(name)
+  else:
+    t = getattr(sys.modules.get(module), name, None)
+  if isinstance(t, type):
+    return t
+  return None
+
+
+def resolve(key):
+  """Returns the FunctionRef for a restored function, with its type counts."""
+  fnfilename, lineno, funcname, _, args, classname, calls = (
+      value_sampler.restored.pop(key))
+  fn = classes.FunctionRef(fnfilename, lineno, funcname)
+  fn.classname = classname
+  fn.calls += calls
+  for argname, position, kind, counts, tag_counts in args:
+    if kind == classes.RECEIVER:
+      add = lambda t, count: fn.add_receiver(argname, t, count)
+    else:
+      arg = classes.ArgRef(fn, argname, position, kind)
+      add = arg.add_type_count
+      tags = [(_tag(code), count) for code, count in tag_counts]
+      # If an inferred type does not resolve, the argument reports the
+      # concrete types that do instead.
+      if None not in [tag for tag, _ in tags]:
+        for tag, count in tags:
+          arg.compacted[tag] = arg.compacted.get(tag, 0) + count
+    for module, name, count in counts:
+      t = _resolve_type(module, name)
+      if t is not None:
+        add(t, count)
+  return fn
@@ -0,0 +1,450 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Writes PEP 484 stubs and type comments from the sampled types."""
+# Generation runs in two steps. One pass over FunctionRef.all_fns, which is
+# already indexed by filename, renders every sampled type to a string in this
+# process (types are interned, so each is rendered once per file). Then, per
+# source file, a worker parses the source to recover defaults, *args, classes
+# and nesting, and writes the stub (or annotated copy). Workers only see
+# strings, so they can run in parallel processes.
+import __builtin__
+import ast
+import os
+import sys
+import tokenize
+import types
+
+from classes import FunctionRef
+from classes import ParameterizedDict
+from classes import ParameterizedList
+from classes import ParameterizedTuple
+from classes import TaggedUnion
+
+# Builtin types whose annotation is a generic from typing.
+_generics = {
+    dict: "Dict[Any, Any]",
+    list: "List[Any]",
+    set: "Set[Any]",
+    frozenset: "FrozenSet[Any]",
+    }
+# Decorators copied into stubs; others may change the signature.
+_decorators = frozenset(["staticmethod", "classmethod", "property"])
+
+
+class _Renderer(object):
+  """Renders sampled types as annotations for use in one source file."""
+
+  def __init__(self, filename, module_files):
+    self.filename = os.path.splitext(os.path.abspath(filename))[0]
+    # module name |-> source path without extension; see _module_files.
+    self.module_files = module_files
+    self.imports = set()
+    self.typing = set()
+    self.cache = {}
+
+  def union(self, tags):
+    names = sorted(set([self.render(tag) for tag in tags]))
+    if "Any" in names:
+      self.typing.add("Any")
+      return "Any"
+    if "None" in names and len(names) > 1:
+      names.remove("None")
+      self.typing.add("Optional")
+      return "Optional[%s]" % self.union_names(names)
+    return self.union_names(names)
+
+  def union_names(self, names):
+    if len(names) == 1:
+      return names[0]
+    self.typing.add("Union")
+    return "Union[%s]" % ", ".join(names)
+
+  def render(self, t):
+    try:
+      return self.cache[t]
+    except KeyError:
+      pass
+    annotation = self.cache[t] = self._render(t)
+    return annotation
+
+  def _render(self, t):
+    if t is types.NoneType:
+      return "None"
+    elif t is ParameterizedList.emptytype:
+      self.typing.update(["List", "Any"])
+      return "List[Any]"
+    elif t is ParameterizedTuple.emptytype:
+      self.typing.add("Tuple")
+      return "Tuple[()]"
+    elif t is ParameterizedDict.emptytype:
+      self.typing.update(["Dict", "Any"])
+      return "Dict[Any, Any]"
+    elif isinstance(t, TaggedUnion):
+      return self.union(t.tags)
+    elif isinstance(t, ParameterizedList):
+      self.typing.add("List")
+      return "List[%s]" % self.union(t.tags)
+    elif isinstance(t, ParameterizedTuple):
+      self.typing.add("Tuple")
+      return "Tuple[%s]" % ", ".join([self.render(tag) for tag in t.tags])
+    elif isinstance(t, ParameterizedDict):
+      self.typing.add("Dict")
+      return "Dict[%s, %s]" % (self.union(t.keytags), self.union(t.valuetags))
+    elif t in _generics:
+      annotation = _generics[t]
+      self.typing.update([annotation.split("[")[0], "Any"])
+      return annotation
+    module = getattr(t, "__module__", None)
+    name = getattr(t, "__name__", None)
+    if module == "__builtin__":
+      # Types like function and instance have no name to refer to them by.
+      if getattr(__builtin__, name, None) is t:
+        return name
+    elif module and name and t is not types.InstanceType:
+      if self.module_files.get(module) == self.filename:
+        return name
+      self.imports.add(module)
+      return "%s.%s" % (module, name)
+    self.typing.add("Any")
+    return "Any"
+
+  def element(self, t):
+    """Renders the type of each value in a *args tuple or **kwargs dict."""
+    if isinstance(t, ParameterizedTuple):
+      return self.union(t.tags)
+    self.typing.add("Any")
+    return "Any"
+
+  def header(self):
+    lines = ["# Generated by bocado from sampled types."]
+    if self.typing:
+      lines.append("from typing import %s" % ", ".join(sorted(self.typing)))
+    lines.extend(["import %s" % module for module in sorted(self.imports)])
+    return lines
+
+# class _Renderer
+
+
+def _module_files(main=None):
+  # module name |-> path of its source without extension, for loaded modules.
+  # main, if given, is the source of the program that ran as __main__, which
+  # sys.modules no longer has once runpy is done with it.
+  files = {}
+  for name, module in sys.modules.items():
+    filename = getattr(module, "__file__", None)
+    if filename:
+      files[name] = os.path.splitext(os.path.abspath(filename))[0]
+  if main is not None:
+    files["__main__"] = os.path.splitext(os.path.abspath(main))[0]
+  return files
+
+
+def _signature(renderer, fn):
+  # Returns a 2-tuple of (argname, annotation, element annotation) triples in
+  # argument order, and the return annotation. The element annotation is
+  # used if the argument turns out to be *args or **kwargs, and is only
+  # rendered for tuples and dicts. A generator returns an Iterator of the
+  # values it yields.
+  params = []
+  returns = None
+  for arg in fn.get_sorted_arg_list():
+    argtype = arg.get_type()
+    if arg.position == -1:
+      returns = renderer.render(argtype)
+      continue
+    element = None
+    if (isinstance(argtype, ParameterizedTuple) or argtype is dict or
+        argtype is ParameterizedTuple.emptytype):
+      element = renderer.element(argtype)
+    params.append((arg.argname, renderer.render(argtype), element))
+  if fn.generator:
+    renderer.typing.add("Iterator")
+    if returns is None:
+      renderer.typing.add("Any")
+      returns = "Any"
+    return params, "Iterator[%s]" % returns
+  return params, returns or "None"
+
+
+def _params(signature):
+  # argname |-> annotation, and argname |-> element annotation.
+  params = signature[0]
+  return (dict([(name, annotation) for name, annotation, _ in params]),
+          dict([(name, element) for name, _, element in params]))
+
+
+def type_comment(fn):
+  """Returns a PEP 484 type comment for a FunctionRef, e.g. (int) -> str."""
+  # Arguments are in the order they were sampled in.
+  renderer = _Renderer(fn.filename, _module_files())
+  params, returns = _signature(renderer, fn)
+  return "(%s) -> %s" % (", ".join([annotation for _, annotation, _ in params]),
+                         returns)
+
+
+def _decorator_name(node):
+  return node.id if isinstance(node, ast.Name) else None
+
+
+def _plain_args(node):
+  # Tuple parameters (def f((a, b)):) cannot be written in a stub.
+  return all([isinstance(arg, ast.Name) for arg in node.args.args])
+
+
+def _stub_def(node, signature, indent, method):
+  params, elements = _params(signature)
+  returns = signature[1]
+  args = node.args
+  parts = []
+  firstdefault = len(args.args) - len(args.defaults)
+  for i, arg in enumerate(args.args):
+    part = arg.id
+    # The receiver of a method is left to the type checker.
+    if arg.id in params and not (method and i == 0):
+      part = "%s: %s" % (part, params[arg.id])
+    if i >= firstdefault:
+      part += " = ..."
+    parts.append(part)
+  for prefix, name in (("*", args.vararg), ("**", args.kwarg)):
+    if name:
+      if elements.get(name):
+        parts.append("%s%s: %s" % (prefix, name, elements[name]))
+      else:
+        parts.append(prefix + name)
+  lines = ["%s@%s" % (indent, _decorator_name(d)) for d in node.decorator_list
+           if _decorator_name(d) in _decorators]
+  lines.append("%sdef %s(%s) -> %s: ..." % (indent, node.name, ", ".join(parts),
+                                            returns))
+  return lines
+
+
+def _base_name(node):
+  if isinstance(node, ast.Name):
+    return node.id
+  elif isinstance(node, ast.Attribute):
+    base = _base_name(node.value)
+    return base and "%s.%s" % (base, node.attr)
+  return None
+
+
+def _stub(source, signatures, names, header):
+  # signatures: lineno |-> signature; names: lineno |-> function name, used
+  # only without source. Nested functions have no place in a stub.
+  lines = list(header)
+  if source is None:
+    for lineno in sorted(signatures):
+      params, returns = signatures[lineno]
+      lines.append("def %s(%s) -> %s: ..." % (
+          names[lineno], ", ".join(["%s: %s" % (name, annotation)
+                                    for name, annotation, _ in params]),
+          returns))
+    return "\n".join(lines) + "\n"
+  for node in ast.parse(source).body:
+    if isinstance(node, ast.FunctionDef):
+      if node.lineno in signatures and _plain_args(node):
+        lines.append("")
+        lines.extend(_stub_def(node, signatures[node.lineno], "", False))
+    elif isinstance(node, ast.ClassDef):
+      methods = []
+      for child in node.body:
+        if (isinstance(child, ast.FunctionDef) and child.lineno in signatures
+            and _plain_args(child)):
+          static = "staticmethod" in map(_decorator_name, child.decorator_list)
+          methods.extend(_stub_def(child, signatures[child.lineno], "    ",
+                                   not static))
+      if methods:
+        bases = [_base_name(base) for base in node.bases]
+        bases = ", ".join([base for base in bases if base])
+        lines.append("")
+        lines.append("class %s%s:" % (node.name, bases and "(%s)" % bases))
+        lines.extend(methods)
+  return "\n".join(lines) + "\n"
+
+
+def _header_end(lines, lineno):
+  # Returns the 1-based line of the colon ending the def header at lineno.
+  readline = iter(lines[lineno - 1:]).next
+  depth = 0
+  seen_def = False
+  try:
+    for tok_type, tok, (row, _), _, _ in tokenize.generate_tokens(readline):
+      if tok_type == tokenize.NAME and tok == "def":
+        seen_def = True
+      elif tok_type == tokenize.OP and seen_def:
+        if tok in "([{":
+          depth += 1
+        elif tok in ")]}":
+          depth -= 1
+        elif tok == ":" and depth == 0:
+          return lineno + row - 1
+  except (tokenize.TokenError, StopIteration):
+    pass
+  return None
+
+
+def _imports_line(tree):
+  # Returns the 0-based line before which imports can be added: after the
+  # docstring and any __future__ imports.
+  for node in tree.body:
+    if isinstance(node, ast.Expr) and isinstance(node.value, ast.Str):
+      continue
+    if isinstance(node, ast.ImportFrom) and node.module == "__future__":
+      continue
+    return node.lineno - 1
+  return None
+
+
+def _annotate(source, signatures, imports):
+  # Inserts a type comment as the first line of each sampled function's body,
+  # and the imports the comments need.
+  lines = source.splitlines(True)
+  insertions = []
+  methods = set()
+  tree = ast.parse(source)
+  for node in ast.walk(tree):
+    if isinstance(node, ast.ClassDef):
+      for child in node.body:
+        if (isinstance(child, ast.FunctionDef) and "staticmethod" not in
+            map(_decorator_name, child.decorator_list)):
+          methods.add(child)
+    if not (isinstance(node, ast.FunctionDef) and node.lineno in signatures
+            and _plain_args(node)):
+      continue
+    end = _header_end(lines, node.lineno)
+    body = node.body[0]
+    # One-line definitions have nowhere to put the comment.
+    if end is None or body.lineno <= end:
+      continue
+    if lines[end:end + 1] and lines[end].strip().startswith("# type:"):
+      continue
+    params, elements = _params(signatures[node.lineno])
+    returns = signatures[node.lineno][1]
+    argnames = [arg.id for arg in node.args.args]
+    if node in methods:
+      argnames = argnames[1:]
+    argtypes = [params.get(name, "Any") for name in argnames]
+    for prefix, name in (("*", node.args.vararg), ("**", node.args.kwarg)):
+      if name:
+        argtypes.append(prefix + (elements.get(name) or "Any"))
+    # Indented like the first line of the body (a multi-line docstring has no
+    # usable col_offset).
+    indent = ""
+    for line in lines[end:]:
+      if line.strip():
+        indent = line[:len(line) - len(line.lstrip())]
+        break
+    insertions.append((end, "%s# type: (%s) -> %s\n" % (
+        indent, ", ".join(argtypes), returns)))
+  if insertions and imports:
+    start = _imports_line(tree)
+    if start is not None:
+      insertions.append((start, "".join(["%s\n" % line for line in imports])))
+  for end, text in sorted(insertions, reverse=True):
+    lines.insert(end, text)
+  return "".join(lines)
+
+
+def _write(job):
+  filename, dest, signatures, names, header, inline = job
+  try:
+    with open(filename) as f:
+      source = f.read()
+  except IOError:
+    source = None
+  if inline:
+    if source is None:
+      return None
+    # Without the comment line that starts stubs.
+    text = _annotate(source, signatures, header[1:])
+  else:
+    text = _stub(source, signatures, names, header)
+  destdir = os.path.dirname(dest)
+  if destdir and not os.path.isdir(destdir):
+    try:
+      os.makedirs(destdir)
+    except OSError:
+      # Another worker created it first.
+      pass
+  with open(dest, "w") as f:
+    f.write(text)
+  return dest
+
+
+def _untrace():
+  sys.settrace(None)
+
+
+def _jobs(outdir, root, inline, main):
+  module_files = _module_files(main)
+  sources = [filename for filename in FunctionRef.all_fns
+             if filename.endswith(".py")]
+  if root is None and sources:
+    root = os.path.dirname(os.path.commonprefix(
+        [os.path.abspath(filename) for filename in sources]))
+  jobs = []
+  for filename in sources:
+    if outdir is not None:
+      relpath = os.path.relpath(os.path.abspath(filename), root)
+      if relpath.startswith(os.pardir):
+        # Not under root, so there is nowhere under outdir to put it.
+        continue
+    renderer = _Renderer(filename, module_files)
+    if inline:
+      # Type comments use Any for unsampled arguments.
+      renderer.typing.add("Any")
+    signatures = {}
+    names = {}
+    for lineno, fn in FunctionRef.all_fns[filename].items():
+      if fn.funcname.startswith("<"):
+        continue
+      signatures[lineno] = _signature(renderer, fn)
+      names[lineno] = fn.funcname
+    if not signatures:
+      continue
+    extension = ".py" if inline else ".pyi"
+    if outdir is None:
+      dest = os.path.splitext(filename)[0] + extension
+    else:
+      dest = os.path.join(outdir, os.path.splitext(relpath)[0] + extension)
+    jobs.append((filename, dest, signatures, names, renderer.header(), inline))
+  return jobs
+
+
+def write_stubs(outdir=None, root=None, processes=None, inline=False,
+                main=None):
+  """Writes a .pyi stub for every source file with sampled functions.
+
+  Stubs are written next to the sources, or with outdir, to the same path
+  relative to root (by default the sources' common directory) under outdir;
+  sources outside root are then skipped.
+  With inline, copies of the sources with PEP 484 type comments are written
+  instead; outdir is then required. Files are processed by `processes`
+  worker processes (default: one per CPU; 1 runs them in this process).
+  main is the source file of the program that ran as __main__, if that is
+  no longer sys.modules["__main__"] (as after runpy). Returns the paths
+  written.
+  """
+  if inline and outdir is None:
+    raise Exception("Annotated copies of the sources need an outdir.")
+  jobs = _jobs(outdir, root, inline, main)
+  if processes == 1 or len(jobs) < 2:
+    written = map(_write, jobs)
+  else:
+    import multiprocessing
+    pool = multiprocessing.Pool(processes, initializer=_untrace)
+    try:
+      written = pool.map(_write, jobs)
+    finally:
+      pool.close()
+      pool.join()
+  return [dest for dest in written if dest]
@@ -11,67 +11,708 @@
 # limitations under the License.
 
 """Defines the top-level tracing function."""
+import fnmatch
+import itertools
+import os
+import sys
+import time
+import types
+
 import classes
 
 absorb = lambda x, y, z: None
 active = set([])
 inactive = set([])
+# key |-> tuple of (parameter name, frozenset of known types) for inactive
+# functions; see _inject_listener.
+guards = {}
+# Guards are checked on one in every guard_stride calls of a saturated
+# function, as reading f_locals costs more than the rest of the check.
+# _guard_skips maps a key to the number of calls left to skip.
+guard_stride = 8
+_guard_skips = {}
+# key |-> snapshot record of a function restored by snapshot.restore but not
+# called since; see _resolve_restored.
+restored = {}
 reservoirsize = 100
 numsamples = 100
+# A function stops being sampled early once it has minsamples samples and the
+# estimated probability of an unseen argument type is below unseen_threshold.
+minsamples = 5
+unseen_threshold = 0.05
+# Whether sampled calls are also profiled per call site; see reset_callsites.
+callsites = False
+# Whether sampled calls are timed, and whether per argument type signature;
+# see reset_latency.
+latency = False
+latency_by_signature = False
+# Whether joint argument and return types are counted; see reset_signatures.
+signatures = False
+# Whether methods' self and cls are recorded as only their class; see
+# reset_receivers.
+receivers = True
+# The recorder.Recorder that sampled calls are also logged to, if any; see
+# set_recorder.
+recorder = None
+# id(frame) |-> 3-tuple of the FunctionRef, argument type signature (or None)
+# and start time (or None) of a sampled call in progress that is timed or
+# whose signature is counted.
+_calls_in_progress = {}
+# id(frame) |-> type of the exception propagating through a sampled call, and
+# the frame's f_lasti when it was raised there; see _trace_exception.
+_exceptions = {}
+# Self-instrumentation; see enable_stats.
+collect_stats = False
+_counters = ("calls_seen", "calls_sampled", "calls_rejected",
+             "calls_filtered", "functions_admitted", "functions_deactivated",
+             "functions_reactivated")
+_timers = ("trace_call_time", "trace_return_time", "instance_set_time")
+stats = dict([(name, 0) for name in _counters] +
+             [(name, 0.0) for name in _timers])
+# Include/exclude rules; see set_filters. _decisions maps id(code) to a
+# 4-tuple of the code object (kept so the id is not reused), the function's key
+# (None if the filters reject it), whether the code is bocado's own and, for
+# functions that are sampled, their parameters (see _parameters).
+_filters = {"include": (), "exclude": ()}
+_decisions = {}
+_owndir = os.path.dirname(os.path.abspath(__file__))
+# Code flags (see inspect) marking functions, as opposed to module and class
+# bodies, *args and **kwargs parameters, and generators.
+_CO_OPTIMIZED = 0x01
+_CO_VARARGS = 0x04
+_CO_VARKEYWORDS = 0x08
+_CO_GENERATOR = 0x20
+# RETURN_VALUE and YIELD_VALUE (see dis.opmap): a frame stopped on any other
+# instruction when it returns is unwinding an exception.
+_YIELD_VALUE = 86
+_returning_ops = (83, _YIELD_VALUE)
+# First parameter names that make a function a method; see reset_receivers.
+_receiver_names = ("self", "cls")
+# Same choice as timeit.default_timer, without importing timeit at startup.
+_clock = time.clock if sys.platform == "win32" else time.time
+# Overhead governor; see set_overhead_budget. While governing, only one in
+# every `stride` calls is considered for sampling, and none while paused.
+overhead_budget = None
+stride = 1
+maxstride = 64
+paused = False
+_governor = {"window": 1.0, "every": 1024, "tick": 0, "start": 0.0,
+             "tracer_time": 0.0, "overhead": 0.0}
+# Memory governor; see set_memory_budget. _memory also holds the counts
+# get_stats reports while governing.
+memory_budget = None
+_memory = {"every": 1024, "tick": 0, "profile_memory": 0,
+           "functions_compacted": 0, "functions_evicted": 0,
+           "evicted_calls": 0}
+# key |-> the last tick of _checks when a saturated function was called and
+# its guard checked (or it saturated); the governor frees the functions that
+# have gone longest without a call first.
+_checks = itertools.count()
+_last_checked = {}
+# key |-> [filename, lineno, funcname, calls, argname |-> type() |-> count]
+# of each function evicted by the governor. Evicted functions stay in
+# inactive with their guard, so they are not sampled again unless their
+# argument types drift.
+evicted = {}
+
+def reset():
+  """Forgets which functions are being, or have finished, sampling."""
+  # Cleared in place: other modules hold references to these sets.
+  active.clear()
+  inactive.clear()
+  guards.clear()
+  _guard_skips.clear()
+  restored.clear()
+  _calls_in_progress.clear()
+  _exceptions.clear()
+  _last_checked.clear()
+  evicted.clear()
+
+def reset_stats():
+  """Zeroes the counters and timers reported by get_stats."""
+  for name in _counters:
+    stats[name] = 0
+  for name in _timers:
+    stats[name] = 0.0
+  for name in ("profile_memory", "functions_compacted", "functions_evicted",
+               "evicted_calls"):
+    _memory[name] = 0
+
+def _timed(name, fn):
+  # Wraps fn so that the time spent in its outermost invocation is added to
+  # stats[name]. The wrapper keeps a reference to the original in `untimed`.
+  depth = [0]
+  def timed(*args):
+    depth[0] += 1
+    start = _clock()
+    try:
+      return fn(*args)
+    finally:
+      depth[0] -= 1
+      if not depth[0]:
+        stats[name] += _clock() - start
+  timed.untimed = fn
+  return timed
+
+def enable_stats(enabled=True):
+  """Turns the sampler's own counters and timers on or off."""
+  # Timers are installed by swapping in timed wrappers, so they cost nothing
+  # while stats are off.
+  global collect_stats, _trace_call, _trace_return
+  if enabled == collect_stats:
+    return
+  collect_stats = enabled
+  if enabled:
+    reset_stats()
+    _trace_call = _timed("trace_call_time", _trace_call)
+    _trace_return = _timed("trace_return_time", _trace_return)
+    # Type inference goes through count_instances.
+    classes.count_instances = _timed("instance_set_time",
+                                     classes.count_instances)
+  else:
+    _trace_call = _trace_call.untimed
+    _trace_return = _trace_return.untimed
+    classes.count_instances = classes.count_instances.untimed
+
+def _sample_memory():
+  # Shallow size of the sample lists and the samples they hold.
+  total = 0
+  for args in classes.ArgRef.all_args.values():
+    for arg in args.values():
+      total += sys.getsizeof(arg.samples) + arg.sample_bytes
+  return total
+
+def get_stats():
+  """Returns a dict describing the sampler's own work and footprint."""
+  current = dict(stats)
+  current["active"] = len(active)
+  current["inactive"] = len(inactive)
+  current["sample_memory"] = _sample_memory()
+  if overhead_budget is not None:
+    current["overhead"] = _governor["overhead"]
+    current["stride"] = stride
+    current["paused"] = paused
+  if memory_budget is not None:
+    for name in ("profile_memory", "functions_compacted", "functions_evicted",
+                 "evicted_calls"):
+      current[name] = _memory[name]
+  return current
+
+def _tracer_time():
+  return stats["trace_call_time"] + stats["trace_return_time"]
+
+def set_overhead_budget(fraction, window=1.0, every=1024):
+  """Keeps time spent in the tracer under `fraction` of wall time.
+
+  Every `every` calls, once `window` seconds have passed, the governor
+  compares tracer time to wall time for the window. Over budget, it halves
+  the fraction of calls sampled; once that reaches 1/maxstride it pauses
+  sampling for a window. Under half the budget, it backs off the other way.
+  Pass None to stop governing. Turns on enable_stats, whose timers it reads.
+  """
+  global overhead_budget, stride, paused
+  overhead_budget = fraction
+  stride = 1
+  paused = False
+  if fraction is None:
+    return
+  enable_stats()
+  _governor["window"] = window
+  _governor["every"] = every
+  _governor["tick"] = 0
+  _governor["start"] = _clock()
+  _governor["tracer_time"] = _tracer_time()
+  _governor["overhead"] = 0.0
+
+def _govern():
+  global stride, paused
+  now = _clock()
+  elapsed = now - _governor["start"]
+  if elapsed < _governor["window"]:
+    return
+  tracer_time = _tracer_time()
+  overhead = (tracer_time - _governor["tracer_time"]) / max(elapsed, 1e-9)
+  _governor["start"] = now
+  _governor["tracer_time"] = tracer_time
+  _governor["overhead"] = overhead
+  if overhead > overhead_budget:
+    if stride < maxstride:
+      stride *= 2
+    else:
+      paused = True
+  elif overhead < overhead_budget / 2:
+    if paused:
+      paused = False
+    elif stride > 1:
+      stride /= 2
+
+def _throttled():
+  _governor["tick"] += 1
+  tick = _governor["tick"]
+  if not tick % _governor["every"]:
+    _govern()
+  return paused or tick % stride != 0
+
+def set_memory_budget(nbytes, every=1024):
+  """Keeps the profile's estimated size under nbytes.
+
+  Every `every` sampled calls, the profile's size is estimated as the
+  shallow size of its functions, arguments, samples and sketches (see
+  FunctionRef.nbytes). Over budget, saturated functions, least recently
+  called first, are compacted to the types inferred from their samples
+  (see ArgRef.compact), and if that is not enough, evicted: dropped from
+  the profile, summarized in `evicted` and counted in get_stats. Evicted
+  functions stay saturated: they are only sampled again if their argument
+  types drift. Pass None to stop.
+  """
+  global memory_budget
+  memory_budget = nbytes
+  _memory["every"] = every
+  _memory["tick"] = 0
+
+def _evict(fn):
+  # Replaces fn's profile with a summary of its calls and type() counts,
+  # added to any from an earlier eviction. Its key stays in inactive with
+  # its guard.
+  fn.evict()
+  summary = evicted.get(fn.key)
+  if summary is None:
+    summary = evicted[fn.key] = [fn.filename, fn.lineno, fn.funcname, 0, {}]
+  summary[3] += fn.calls
+  for arg in fn.args.values():
+    counts = summary[4].setdefault(arg.argname, {})
+    for sample_type, count in arg.type_counts.items():
+      counts[sample_type] = counts.get(sample_type, 0) + count
+  for frame_id, call in _calls_in_progress.items():
+    if call[0] is fn:
+      del _calls_in_progress[frame_id]
+
+def enforce_memory_budget(nbytes=None):
+  """Applies set_memory_budget's budget (or nbytes) now; returns the size."""
+  # The interned parametric types are not freed, as they are compared by
+  # identity.
+  if nbytes is None:
+    nbytes = memory_budget
+  fns = [fn for fns in classes.FunctionRef.all_fns.values()
+         for fn in fns.values()]
+  sizes = dict([(fn, fn.nbytes()) for fn in fns])
+  total = sum(sizes.values())
+  # A saturated function's generation stops changing however often it is
+  # called, so functions are ranked by their last guard check instead.
+  saturated = sorted([fn for fn in fns if fn.key in inactive],
+                     key=lambda fn: _last_checked.get(fn.key, -1))
+  for fn in saturated:
+    if total <= nbytes:
+      break
+    if any([arg.samples for arg in fn.args.values()]):
+      fn.compact()
+      size = fn.nbytes()
+      total += size - sizes[fn]
+      sizes[fn] = size
+      _memory["functions_compacted"] += 1
+  if total > nbytes:
+    # Filter decisions hold on to every code object seen.
+    _decisions.clear()
+  for fn in saturated:
+    if total <= nbytes:
+      break
+    _evict(fn)
+    total -= sizes[fn]
+    _memory["functions_evicted"] += 1
+    _memory["evicted_calls"] += fn.calls
+  _memory["profile_memory"] = total
+  return total
+
+def set_filters(include=(), exclude=()):
+  """Restricts sampling to functions matching include and none of exclude.
+
+  Rules are strings. "module:<pattern>" and "function:<pattern>" match the
+  module's __name__ and the function's name; anything else, optionally
+  written "file:<pattern>", matches the absolute filename. Patterns are
+  fnmatch globs, and a module or file pattern also matches anything it is a
+  prefix of (so "module:mypkg" covers mypkg.sub). An empty include list
+  includes everything.
+  """
+  _filters["include"] = tuple(include)
+  _filters["exclude"] = tuple(exclude)
+  _decisions.clear()
+
+def _matches(rule, filename, module, funcname):
+  kind, _, pattern = rule.partition(":")
+  if not pattern:
+    kind, pattern = "file", rule
+  if kind == "module":
+    return (fnmatch.fnmatchcase(module, pattern) or
+            module.startswith(pattern + "."))
+  elif kind == "function":
+    return fnmatch.fnmatchcase(funcname, pattern)
+  elif kind == "file":
+    return (fnmatch.fnmatchcase(filename, pattern) or
+            filename.startswith(pattern))
+  raise Exception("Unknown filter rule: %s" % rule)
+
+def _decide(frame):
+  code = frame.f_code
+  filename = os.path.abspath(code.co_filename)
+  module = frame.f_globals.get("__name__") or ""
+  matches = lambda rule: _matches(rule, filename, module, code.co_name)
+  included = not _filters["include"] or any(map(matches, _filters["include"]))
+  # Module and class bodies have no parameters or return value to sample.
+  # Class bodies get new locals too, so only optimized (function) code is
+  # sampled.
+  if (not included or any(map(matches, _filters["exclude"])) or
+      not code.co_flags & _CO_OPTIMIZED):
+    key = None
+    parameters = None
+  else:
+    key = classes.FunctionRef.get_key(code)
+    parameters = _parameters(code)
+  decision = (code, key, filename.startswith(_owndir), parameters)
+  _decisions[id(code)] = decision
+  return decision
+
+def _parameters(code):
+  # The names of code's parameters in order, *args and **kwargs last (as in
+  # co_varnames), and their kinds. Only these are read from f_locals, which
+  # on a call also holds the function's free variables.
+  n = code.co_argcount
+  kinds = [classes.POSITIONAL] * n
+  if receivers and n and code.co_varnames[0] in _receiver_names:
+    kinds[0] = classes.RECEIVER
+  if code.co_flags & _CO_VARARGS:
+    kinds.append(classes.VARARGS)
+  if code.co_flags & _CO_VARKEYWORDS:
+    kinds.append(classes.VARKEYWORDS)
+  return code.co_varnames[:len(kinds)], tuple(kinds)
 
 def reset_reservoirsize(n):
   global reservoirsize
   reservoirsize = n
 
-def _add_to_samples(f_code, items):
-  """Adds observed values for f_code to samples."""
+def reset_retention(mode):
+  """Sets how samples are held: classes.STRONG, FINGERPRINT or WEAK."""
+  for retention in classes.retention_modes:
+    if mode == retention:
+      classes.ArgRef.retention = retention
+      return
+  raise Exception("Unknown retention mode: %s" % mode)
+
+def reset_stopping_rule(n, threshold, stride=None):
+  """Sets minsamples and unseen_threshold. A threshold of 0 disables the
+  early stop, so functions are sampled numsamples times. With stride, sets
+  guard_stride: drift is checked on one in every stride calls."""
+  global minsamples, unseen_threshold, guard_stride
+  minsamples = n
+  unseen_threshold = threshold
+  if stride is not None:
+    guard_stride = stride
+
+def reset_value_statistics(enabled):
+  """Turns range, mean/variance and quantile summaries of samples on or off."""
+  classes.ArgRef.collect_statistics = enabled
+
+def set_recorder(log):
+  """Also appends every sampled call to log, a recorder.Recorder, or None."""
+  global recorder
+  recorder = log
+
+def reset_callsites(enabled, maxcallsites=None):
+  """Turns per-call-site type profiles on or off.
+
+  Each sampled call is also counted against the line of the calling function
+  it came from, so the callers responsible for a polymorphic argument can be
+  told apart. At most maxcallsites (default classes.FunctionRef.maxcallsites)
+  sites are kept per function; the rest are counted together.
+  """
+  global callsites
+  callsites = enabled
+  if maxcallsites is not None:
+    classes.FunctionRef.maxcallsites = maxcallsites
+
+def reset_latency(enabled, by_signature=False):
+  """Turns timing of sampled calls on or off.
+
+  Durations go into a LogHistogram per function and, with by_signature, per
+  tuple of the type()s of the call's arguments. Each resumption of a
+  generator is timed as a call.
+  """
+  global latency, latency_by_signature
+  latency = enabled
+  latency_by_signature = enabled and by_signature
+  _calls_in_progress.clear()
+
+def reset_signatures(enabled, maxsignatures=None):
+  """Turns counting of joint argument and return types per call on or off.
+
+  Each sampled call that returns counts its tuple of argument type()s and
+  the type() of its return value, so the combinations that actually occur
+  can be told apart from the marginal types of each argument. At most
+  maxsignatures (default classes.FunctionRef.maxsignatures) are kept per
+  function; the rest are counted together.
+  """
+  global signatures
+  signatures = enabled
+  if maxsignatures is not None:
+    classes.FunctionRef.maxsignatures = maxsignatures
+  _calls_in_progress.clear()
+
+def reset_receivers(enabled):
+  """Turns cheap handling of method receivers on or off.
+
+  A function whose first parameter is named self or cls is taken to be a
+  method. Its receiver is then not sampled, which classifies objects by
+  their dir(), but only its class is counted (see FunctionRef.add_receiver),
+  and the class defining the method is looked up once.
+  """
+  global receivers
+  receivers = enabled
+  _decisions.clear()
+
+def _start_call(frame, fn, values):
+  # values are those of the call's parameters; see _parameters.
+  if latency_by_signature or signatures:
+    signature = tuple([type(value) for value in values])
+  else:
+    signature = None
+  _calls_in_progress[id(frame)] = (
+      fn, signature, _clock() if latency else None)
+
+def _finish_call(frame, arg, exctype=None):
+  # Returns the call's signature, if one was recorded. exctype is the type of
+  # the exception the call raised, if any, instead of returning arg.
+  end = _clock()
+  try:
+    fn, signature, start = _calls_in_progress.pop(id(frame))
+  except KeyError:
+    return None
+  if start is not None:
+    fn.add_latency(end - start, signature if latency_by_signature else None)
+  if exctype is None and signature is not None and signatures:
+    fn.add_signature(signature, type(arg))
+  return signature
+
+def _add_exception(frame, exctype):
+  code = frame.f_code
+  fn = classes.FunctionRef(code.co_filename, code.co_firstlineno, code.co_name)
+  signature = None
+  if latency or signatures:
+    signature = _finish_call(frame, None, exctype)
+  fn.add_exception(exctype, signature if signatures else None)
+
+def _add_to_samples(f_code, parameters, values):
+  """Adds observed values of f_code's parameters to samples."""
+  fn = classes.FunctionRef(f_code.co_filename,
+                   f_code.co_firstlineno,
+                   f_code.co_name)
+  fn.generator = bool(f_code.co_flags & _CO_GENERATOR)
+  names, kinds = parameters
+  for position, value in enumerate(values):
+    kind = kinds[position]
+    if kind is classes.RECEIVER:
+      _add_receiver(fn, f_code, names[position], value)
+      continue
+    arg = classes.ArgRef(fn, names[position], position, kind)
+    arg.add_sample(value)
+  return fn
+
+
+def _add_receiver(fn, f_code, name, receiver):
+  cls = _receiver_class(receiver)
+  if fn.classname is None:
+    fn.classname = _defining_class(cls, f_code).__name__
+  fn.add_receiver(name, cls)
+
+
+def _receiver_class(receiver):
+  cls = type(receiver)
+  if cls is types.InstanceType:
+    return receiver.__class__
+  elif cls is types.ClassType or issubclass(cls, type):
+    # The receiver of a classmethod is the class itself.
+    return receiver
+  return cls
+
+
+def _defining_class(cls, f_code):
+  # The first class in cls's method resolution order with a function (or a
+  # classmethod or staticmethod) for f_code. Only runs once per method.
+  import inspect
+  for base in inspect.getmro(cls):
+    for value in vars(base).values():
+      function = getattr(value, "__func__", value)
+      if getattr(function, "func_code", None) is f_code:
+        return base
+  return cls
+
+
+def _add_return(f_code, value):
   fn = classes.FunctionRef(f_code.co_filename,
                    f_code.co_firstlineno,
                    f_code.co_name)
-  for k, v in items:
-    arg = classes.ArgRef(fn, k)
-    arg.add_sample(v)
+  classes.ArgRef(fn, "").add_sample(value)
   return fn
 
 
 def _stop_sampling(fn):
-  # Will want something more clever than this, based on having high confidence
-  # in the observed values. We probably want to model this as a DP.
-  return all([len(arg.samples) > numsamples for arg in fn.args.values()])
+  # Stop after more than numsamples sampled calls, or earlier once we are
+  # confident no new types will appear. Following Good-Turing, the
+  # probability that an argument's next sample has an unseen type is the
+  # fraction of its samples whose type was seen exactly once. Types here are
+  # the cheap type() of each value, so a function whose lists change element
+  # type will still stop early. Receiver classes count as an argument.
+  if fn.calls > numsamples:
+    return True
+  if fn.calls < minsamples:
+    return False
+  if fn.receivers:
+    counts = fn.receivers.values()
+    if counts.count(1) / float(sum(counts)) >= unseen_threshold:
+      return False
+  return all([arg.unseen_type_prob() < unseen_threshold
+              for arg in fn.args.values()])
 
 
 def _inject_listener(frame, fn):
-  # Modify runtime bytecode to move the function into the active set if a new
-  # type appears.
-  pass
+  """Guards a saturated function so that a new argument type reactivates it."""
+  # The guard only records the type() of each parameter, so checking it costs
+  # one f_locals lookup and one set membership test per parameter, on the
+  # calls that are checked (see guard_stride).
+  code = frame.f_code
+  args_by_name = dict([(arg.argname, arg) for arg in fn.args.values()])
+  guard = []
+  for name in code.co_varnames[:code.co_argcount]:
+    if name in args_by_name:
+      guard.append((name, frozenset(args_by_name[name].type_counts)))
+  # A new receiver class is drift too, where type() finds the class.
+  if fn.receiver == "self" and all(
+      [isinstance(cls, type) for cls in fn.receivers]):
+    guard.append(("self", frozenset(fn.receivers)))
+  guards[fn.key] = tuple(guard)
+  _last_checked[fn.key] = next(_checks)
+
+
+def _resolve_restored(frame, key):
+  # The first call of a restored function, when the modules defining its
+  # argument types have usually been imported, recreates its counts and, if
+  # it was saturated, its guard. Imported here as it only runs after restore.
+  import snapshot
+  fn = snapshot.resolve(key)
+  fn.generator = bool(frame.f_code.co_flags & _CO_GENERATOR)
+  if key in inactive:
+    _inject_listener(frame, fn)
+
+
+def _drifted(frame, guard):
+  f_locals = frame.f_locals
+  for name, known in guard:
+    try:
+      value = f_locals[name]
+    except KeyError:
+      # A resumed generator can have deleted a parameter.
+      continue
+    if type(value) not in known:
+      return True
+  return False
 
 
 def _trace_call(frame, event, arg):
   """The local tracing function for a function call."""
-  fn = _add_to_samples(frame.f_code, frame.f_locals.items())
+  code = frame.f_code
+  try:
+    parameters = _decisions[id(code)][3]
+  except KeyError:
+    # The filters changed since the call was admitted.
+    parameters = _parameters(code)
+  # Each access to f_locals copies the frame's variables into a new dict.
+  f_locals = frame.f_locals
+  try:
+    values = [f_locals[name] for name in parameters[0]]
+  except KeyError:
+    # A resumed generator can have deleted a parameter. Returning None would
+    # leave this function tracing the rest of the frame.
+    return _next_event(frame, event, arg)
+  fn = _add_to_samples(code, parameters, values)
+  if callsites and frame.f_back is not None:
+    fn.get_callsite(frame.f_back).add_call(zip(parameters[0], values))
+  fn.add_call()
+  if recorder is not None:
+    recorder.record_call(frame, fn, parameters, values)
+  if collect_stats:
+    stats["calls_sampled"] += 1
   if _stop_sampling(fn):
     _inject_listener(frame, fn)
     inactive.add(fn.key)
+    if collect_stats:
+      stats["functions_deactivated"] += 1
     try:
       active.remove(fn.key)
-      # Note: this function is still hanging around in samples, taking up space.
+      # The function's samples stay in the profile until set_memory_budget
+      # compacts or evicts it.
     except KeyError:
       pass
+  if memory_budget is not None:
+    _memory["tick"] += 1
+    if not _memory["tick"] % _memory["every"]:
+      enforce_memory_budget()
+  # The clock starts last so that the time spent sampling is not included.
+  if latency or signatures:
+    _start_call(frame, fn, values)
   # _trace_call's return function is called on every subsequent event in scope.
-  return _trace_return
+  return _next_event(frame, event, arg)
+
+
+def _next_event(frame, event, arg):
+  # The call's first event is usually its first line. A resumed generator's
+  # can also be an exception thrown into it, or its return, which
+  # _trace_return still has to handle.
+  if event == "line":
+    return _trace_return
+  return _trace_return(frame, event, arg)
 
 
 def _trace_exception(frame, event, arg):
+  """The local tracing function once an exception was raised in a call."""
+  # The exception is kept until the frame returns: a frame that handles it
+  # returns with RETURN_VALUE (or suspends with YIELD_VALUE), and one that
+  # unwinds, through finally blocks or not, stops on any other instruction,
+  # or, with no line run in between, on the one that raised it: the
+  # YIELD_VALUE of a generator that an exception was thrown into. Each frame
+  # an exception unwinds through records it once.
+  if event == "line":
+    exception = _exceptions.get(id(frame))
+    if exception is not None and exception[1] is not None:
+      _exceptions[id(frame)] = (exception[0], None)
+  elif event == "exception":
+    _exceptions[id(frame)] = (arg[0], frame.f_lasti)
+  elif event == "return":
+    exctype, lasti = _exceptions.pop(id(frame), (None, None))
+    if (exctype is None or (frame.f_lasti != lasti and
+        ord(frame.f_code.co_code[frame.f_lasti]) in _returning_ops)):
+      return _trace_return(frame, event, arg)
+    _add_exception(frame, exctype)
   return None
 
 
 def _trace_return(frame, event, arg):
-  # arg is not None only for returns and exceptions.
-  if arg is not None:
-    if type(arg) is tuple and len(arg) == 3:
-      return _trace_exception
-    # Otherwise, we are a return event.
-    _add_to_samples(frame.f_code, [("", arg)])
+  if event == "exception":
+    _exceptions[id(frame)] = (arg[0], frame.f_lasti)
+    return _trace_exception
+  elif event != "return":
+    return None
+  if latency or signatures:
+    _finish_call(frame, arg)
+  # A generator's return values are the values it yields; the None it
+  # returns when it is exhausted is not sampled.
+  code = frame.f_code
+  if (code.co_flags & _CO_GENERATOR and
+      ord(code.co_code[frame.f_lasti]) != _YIELD_VALUE):
+    return None
+  fn = _add_return(code, arg)
+  if recorder is not None:
+    recorder.record_return(fn, arg)
+  # The caller is still suspended at the line of the call.
+  if callsites and frame.f_back is not None:
+    fn.get_callsite(frame.f_back).add_value("", arg)
 
 
 def get_fn_arg_values(frame, event, arg, skipself=True):
@@ -82,14 +723,49 @@ def get_fn_arg_values(frame, event, arg, skipself=True):
   # is only ever called for the "call" event. This function
   # should never be used as a return value of a trace.
   assert event == "call", "Top-level event is %s" % event
-  if skipself:
-    if "bocado" in frame.f_code.co_filename:
-      return None
-  key = classes.FunctionRef.get_key(frame.f_code)
+  if collect_stats:
+    stats["calls_seen"] += 1
+  # Filtering costs one dict lookup once a code object has been seen.
+  try:
+    _, key, own, _ = _decisions[id(frame.f_code)]
+  except KeyError:
+    _, key, own, _ = _decide(frame)
+  if skipself and own:
+    return None
+  if key is None:
+    if collect_stats:
+      stats["calls_filtered"] += 1
+    return None
+  if overhead_budget is not None and _throttled():
+    return None
+  if restored and key in restored:
+    _resolve_restored(frame, key)
   if key in active:
     return _trace_call
-  elif key in inactive or len(active) >= reservoirsize:
+  elif key in inactive:
+    # Saturated functions are only sampled again if their argument types drift.
+    guard = guards.get(key)
+    if guard is None or len(active) >= reservoirsize:
+      return None
+    skips = _guard_skips.get(key, 0)
+    if skips:
+      _guard_skips[key] = skips - 1
+      return None
+    _guard_skips[key] = guard_stride - 1
+    _last_checked[key] = next(_checks)
+    if not _drifted(frame, guard):
+      return None
+    inactive.remove(key)
+    active.add(key)
+    if collect_stats:
+      stats["functions_reactivated"] += 1
+    return _trace_call
+  elif len(active) >= reservoirsize:
+    if collect_stats:
+      stats["calls_rejected"] += 1
     return None
   else:
     active.add(key)
+    if collect_stats:
+      stats["functions_admitted"] += 1
     return _trace_call
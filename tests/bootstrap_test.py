@@ -0,0 +1,56 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for bocado.bootstrap."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from bocado import bootstrap
+
+
+class BootstrapTest(unittest.TestCase):
+
+  def test_output_not_loaded(self):
+    code = ("import sys, bocado.bootstrap as b; b.install(); "
+            "sys.stdout.write(str('bocado.output' in sys.modules))")
+    self.assertEqual(
+        subprocess.check_output([sys.executable, "-c", code]), "False")
+
+  def test_install_from_env(self):
+    env = dict(os.environ)
+    env.pop(bootstrap.env_var, None)
+    code = ("import sys, bocado.bootstrap as b; "
+            "sys.stdout.write(str(b.install_from_env()))")
+    self.assertEqual(
+        subprocess.check_output([sys.executable, "-c", code], env=env),
+        "False")
+    tmpdir = tempfile.mkdtemp()
+    try:
+      filename = os.path.join(tmpdir, "types.txt")
+      env[bootstrap.env_var] = filename
+      code += "\ndef square(n):\n  return n * n\nsquare(3)\n"
+      self.assertEqual(
+          subprocess.check_output([sys.executable, "-c", code], env=env),
+          "True")
+      with open(filename) as f:
+        self.assertIn("square returns int", f.read())
+    finally:
+      shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+  unittest.main()
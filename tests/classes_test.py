@@ -15,7 +15,11 @@
 import types
 import unittest
 
+from bocado import classes
 from bocado.classes import ArgRef
+from bocado.classes import count_instances
+from bocado.classes import Fingerprint
+from bocado.classes import FINGERPRINT
 from bocado.classes import FunctionRef
 from bocado.classes import instance_set
 from bocado.classes import ParameterizedDict
@@ -23,7 +27,9 @@ from bocado.classes import ParameterizedList
 from bocado.classes import ParameterizedTuple
 from bocado.classes import ParametricType
 from bocado.classes import TaggedUnion
+from bocado.classes import STRONG
 from bocado.classes import ValueCollectionDict
+from bocado.classes import WEAK
 
 
 class Foo(object):
@@ -52,6 +58,13 @@ class InstanceSetTest(unittest.TestCase):
     self.assertEqual(instance_set([datum1, datum2]), [Foo])
     self.assertEqual(instance_set([datum1, datum2, datum3]), [Foo, Foo])
 
+  def test_count_instances(self):
+    datum1 = Foo()
+    datum2 = Foo()
+    datum2.bar = "bar"
+    self.assertEqual(count_instances([1, datum1, 2, datum2, datum1, 3]),
+                     ([int, Foo, Foo], [3, 2, 1]))
+
 class ValueCollectionDictTest(unittest.TestCase):
 
   def test_list_vcd(self):
@@ -90,6 +103,28 @@ class ArgRefTest(unittest.TestCase):
     arg0.add_sample(1)
     self.assertEqual(len(arg0.samples), 1)
 
+  def test_type_cache(self):
+    calls = []
+    def counting_count_instances(samples):
+      calls.append(len(samples))
+      return count_instances(samples)
+    classes.count_instances = counting_count_instances
+    fn = FunctionRef("cache", 1, "cacheFn")
+    try:
+      arg = ArgRef(fn, "cached")
+      arg.add_sample(1)
+      self.assertEqual(arg.get_type(), int)
+      self.assertEqual(arg.get_type_prob(), {int: 1.0})
+      fn.set_signature()
+      self.assertEqual(calls, [1])
+      arg.add_sample("a")
+      self.assertEqual(arg.get_type(), TaggedUnion([int, str]))
+      fn.set_signature()
+      self.assertEqual(fn.signature["cached"][1], TaggedUnion([int, str]))
+      self.assertEqual(calls, [1, 2])
+    finally:
+      classes.count_instances = count_instances
+
   def test_get_type(self):
     arg1 = ArgRef(self.fn, "arg1")
     self.assertEqual(arg1.get_type(), types.NoneType)
@@ -125,6 +160,95 @@ class ArgRefTest(unittest.TestCase):
     self.assertEqual(len(type_dict), 2)
     self.assertAlmostEqual(type_dict[int], 0.5)
     self.assertAlmostEqual(type_dict[bool], 0.5)
+    # Probabilities are per sample, not per distinct type.
+    arg3.add_sample(2)
+    arg3.add_sample(3)
+    type_dict = arg3.get_type_prob()
+    self.assertAlmostEqual(type_dict[int], 0.75)
+    self.assertAlmostEqual(type_dict[bool], 0.25)
+    self.assertEqual(arg3.get_type_counts(), {int: 3, bool: 1})
+
+  def test_compact(self):
+    arg = ArgRef(self.fn, "compacted")
+    for sample in [1, 2, True] + range(3, 40):
+      arg.add_sample(sample)
+    size = arg.nbytes()
+    arg.compact()
+    self.assertEqual(arg.samples, [])
+    # The distinct value sketch shrinks too.
+    self.assertEqual(arg.distinct.precision, ArgRef.compacted_precision)
+    self.assertLess(arg.nbytes(), size / 2)
+    self.assertEqual(arg.get_type(), TaggedUnion([int, bool]))
+    # Later samples are merged with the compacted counts.
+    arg.add_sample(3)
+    arg.add_sample("a")
+    self.assertEqual(arg.get_type_counts(), {int: 40, bool: 1, str: 1})
+    self.assertEqual(arg.get_type(), TaggedUnion([int, bool, str]))
+
+  def test_num_distinct(self):
+    arg4 = ArgRef(self.fn, "arg4")
+    self.assertEqual(arg4.num_distinct(), 0)
+    for sample in [1, 1, "a", [1], [1], {"b": 2}]:
+      arg4.add_sample(sample)
+    self.assertEqual(arg4.num_distinct(), 4)
+
+  def test_get_statistics(self):
+    ArgRef.collect_statistics = True
+    try:
+      arg5 = ArgRef(self.fn, "arg5")
+      for sample in [1, 3.5, "ab", [1, 2, 3, 4], True]:
+        arg5.add_sample(sample)
+    finally:
+      ArgRef.collect_statistics = False
+    statistics = arg5.get_statistics()
+    self.assertEqual(statistics["magnitude"]["count"], 2)
+    self.assertEqual(statistics["magnitude"]["max"], 3.5)
+    self.assertEqual(statistics["length"]["min"], 2)
+    self.assertEqual(statistics["length"]["max"], 4)
+
+
+class RetentionTest(unittest.TestCase):
+
+  def setUp(self):
+    self.fn = FunctionRef("retention", 1, "retentionFn")
+
+  def tearDown(self):
+    ArgRef.retention = STRONG
+
+  def test_fingerprint(self):
+    ArgRef.retention = FINGERPRINT
+    arg = ArgRef(self.fn, "fp")
+    foo = Foo()
+    arg.add_sample(foo)
+    arg.add_sample(1)
+    arg.add_sample(1)
+    arg.add_sample([1, 2])
+    self.assertTrue(all([type(s) is Fingerprint for s in arg.samples]))
+    self.assertIsNone(arg.samples[0].value())
+    self.assertEqual(len(set(arg.samples[1:3])), 1)
+    self.assertEqual(arg.get_type(),
+                     TaggedUnion([Foo, int, ParameterizedList([int])]))
+
+  def test_bounded_fingerprint(self):
+    ArgRef.retention = FINGERPRINT
+    arg = ArgRef(self.fn, "bounded")
+    # Only a prefix of a large list is classified.
+    arg.add_sample([Foo() for _ in range(2000)] + ["a"])
+    self.assertEqual(arg.get_type(), ParameterizedList([Foo]))
+    # Instances of a class with the same dir() share a descriptor.
+    arg.add_sample(Foo())
+    arg.add_sample(Foo())
+    self.assertIs(arg.samples[1].descriptor, arg.samples[2].descriptor)
+
+  def test_weak(self):
+    ArgRef.retention = WEAK
+    arg = ArgRef(self.fn, "weak")
+    foo = Foo()
+    arg.add_sample(foo)
+    self.assertIs(arg.samples[0].value(), foo)
+    del foo
+    self.assertIsNone(arg.samples[0].value())
+    self.assertEqual(arg.get_type(), Foo)
 
 
 class FunctionRefTest(unittest.TestCase):
@@ -137,6 +261,17 @@ class FunctionRefTest(unittest.TestCase):
     with self.assertRaises(Exception) as e:
       FunctionRef("foo", 1, "foofn")
 
+  def test_evict(self):
+    fn = FunctionRef("evicted", 1, "evictedFn")
+    arg = ArgRef(fn, "x")
+    arg.add_sample(1)
+    fn.evict()
+    self.assertNotIn("evicted", FunctionRef.all_fns)
+    self.assertNotIn(fn, FunctionRef.by_name["evictedFn"])
+    self.assertNotIn(arg, ArgRef.by_type["int"])
+    self.assertNotIn(fn, ArgRef.all_args)
+    self.assertIsNot(FunctionRef("evicted", 1, "evictedFn"), fn)
+
   def test_get_key(self):
     co1 = compile("print 'foo'", "", "single")
     co2 = compile("print 'foo'", "", "single")
@@ -159,6 +294,25 @@ class FunctionRefTest(unittest.TestCase):
     retval.add_sample("foo")
     self.assertEqual(fn.get_num_samples(), 2)
 
+  def test_get_signatures(self):
+    fn = FunctionRef("qux", 1, "quxFn")
+    fn.add_signature((int, str), int)
+    fn.add_signature((float, str), float)
+    fn.add_signature((float, str), float)
+    self.assertEqual(fn.get_signatures(),
+                     [((float, str), float, 2), ((int, str), int, 1)])
+    maxsignatures = FunctionRef.maxsignatures
+    try:
+      FunctionRef.maxsignatures = 2
+      fn.add_signature((str, str), str)
+      fn.add_signature((str, str), str)
+      fn.add_signature((int, str), int)
+    finally:
+      FunctionRef.maxsignatures = maxsignatures
+    self.assertEqual(fn.get_signatures(),
+                     [((float, str), float, 2), ((int, str), int, 2),
+                      (None, None, 2)])
+
   def test_get_return(self):
     fn = FunctionRef("baz", 1, "bazFn")
     argref, returntype = fn.get_return()
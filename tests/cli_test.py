@@ -0,0 +1,136 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for bocado.cli."""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+_script = """
+import os, signal, sys
+
+def add(a, b):
+  return a + b
+
+for i in range(10):
+  add(i, 2.0)
+# Dump on demand, then check the dump while still running.
+os.kill(os.getpid(), signal.SIGUSR1)
+sys.stdout.write(open(sys.argv[1]).read())
+"""
+
+
+class CliTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.script = os.path.join(self.tmpdir, "script.py")
+    with open(self.script, "w") as f:
+      f.write(_script)
+    self.output = os.path.join(self.tmpdir, "types.json")
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def run_bocado(self, *args):
+    return subprocess.check_output(
+        [sys.executable, "-m", "bocado", "run"] + list(args))
+
+  def find_add(self, profile):
+    for module in profile:
+      for fn in module["functions"]:
+        if fn["name"] == "add":
+          return fn
+
+  def test_run_json(self):
+    ondemand = self.run_bocado("-f", "json", "-o", self.output,
+                               "--include", self.tmpdir, self.script,
+                               self.output)
+    # The on-demand dump already saw the calls to add.
+    self.assertIsNotNone(self.find_add(json.loads(ondemand)))
+    with open(self.output) as f:
+      profile = json.load(f)
+    self.assertEqual(len(profile), 1)
+    add = self.find_add(profile)
+    types = dict([(a["name"], a["types"][0]["name"])
+                  for a in add["arguments"]])
+    self.assertEqual(types, {"a": "int", "b": "float", "": "float"})
+
+  def test_runner_excluded(self):
+    self.run_bocado("-f", "json", "-o", self.output, self.script, self.output)
+    with open(self.output) as f:
+      profile = json.load(f)
+    self.assertIsNotNone(self.find_add(profile))
+    modules = [os.path.basename(module["filename"]) for module in profile]
+    self.assertNotIn("runpy.py", modules)
+    self.assertNotIn("pkgutil.py", modules)
+
+  def test_stubs_main(self):
+    script = os.path.join(self.tmpdir, "vectors.py")
+    with open(script, "w") as f:
+      f.write("class Vec(object):\n  pass\n\n"
+              "def norm(v):\n  return 1.0\n\n"
+              "for i in range(10):\n  norm(Vec())\n")
+    stubdir = os.path.join(self.tmpdir, "stubs")
+    self.run_bocado("-o", self.output, "--stubs", stubdir, "--include",
+                    self.tmpdir, script)
+    with open(os.path.join(stubdir, "vectors.pyi")) as f:
+      stub = f.read()
+    # The script's own classes are referred to by name.
+    self.assertIn("def norm(v: Vec) -> float: ...", stub)
+    self.assertNotIn("__main__", stub)
+
+  def test_snapshot(self):
+    snapshot = os.path.join(self.tmpdir, "state")
+    for run in range(2):
+      self.run_bocado("-f", "json", "-o", self.output, "--snapshot", snapshot,
+                      "--include", self.tmpdir, self.script, self.output)
+      with open(self.output) as f:
+        add = self.find_add(json.load(f))
+      # The second run samples nothing: add was saturated in the first, and
+      # its types come from the snapshot.
+      types = dict([(a["name"], (a["types"][0]["name"],
+                                 a["types"][0]["count"]))
+                    for a in add["arguments"]])
+      self.assertEqual(types, {"a": ("int", 5), "b": ("float", 5),
+                               "": ("float", 5)})
+
+  def test_record_replay(self):
+    log = os.path.join(self.tmpdir, "calls")
+    self.run_bocado("-f", "json", "-o", self.output, "--record", log,
+                    "--include", self.tmpdir, self.script, self.output)
+    with open(self.output) as f:
+      recorded = self.find_add(json.load(f))
+    replayed = os.path.join(self.tmpdir, "replayed.json")
+    subprocess.check_call([sys.executable, "-m", "bocado", "replay", "-f",
+                           "json", "-o", replayed, log + ".00000"])
+    with open(replayed) as f:
+      add = self.find_add(json.load(f))
+    # All but the ids, which differ between processes.
+    for arg in add["arguments"] + recorded["arguments"]:
+      arg.pop("id", None)
+    self.assertEqual(add["arguments"], recorded["arguments"])
+
+  def test_requires_target(self):
+    with open(os.devnull, "w") as devnull:
+      self.assertNotEqual(
+          subprocess.call([sys.executable, "-m", "bocado", "run"],
+                          stderr=devnull), 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,80 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for bocado.query."""
+
+import unittest
+
+from bocado import query
+from bocado.classes import ArgRef
+from bocado.classes import FunctionRef
+from bocado.classes import ValueCollectionDict
+
+
+class QueryTest(unittest.TestCase):
+
+  def setUp(self):
+    FunctionRef.all_fns = ValueCollectionDict(dict)
+    ArgRef.all_args = ValueCollectionDict(dict)
+    query.rebuild()
+    self.scale = FunctionRef("/src/pkg/geometry.py", 10, "scale")
+    for value in [1, 2.0, 3]:
+      ArgRef(self.scale, "factor").add_sample(value)
+      ArgRef(self.scale, "shape").add_sample("square")
+    ArgRef(self.scale, "").add_sample(1.5)
+    self.log = FunctionRef("/src/pkg/util.py", 3, "log")
+    ArgRef(self.log, "message").add_sample("hi")
+    ArgRef(self.log, "").add_sample(None)
+    self.other_scale = FunctionRef("/src/other.py", 1, "scale")
+    ArgRef(self.other_scale, "factor").add_sample(1)
+    ArgRef(self.other_scale, "").add_sample(1)
+    ArgRef(self.other_scale, "").add_sample(None)
+
+  def test_functions(self):
+    self.assertEqual(query.functions(), set([self.scale, self.log,
+                                             self.other_scale]))
+    self.assertEqual(query.functions(name="scale"),
+                     set([self.scale, self.other_scale]))
+    self.assertEqual(query.functions(filename="/src/pkg/"),
+                     set([self.scale, self.log]))
+    self.assertEqual(query.functions(name="scale", filename="/src/pkg/"),
+                     set([self.scale]))
+    self.assertEqual(query.functions(argtype="str"), set([self.scale,
+                                                          self.log]))
+    self.assertEqual(query.functions(mindegree=2), set([self.scale]))
+    self.assertEqual(query.functions(returns="int"), set([self.other_scale]))
+    # Including the functions that only sometimes return None.
+    self.assertEqual(query.functions(returns="NoneType"),
+                     set([self.log, self.other_scale]))
+    self.assertEqual(query.functions(name="missing"), set())
+
+  def test_arguments(self):
+    factor = ArgRef(self.scale, "factor")
+    self.assertEqual(query.arguments(mindegree=2), set([factor]))
+    self.assertEqual(query.arguments(typename="float"), set([factor]))
+    self.assertEqual(query.arguments(typename="float", returns=True),
+                     set([ArgRef(self.scale, "")]))
+    self.assertEqual(query.arguments(funcname="scale", typename="int"),
+                     set([factor, ArgRef(self.other_scale, "factor")]))
+
+  def test_incremental(self):
+    message = ArgRef(self.log, "message")
+    self.assertNotIn(message, query.arguments(mindegree=2))
+    message.add_sample(u"hi")
+    self.assertEqual(query.arguments(mindegree=2),
+                     set([message, ArgRef(self.scale, "factor")]))
+    self.assertNotIn(message, ArgRef.by_degree[1])
+    self.assertIn(message, query.arguments(typename="unicode"))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,162 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for bocado.recorder."""
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from bocado import classes
+from bocado import recorder
+from bocado import value_sampler
+from bocado.classes import ArgRef
+from bocado.classes import FunctionRef
+from bocado.classes import ParameterizedList
+from bocado.classes import ParameterizedTuple
+from bocado.classes import TaggedUnion
+from bocado.classes import ValueCollectionDict
+
+
+class Counter(object):
+  def bump(self, step):
+    return [step]
+
+def scale(factor, points):
+  return factor
+
+
+class RecorderTest(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.prefix = os.path.join(self.tmpdir, "calls")
+    self.reset()
+
+  def tearDown(self):
+    value_sampler.set_recorder(None)
+    shutil.rmtree(self.tmpdir)
+
+  def reset(self):
+    FunctionRef.all_fns = ValueCollectionDict(dict)
+    ArgRef.all_args = ValueCollectionDict(dict)
+    value_sampler.reset()
+
+  def record(self, **options):
+    log = recorder.Recorder(self.prefix, **options)
+    value_sampler.set_recorder(log)
+    sys.settrace(lambda x, y, z: value_sampler.get_fn_arg_values(
+        x, y, z, skipself=False))
+    for i in range(3):
+      scale(i, [(1, 2)])
+      scale(0.5, [])
+      Counter().bump(i)
+    sys.settrace(None)
+    value_sampler.set_recorder(None)
+    log.close()
+    return sorted(glob.glob(self.prefix + ".*"))
+
+  def get_fn(self, function):
+    code = function.func_code
+    return FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+
+  def test_replay(self):
+    logs = self.record()
+    self.assertEqual(logs, [self.prefix + ".00000"])
+    # The replayed profile matches the one sampled while recording.
+    scale_fn = self.get_fn(scale)
+    calls = scale_fn.calls
+    factor_counts = ArgRef(scale_fn, "factor").get_type_counts()
+    points_counts = ArgRef(scale_fn, "points").get_type_counts()
+    self.reset()
+    self.assertEqual(recorder.replay(logs), 2)
+    scale_fn = self.get_fn(scale)
+    self.assertEqual(scale_fn.calls, calls)
+    factor = ArgRef(scale_fn, "factor")
+    self.assertEqual(factor.get_type(), TaggedUnion([int, float]))
+    self.assertEqual(factor.get_type_counts(), factor_counts)
+    self.assertEqual(factor.num_distinct(), 4)
+    points = ArgRef(scale_fn, "points")
+    self.assertEqual(points.get_type_counts(), points_counts)
+    self.assertIn(ParameterizedList.emptytype, points.get_type_counts())
+    bump = self.get_fn(Counter.bump.im_func)
+    self.assertEqual(bump.classname, "Counter")
+    self.assertEqual(bump.receivers, {Counter: 3})
+    self.assertEqual(ArgRef(bump, "").get_type(), ParameterizedList([int]))
+
+  def test_rotation(self):
+    # Every flush fills a file.
+    logs = self.record(maxbytes=1, buffersize=4)
+    self.assertGreater(len(logs), 2)
+    factor_counts = ArgRef(self.get_fn(scale), "factor").get_type_counts()
+    self.reset()
+    recorder.replay(logs, processes=2)
+    self.assertEqual(ArgRef(self.get_fn(scale), "factor").get_type_counts(),
+                     factor_counts)
+    self.assertEqual(self.get_fn(Counter.bump.im_func).calls, 3)
+    # With maxfiles, the oldest files are removed.
+    for log in logs:
+      os.remove(log)
+    self.assertEqual(len(self.record(maxbytes=1, buffersize=4, maxfiles=2)),
+                     2)
+
+  def test_filters(self):
+    logs = self.record()
+    self.reset()
+    self.assertEqual(recorder.replay(logs, exclude=["function:scale"]), 1)
+    self.assertEqual([fn.funcname for fns in FunctionRef.all_fns.values()
+                      for fn in fns.values()], ["bump"])
+
+  def test_truncated(self):
+    logs = self.record(buffersize=4)
+    with open(logs[0], "rb+") as f:
+      f.truncate(os.path.getsize(logs[0]) / 2)
+    calls = lambda: sum([fn.calls for fns in FunctionRef.all_fns.values()
+                         for fn in fns.values()])
+    recorded = calls()
+    self.reset()
+    # The records before the cut are replayed.
+    recorder.replay(logs)
+    self.assertLess(calls(), recorded)
+    self.assertGreater(calls(), 0)
+
+  def test_large_argument(self):
+    points = [(i, float(i)) for i in range(100000)]
+    log = recorder.Recorder(self.prefix)
+    value_sampler.set_recorder(log)
+    sys.settrace(lambda x, y, z: value_sampler.get_fn_arg_values(
+        x, y, z, skipself=False))
+    scale(1, points)
+    sys.settrace(None)
+    value_sampler.set_recorder(None)
+    log.close()
+    self.reset()
+    recorder.replay([self.prefix + ".00000"])
+    self.assertEqual(ArgRef(self.get_fn(scale), "points").get_type(),
+                     ParameterizedList([ParameterizedTuple([int, float])]))
+    # Only the first elements of a container are looked at when recording.
+    code = recorder._code([1] * classes.fingerprint_maxitems + ["a"] * 1000)
+    self.assertEqual(code, ("l", (("c", ("__builtin__", "int")),)))
+
+  def test_placeholders(self):
+    self.assertIs(recorder._type(("__builtin__", "NoneType")), type(None))
+    missing = recorder._type(("missing.module", "Thing"))
+    self.assertEqual((missing.__module__, missing.__name__),
+                     ("missing.module", "Thing"))
+    self.assertIs(recorder._type(("missing.module", "Thing")), missing)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,123 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for bocado.server."""
+
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import unittest
+import urllib2
+
+from bocado import server
+from bocado import value_sampler
+from bocado.classes import ArgRef
+from bocado.classes import FunctionRef
+from bocado.classes import ValueCollectionDict
+
+
+def tick():
+  pass
+
+
+class ServerTest(unittest.TestCase):
+
+  def setUp(self):
+    FunctionRef.all_fns = ValueCollectionDict(dict)
+    ArgRef.all_args = ValueCollectionDict(dict)
+    value_sampler.reset()
+    self.add = FunctionRef("/src/math.py", 1, "add")
+    ArgRef(self.add, "a").add_sample(1)
+    self.neg = FunctionRef("/src/math.py", 5, "neg")
+    ArgRef(self.neg, "a").add_sample(1.0)
+
+  def tearDown(self):
+    server.stop()
+
+  def get(self, path):
+    host, port = server._server.server_address
+    return urllib2.urlopen("http://%s:%d%s" % (host, port, path))
+
+  def names(self, response):
+    return sorted([fn["name"] for module in json.load(response)
+                   for fn in module["functions"]])
+
+  def test_profile(self):
+    server.start()
+    self.assertEqual(self.names(self.get("/json")), ["add", "neg"])
+    csv = self.get("/csv").read().splitlines()
+    self.assertEqual(csv[0].split(",")[:3], ["filename", "lineno", "funcname"])
+    self.assertEqual(len(csv), 3)
+    stats = json.load(self.get("/stats"))
+    self.assertEqual(stats["active"], 0)
+    with self.assertRaises(urllib2.HTTPError) as raised:
+      self.get("/proto")
+    self.assertEqual(raised.exception.code, 501)
+    with self.assertRaises(urllib2.HTTPError) as raised:
+      self.get("/missing")
+    self.assertEqual(raised.exception.code, 404)
+
+  def test_delta(self):
+    server.start()
+    generation = self.get("/json").info()[server.generation_header]
+    self.assertEqual(self.names(self.get("/json?since=" + generation)), [])
+    ArgRef(self.neg, "a").add_sample(2)
+    response = self.get("/json?since=" + generation)
+    self.assertGreater(int(response.info()[server.generation_header]),
+                       int(generation))
+    self.assertEqual(self.names(response), ["neg"])
+
+  def test_delta_no_arguments(self):
+    server.start()
+    generation = self.get("/json").info()[server.generation_header]
+    # A call with no arguments to sample changes the function's call count.
+    sys.settrace(lambda x, y, z: value_sampler.get_fn_arg_values(
+        x, y, z, skipself=False))
+    tick()
+    sys.settrace(None)
+    self.assertIn("tick", self.names(self.get("/json?since=" + generation)))
+
+  def test_uncached(self):
+    server.start()
+    self.assertEqual(self.names(self.get("/json")), ["add", "neg"])
+    self.get("/csv").read()
+    # The server infers types without filling the caches the tracer resets.
+    self.assertIsNone(ArgRef(self.add, "a")._counts)
+    self.assertEqual(ArgRef(self.add, "a").get_type_counts(False), {int: 1})
+
+  def test_unix_socket(self):
+    tmpdir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(tmpdir, "bocado.sock")
+      self.assertEqual(server.parse_address(path), path)
+      server.start(path)
+      client = socket.socket(socket.AF_UNIX)
+      client.connect(path)
+      client.sendall("GET /stats HTTP/1.0\r\n\r\n")
+      response = client.makefile().read()
+      client.close()
+      self.assertTrue(response.startswith("HTTP/1.0 200"))
+      server.stop()
+      self.assertFalse(os.path.exists(path))
+    finally:
+      shutil.rmtree(tmpdir)
+
+  def test_parse_address(self):
+    self.assertEqual(server.parse_address("8700"), ("127.0.0.1", 8700))
+    self.assertEqual(server.parse_address("0.0.0.0:80"), ("0.0.0.0", 80))
+
+
+if __name__ == "__main__":
+  unittest.main()
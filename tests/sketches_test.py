@@ -0,0 +1,168 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for bocado.sketches."""
+
+import unittest
+
+from bocado.sketches import HyperLogLog
+from bocado.sketches import KLL
+from bocado.sketches import LogHistogram
+from bocado.sketches import value_hash
+from bocado.sketches import ValueSummary
+
+
+class ValueHashTest(unittest.TestCase):
+
+  def test_hashable(self):
+    self.assertEqual(value_hash("foo"), hash("foo"))
+
+  def test_unhashable(self):
+    self.assertEqual(value_hash([1, [2]]), value_hash([1, [2]]))
+    self.assertNotEqual(value_hash([1, 2]), value_hash([2, 1]))
+    self.assertEqual(value_hash({"a": [1]}), value_hash({"a": [1]}))
+    self.assertNotEqual(value_hash({"a": [1]}), value_hash({"a": [2]}))
+
+  def test_failing_hash(self):
+    class Proxy(object):
+      def __hash__(self):
+        raise AttributeError("not loaded")
+    proxy = Proxy()
+    self.assertEqual(value_hash(proxy), value_hash(proxy))
+    self.assertEqual(value_hash([proxy]), value_hash([proxy]))
+
+
+class HyperLogLogTest(unittest.TestCase):
+
+  def test_small_cardinality(self):
+    hll = HyperLogLog()
+    self.assertEqual(len(hll), 0)
+    for i in range(10):
+      hll.add(i)
+      hll.add(i)
+    self.assertEqual(len(hll), 10)
+
+  def test_sparse(self):
+    hll = HyperLogLog(sparse=4)
+    for i in range(4):
+      hll.add(i)
+    self.assertIsNone(hll.registers)
+    self.assertEqual(len(hll), 4)
+    hll.add(4)
+    self.assertEqual(len(hll.registers), hll.size)
+    self.assertEqual(len(hll), 5)
+    # Sparse and dense sketches merge either way round.
+    sparse = HyperLogLog(sparse=4)
+    sparse.add(5)
+    self.assertEqual(len(HyperLogLog(sparse=4).merge(sparse).merge(hll)), 6)
+    self.assertEqual(len(hll.merge(sparse)), 6)
+
+  def test_large_cardinality(self):
+    hll = HyperLogLog()
+    for i in xrange(50000):
+      hll.add("value%d" % i)
+    self.assertAlmostEqual(hll.cardinality() / 50000.0, 1.0, delta=0.1)
+
+  def test_merge(self):
+    hll1 = HyperLogLog()
+    hll2 = HyperLogLog()
+    for i in range(100):
+      hll1.add(i)
+      hll2.add(i + 50)
+    merged = HyperLogLog(registers=hll1.registers).merge(hll2)
+    self.assertAlmostEqual(merged.cardinality() / 150.0, 1.0, delta=0.1)
+    with self.assertRaises(Exception):
+      hll1.merge(HyperLogLog(precision=4))
+
+  def test_fold(self):
+    hll = HyperLogLog()
+    for i in xrange(5000):
+      hll.add("value%d" % i)
+    size = hll.nbytes()
+    hll.fold(8)
+    self.assertEqual((hll.precision, len(hll.registers)), (8, 256))
+    self.assertLess(hll.nbytes(), size)
+    self.assertAlmostEqual(hll.cardinality() / 5000.0, 1.0, delta=0.2)
+    # Folding matches sketching at the lower precision from the start.
+    coarse = HyperLogLog(precision=8)
+    for i in xrange(5000):
+      coarse.add("value%d" % i)
+    self.assertEqual(hll.registers, coarse.registers)
+    sparse = HyperLogLog()
+    sparse.add(1)
+    self.assertEqual(len(sparse.fold(4).merge(HyperLogLog(precision=4))), 1)
+
+
+class KLLTest(unittest.TestCase):
+
+  def test_empty(self):
+    self.assertIsNone(KLL().quantile(0.5))
+
+  def test_quantile(self):
+    kll = KLL()
+    for i in xrange(10000):
+      kll.add(i)
+    self.assertLess(sum([len(c) for c in kll.compactors]), 1000)
+    self.assertAlmostEqual(kll.quantile(0.5), 5000, delta=500)
+    self.assertAlmostEqual(kll.quantile(0.9), 9000, delta=500)
+
+  def test_merge(self):
+    kll1 = KLL()
+    kll2 = KLL()
+    for i in xrange(5000):
+      kll1.add(i)
+      kll2.add(i + 5000)
+    self.assertAlmostEqual(kll1.merge(kll2).quantile(0.5), 5000, delta=500)
+
+
+class ValueSummaryTest(unittest.TestCase):
+
+  def test_summary(self):
+    summary = ValueSummary()
+    for x in [2, 4, 4, 4, 5, 5, 7, 9]:
+      summary.add(x)
+    stats = summary.to_dict()
+    self.assertEqual(stats["count"], 8)
+    self.assertEqual(stats["min"], 2)
+    self.assertEqual(stats["max"], 9)
+    self.assertAlmostEqual(stats["mean"], 5.0)
+    self.assertAlmostEqual(stats["variance"], 32.0 / 7)
+    self.assertEqual(stats["p50"], 4)
+
+
+class LogHistogramTest(unittest.TestCase):
+
+  def test_buckets(self):
+    histogram = LogHistogram()
+    for x in [0.001] * 9 + [3.0]:
+      histogram.add(x)
+    self.assertEqual(histogram.count, 10)
+    self.assertAlmostEqual(histogram.mean(), 0.3009)
+    # 0.001 is in [2**-10, 2**-9).
+    self.assertEqual(histogram.quantile(0.5), 2 ** -9)
+    self.assertEqual(histogram.quantile(0.99), 4.0)
+    self.assertEqual(histogram.to_dict()["buckets"], [[2 ** -9, 9], [4.0, 1]])
+
+  def test_merge(self):
+    a, b = LogHistogram(), LogHistogram()
+    a.add(1.0)
+    b.add(1.5)
+    b.add(0.0)
+    a.merge(b)
+    self.assertEqual(a.count, 3)
+    # 1.0 and 1.5 are both in [1, 2); zero is in the lowest bucket.
+    self.assertEqual(a.buckets, {1: 2, LogHistogram.minexponent: 1})
+    self.assertEqual(a.total, 2.5)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,157 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for bocado.snapshot."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from bocado import snapshot
+from bocado import value_sampler
+from bocado.classes import ArgRef
+from bocado.classes import FunctionRef
+from bocado.classes import ParameterizedList
+from bocado.classes import ValueCollectionDict
+
+
+class Point(object):
+
+  def moved(self, dx):
+    return self
+
+
+def scale(factor, point):
+  return factor
+
+
+class SnapshotTest(unittest.TestCase):
+
+  def setUp(self):
+    self.forget()
+    self.filename = os.path.join(tempfile.mkdtemp(), "snapshot")
+    self.key = FunctionRef.get_key(scale.func_code)
+
+  def tearDown(self):
+    shutil.rmtree(os.path.dirname(self.filename))
+    self.forget()
+
+  def forget(self):
+    # As after a restart.
+    FunctionRef.all_fns = ValueCollectionDict(dict)
+    ArgRef.all_args = ValueCollectionDict(dict)
+    value_sampler.reset()
+
+  def trace(self, *calls):
+    sys.settrace(
+        lambda x, y, z: value_sampler.get_fn_arg_values(x, y, z,
+                                                        skipself=False))
+    for args in calls:
+      scale(*args)
+    sys.settrace(None)
+
+  def scale_ref(self):
+    return FunctionRef.all_fns[scale.func_code.co_filename][
+        scale.func_code.co_firstlineno]
+
+  def test_restore_saturated(self):
+    self.trace(*[(i, Point()) for i in range(10)])
+    self.assertIn(self.key, value_sampler.inactive)
+    self.assertEqual(snapshot.save(self.filename), 1)
+    self.forget()
+    self.assertEqual(snapshot.restore(self.filename), 1)
+    self.assertIn(self.key, value_sampler.inactive)
+    # Nothing is sampled, but the types are known again once scale is called.
+    self.trace((1, Point()))
+    fn = self.scale_ref()
+    self.assertEqual(ArgRef(fn, "factor").samples, [])
+    self.assertEqual(ArgRef(fn, "point").type_counts, {Point: 5})
+    self.assertEqual(ArgRef(fn, "point").get_type(), Point)
+    self.assertEqual([(arg.argname, arg.position)
+                      for arg in fn.get_sorted_arg_list()],
+                     [("", -1), ("factor", 0), ("point", 1)])
+    # A new argument type still reactivates sampling, on a checked call.
+    value_sampler._guard_skips.clear()
+    self.trace((1.5, Point()))
+    self.assertIn(self.key, value_sampler.active)
+    self.assertEqual(ArgRef(fn, "factor").samples, [1.5])
+    # The restored types are still reported alongside the new samples.
+    self.assertEqual(ArgRef(fn, "factor").get_type_counts(),
+                     {int: 5, float: 1})
+
+  def test_parameterized(self):
+    self.trace(*[(i, [Point(), Point()]) for i in range(10)])
+    calls = self.scale_ref().calls
+    # Inferred types and calls survive any number of round trips.
+    for restart in range(2):
+      snapshot.save(self.filename)
+      self.forget()
+      snapshot.restore(self.filename)
+      self.trace((1, [Point()]))
+      fn = self.scale_ref()
+      self.assertEqual(fn.calls, calls)
+      point = ArgRef(fn, "point")
+      self.assertEqual(point.samples, [])
+      self.assertEqual(point.get_type(), ParameterizedList([Point]))
+      self.assertEqual(point.get_type_counts(),
+                       {ParameterizedList([Point]): calls})
+      self.assertEqual(point.type_counts, {list: calls})
+
+  def test_save_unresolved(self):
+    self.trace(*[(i, Point()) for i in range(10)])
+    snapshot.save(self.filename)
+    self.forget()
+    snapshot.restore(self.filename)
+    # Restored functions that were not called are saved as they were loaded,
+    # and functions that are already known are not replaced.
+    snapshot.save(self.filename)
+    self.assertEqual(snapshot.restore(self.filename), 0)
+    self.forget()
+    self.assertEqual(snapshot.restore(self.filename), 1)
+    self.trace((1, Point()))
+    self.assertEqual(ArgRef(self.scale_ref(), "factor").type_counts, {int: 5})
+
+  def test_receivers(self):
+    sys.settrace(
+        lambda x, y, z: value_sampler.get_fn_arg_values(x, y, z,
+                                                        skipself=False))
+    for i in range(10):
+      Point().moved(i)
+    sys.settrace(None)
+    snapshot.save(self.filename)
+    self.forget()
+    snapshot.restore(self.filename)
+    self.trace((1, Point()))
+    code = Point.moved.im_func.func_code
+    snapshot.resolve(FunctionRef.get_key(code))
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    self.assertEqual((fn.receiver, fn.classname, fn.receivers),
+                     ("self", "Point", {Point: 5}))
+
+  def test_unresolved_types(self):
+    class Local(object):
+      pass
+    self.trace(*[(i, Local()) for i in range(10)])
+    snapshot.save(self.filename)
+    self.forget()
+    snapshot.restore(self.filename)
+    self.trace((1, Local()))
+    # Local cannot be found by name, so its count is dropped and seeing it
+    # again reactivates sampling.
+    self.assertIn(self.key, value_sampler.active)
+    self.assertEqual(ArgRef(self.scale_ref(), "point").type_counts, {Local: 1})
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,150 @@
+# Copyright 2014 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for bocado.stubs."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from bocado import stubs
+from bocado import value_sampler
+from bocado.classes import ArgRef
+from bocado.classes import FunctionRef
+from bocado.classes import ValueCollectionDict
+
+
+class Shape(object):
+
+  def __init__(self, sides):
+    self.sides = sides
+
+  def scaled(self, factor, *rest):
+    """Returns the side count, scaled.
+
+    Twice, for good measure.
+    """
+    return [self.sides * factor]
+
+
+def describe_all(shapes, sep=", "):
+  return sep.join([str(shape.sides) for shape in shapes])
+
+
+def first(pair): return pair[0]
+
+
+def find(items, key):
+  if key in items:
+    return items.index(key)
+
+
+def count_up(n):
+  for i in range(n):
+    yield i
+
+
+class StubsTest(unittest.TestCase):
+
+  def setUp(self):
+    FunctionRef.all_fns = ValueCollectionDict(dict)
+    ArgRef.all_args = ValueCollectionDict(dict)
+    value_sampler.reset()
+    sys.settrace(
+        lambda x, y, z: value_sampler.get_fn_arg_values(x, y, z,
+                                                        skipself=False))
+    Shape(3).scaled(2.0)
+    describe_all([Shape(4)])
+    first((1, "a"))
+    first((2.0, "b"))
+    sys.settrace(None)
+    self.filename = os.path.splitext(__file__)[0] + ".py"
+    self.outdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.outdir)
+
+  def test_type_comment(self):
+    fn = FunctionRef.all_fns[self.filename][first.func_code.co_firstlineno]
+    self.assertEqual(
+        stubs.type_comment(fn),
+        "(Union[Tuple[float, str], Tuple[int, str]]) -> Union[float, int]")
+
+  def test_optional_and_generator(self):
+    sys.settrace(
+        lambda x, y, z: value_sampler.get_fn_arg_values(x, y, z,
+                                                        skipself=False))
+    find([1, 2], 2)
+    find([1, 2], 3)
+    list(count_up(2))
+    sys.settrace(None)
+    fns = FunctionRef.all_fns[self.filename]
+    # A function that sometimes returns None returns an Optional.
+    self.assertEqual(stubs.type_comment(fns[find.func_code.co_firstlineno]),
+                     "(List[int], int) -> Optional[int]")
+    # A generator returns an Iterator of what it yields.
+    self.assertEqual(
+        stubs.type_comment(fns[count_up.func_code.co_firstlineno]),
+        "(int) -> Iterator[int]")
+
+  def test_write_stubs(self):
+    written = stubs.write_stubs(self.outdir, processes=1)
+    self.assertEqual(written,
+                     [os.path.join(self.outdir, "stubs_test.pyi")])
+    with open(written[0]) as f:
+      stub = f.read()
+    self.assertEqual(stub, "\n".join([
+        "# Generated by bocado from sampled types.",
+        "from typing import Any, List, Tuple, Union",
+        "",
+        "class Shape(object):",
+        "    def __init__(self, sides: int) -> None: ...",
+        "    def scaled(self, factor: float, *rest: Any) -> List[float]: ...",
+        "",
+        "def describe_all(shapes: List[Shape], sep: str = ...) -> str: ...",
+        "",
+        "def first(pair: Union[Tuple[float, str], Tuple[int, str]]) -> "
+        "Union[float, int]: ...",
+        ""]))
+
+  def test_write_type_comments(self):
+    written = stubs.write_stubs(self.outdir, processes=1, inline=True)
+    with open(written[0]) as f:
+      lines = f.read().splitlines()
+    with open(self.filename) as f:
+      # Three type comments (first is a one-line def) and the typing import.
+      self.assertEqual(len(lines), len(f.read().splitlines()) + 4)
+    self.assertIn("from typing import Any, List, Tuple, Union", lines)
+    scaled = lines.index("  def scaled(self, factor, *rest):")
+    self.assertEqual(lines[scaled + 1],
+                     "    # type: (float, *Any) -> List[float]")
+    describe = lines.index('def describe_all(shapes, sep=", "):')
+    self.assertEqual(lines[describe + 1],
+                     "  # type: (List[Shape], str) -> str")
+
+  def test_parallel(self):
+    # Two files written by two worker processes. The second has no source.
+    root = os.path.dirname(self.filename)
+    fn = FunctionRef(os.path.join(root, "nosource.py"), 1, "other")
+    ArgRef(fn, "x").add_sample(1)
+    written = stubs.write_stubs(self.outdir, root=root, processes=2)
+    self.assertEqual(len(written), 2)
+    with open(os.path.join(self.outdir, "nosource.pyi")) as f:
+      self.assertIn("def other(x: int) -> None: ...", f.read())
+    # Sources outside root are skipped.
+    self.assertEqual(stubs.write_stubs(self.outdir, root=self.outdir), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
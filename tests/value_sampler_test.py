@@ -16,6 +16,7 @@ import unittest
 from bocado.classes import *
 from bocado.output import *
 from bocado.value_sampler import *
+from bocado import value_sampler
 
 
 class Point(object):
@@ -23,6 +24,17 @@ class Point(object):
     self.x = x
     self.y = y
 
+class Shape(object):
+  def area(self):
+    return 0
+
+  @classmethod
+  def unit(cls):
+    return cls()
+
+class Square(Shape):
+  pass
+
 def l1_distance(p1, p2):
   return abs(p1.x - p2.x) + abs(p1.y - p2.y)
 
@@ -72,6 +84,71 @@ def lambda_in_body(args=[]):
 def apply_lambda_immediately(args=(lambda x: x)([])):
   return args
 
+def identity(x):
+  return x
+
+def pair(n):
+  yield n
+  yield n + 1
+
+def resilient():
+  while True:
+    try:
+      yield 1
+    except ValueError:
+      pass
+
+class Unloaded(object):
+  # A lazy proxy, whose hash and dir() fail until it is loaded.
+  def __hash__(self):
+    raise AttributeError("not loaded")
+
+  def __dir__(self):
+    raise RuntimeError("not loaded")
+
+def countdown(n):
+  while n:
+    yield n
+    n -= 1
+    if not n:
+      del n
+      yield None
+      return
+
+def fail(x):
+  raise ValueError(x)
+
+def fail_through(x):
+  return fail(x)
+
+def recover(x):
+  try:
+    fail(x)
+  except ValueError:
+    return x
+
+def cleanup():
+  return None
+
+def fail_finally(x):
+  try:
+    fail(x)
+  finally:
+    cleanup()
+
+def recover_none(x):
+  try:
+    fail(x)
+  except ValueError:
+    pass
+
+def boom():
+  raise ValueError()
+
+def variadic(first, second=None, *rest, **options):
+  local = first
+  return local
+
 def get_fn(name):
   for filedict in FunctionRef.all_fns.values():
     for fn in filedict.values():
@@ -85,6 +162,7 @@ class ValueSamplerTest(unittest.TestCase):
   def setUp(self):
     FunctionRef.all_fns = ValueCollectionDict(dict)
     ArgRef.all_args = ValueCollectionDict(dict)
+    reset()
     self.trace_fn = lambda x, y, z: get_fn_arg_values(x, y, z, skipself=False)
 
   def test_lambdas(self):
@@ -162,16 +240,488 @@ class ValueSamplerTest(unittest.TestCase):
     self.assertEqual(outer_fn.signature["n"][1], TaggedUnion([float, int]))
     inner_fn = get_fn("helper")
     self.assertIsNotNone(inner_fn)
-    # Remember, becuase this is an inner function, helper is actually
-    # made into a closure.
-    import types
-    self.assertIs(len(inner_fn.signature), 6)
+    # helper is a closure, but only its parameters are sampled, not the
+    # free variables eps, helper and n.
+    self.assertIs(len(inner_fn.signature), 3)
     self.assertEqual(inner_fn.signature[""][1], float)
-    self.assertEqual(inner_fn.signature["eps"][1], float)
-    self.assertEqual(inner_fn.signature["helper"][1], types.FunctionType)
-    self.assertEqual(inner_fn.signature["a"][1], TaggedUnion([float, int]))
-    self.assertEqual(inner_fn.signature["b"][1], TaggedUnion([float, int]))
-    self.assertEqual(inner_fn.signature["n"][1], TaggedUnion([float, int]))
+    self.assertEqual(inner_fn.signature["a"], (0, TaggedUnion([float, int])))
+    self.assertEqual(inner_fn.signature["b"], (1, TaggedUnion([float, int])))
+
+  def test_failing_hash(self):
+    sys.settrace(self.trace_fn)
+    identity(Unloaded())
+    tracer = sys.gettrace()
+    sys.settrace(None)
+    # The exception stays in the tracer, which stays installed.
+    self.assertIsNotNone(tracer)
+    fn = FunctionRef.all_fns[identity.func_code.co_filename][
+        identity.func_code.co_firstlineno]
+    self.assertEqual(ArgRef(fn, "x").type_counts, {Unloaded: 1})
+
+  def test_failing_dir(self):
+    reset_retention(FINGERPRINT)
+    try:
+      sys.settrace(self.trace_fn)
+      identity(Unloaded())
+      tracer = sys.gettrace()
+      sys.settrace(None)
+    finally:
+      reset_retention(STRONG)
+    self.assertIsNotNone(tracer)
+    fn = FunctionRef.all_fns[identity.func_code.co_filename][
+        identity.func_code.co_firstlineno]
+    self.assertEqual(ArgRef(fn, "x").get_type(), Unloaded)
+
+  def test_stop_sampling(self):
+    # A monomorphic function saturates after minsamples calls.
+    sys.settrace(self.trace_fn)
+    for i in range(20):
+      identity(i)
+    sys.settrace(None)
+    code = identity.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    self.assertEqual(len(ArgRef(fn, "x").samples), minsamples)
+    self.assertIn(fn.key, inactive)
+    # One that keeps seeing new types does not.
+    reset()
+    new_types = [type("T%d" % i, (object,), {})() for i in range(20)]
+    sys.settrace(self.trace_fn)
+    for value in new_types:
+      identity(value)
+    sys.settrace(None)
+    self.assertEqual(len(ArgRef(fn, "x").samples), minsamples + 20)
+    self.assertNotIn(fn.key, inactive)
+
+  def test_type_drift(self):
+    sys.settrace(self.trace_fn)
+    for i in range(20):
+      identity(i)
+    sys.settrace(None)
+    code = identity.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    self.assertIn(fn.key, inactive)
+    self.assertEqual(guards[fn.key], (("x", frozenset([int])),))
+    # A new type reactivates the function until it saturates again.
+    sys.settrace(self.trace_fn)
+    for i in range(20):
+      identity(str(i))
+    sys.settrace(None)
+    self.assertIn(fn.key, inactive)
+    self.assertEqual(guards[fn.key], (("x", frozenset([int, str])),))
+    # Only until the new type is no longer a singleton.
+    self.assertLess(ArgRef(fn, "x").type_counts[str], 20)
+    self.assertEqual(ArgRef(fn, "x").get_type(), TaggedUnion([int, str]))
+
+  def test_guard_stride(self):
+    sys.settrace(self.trace_fn)
+    for i in range(20):
+      identity(i)
+    sys.settrace(None)
+    code = identity.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    # Drift is only checked on one in every guard_stride calls.
+    value_sampler._guard_skips.clear()
+    sys.settrace(self.trace_fn)
+    identity(1)
+    for i in range(guard_stride - 1):
+      identity(str(i))
+    sys.settrace(None)
+    self.assertIn(fn.key, inactive)
+    sys.settrace(self.trace_fn)
+    identity("b")
+    sys.settrace(None)
+    self.assertNotIn(fn.key, inactive)
+
+  def test_guard_deleted_parameter(self):
+    sys.settrace(self.trace_fn)
+    for i in range(20):
+      list(countdown(2))
+    # Resuming a saturated generator whose parameter was deleted.
+    value_sampler.guard_stride = 1
+    value_sampler._guard_skips.clear()
+    try:
+      self.assertEqual(list(countdown(1)), [1, None])
+    finally:
+      sys.settrace(None)
+      value_sampler.guard_stride = 8
+    code = countdown.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    self.assertIn(fn.key, inactive)
+
+  def test_stats(self):
+    enable_stats()
+    try:
+      sys.settrace(self.trace_fn)
+      for i in range(20):
+        identity(i)
+      sys.settrace(None)
+      code = identity.func_code
+      FunctionRef.all_fns[code.co_filename][code.co_firstlineno].set_signature()
+      current = get_stats()
+    finally:
+      enable_stats(False)
+    # The trace function also sees the call to sys.settrace(None).
+    self.assertGreaterEqual(current["calls_seen"], 20)
+    self.assertEqual(current["calls_sampled"], minsamples)
+    self.assertEqual(current["functions_deactivated"], 1)
+    self.assertGreater(current["trace_call_time"], 0)
+    self.assertGreater(current["instance_set_time"], 0)
+    self.assertGreater(current["sample_memory"], 0)
+    self.assertIn(current["inactive"], [1, 2])
+
+  def test_overhead_budget(self):
+    # A zero-length window re-evaluates on every check.
+    set_overhead_budget(0.02, window=0, every=1)
+    try:
+      self.assertFalse(value_sampler._throttled())
+      for expected_stride in [2, 4, 8, 16, 32, 64]:
+        stats["trace_call_time"] += 10.0
+        value_sampler._govern()
+        self.assertEqual(value_sampler.stride, expected_stride)
+      stats["trace_call_time"] += 10.0
+      value_sampler._govern()
+      self.assertTrue(value_sampler.paused)
+      # With no tracer time in the window, the governor relaxes again.
+      value_sampler._govern()
+      self.assertFalse(value_sampler.paused)
+      value_sampler._govern()
+      self.assertEqual(value_sampler.stride, 32)
+    finally:
+      set_overhead_budget(None)
+      enable_stats(False)
+
+  def test_memory_budget(self):
+    new_types = [type("T%d" % i, (object,), {})() for i in range(20)]
+    sys.settrace(self.trace_fn)
+    for i in range(20):
+      identity(i)
+      variadic(new_types[i])
+    sys.settrace(None)
+    code = identity.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    arg = ArgRef(fn, "x")
+    other_code = variadic.func_code
+    other = FunctionRef.all_fns[other_code.co_filename][
+        other_code.co_firstlineno]
+    self.assertIn(fn.key, inactive)
+    size = enforce_memory_budget(1 << 30)
+    self.assertEqual(len(arg.samples), minsamples)
+    # Saturated functions are compacted first, keeping their types.
+    self.assertLess(enforce_memory_budget(size - 1), size)
+    self.assertEqual(arg.samples, [])
+    self.assertEqual(arg.get_type(), int)
+    self.assertEqual(arg.get_type_counts(), {int: minsamples})
+    # Then evicted; functions still sampling are kept.
+    set_memory_budget(0, every=1)
+    try:
+      sys.settrace(self.trace_fn)
+      identity(1)
+      variadic(1)
+      sys.settrace(None)
+      current = get_stats()
+    finally:
+      set_memory_budget(None)
+      reset_stats()
+    self.assertNotIn(code.co_firstlineno,
+                     FunctionRef.all_fns.get(code.co_filename, {}))
+    self.assertIs(FunctionRef.all_fns[other_code.co_filename][
+        other_code.co_firstlineno], other)
+    # They stay saturated, with a summary of their types.
+    self.assertIn(fn.key, inactive)
+    self.assertIn(fn.key, value_sampler.guards)
+    self.assertEqual(value_sampler.evicted[fn.key][3:],
+                     [minsamples, {"x": {int: minsamples},
+                                   "": {int: minsamples}}])
+    self.assertEqual(current["functions_compacted"], 1)
+    self.assertEqual(current["functions_evicted"], 1)
+    self.assertEqual(current["evicted_calls"], minsamples)
+    # Measured before the last call's return value was sampled.
+    self.assertGreater(current["profile_memory"], 0)
+    self.assertLessEqual(current["profile_memory"],
+                         other.nbytes())
+
+  def make_functions(self, n):
+    # Each in a file of its own, so that each has its own FunctionRef.
+    fns = []
+    for i in range(n):
+      namespace = {}
+      exec compile("def f%d(x):\n  return x\n" % i, "<budget%d>" % i,
+                   "exec") in namespace
+      fns.append(namespace["f%d" % i])
+    return fns
+
+  def test_memory_budget_sustained(self):
+    fns = self.make_functions(40)
+    set_memory_budget(20000, every=5)
+    enable_stats()
+    try:
+      sys.settrace(self.trace_fn)
+      for _ in range(200):
+        for f in fns:
+          f(1)
+      sys.settrace(None)
+      current = get_stats()
+    finally:
+      set_memory_budget(None)
+      enable_stats(False)
+      reset_stats()
+    self.assertGreater(current["functions_evicted"], 0)
+    # Evicted functions stay saturated, so the budget does not bring back
+    # sampling of every call, and their types are kept in a summary.
+    self.assertLessEqual(current["calls_sampled"], len(fns) * minsamples)
+    names = set([summary[2] for summary in value_sampler.evicted.values()])
+    for fns_by_line in FunctionRef.all_fns.values():
+      names.update([fn.funcname for fn in fns_by_line.values()
+                    if fn.calls])
+    self.assertEqual(names, set([f.__name__ for f in fns]))
+
+  def test_memory_budget_coldest_first(self):
+    hot, cold = self.make_functions(2)
+    sys.settrace(self.trace_fn)
+    for f in (hot, cold):
+      for i in range(minsamples):
+        f(i)
+    # hot saturated first, but is still being called.
+    for i in range(4 * value_sampler.guard_stride):
+      hot(i)
+    sys.settrace(None)
+    for fns_by_line in FunctionRef.all_fns.values():
+      for fn in fns_by_line.values():
+        fn.compact()
+    size = enforce_memory_budget(1 << 30)
+    enforce_memory_budget(size - 1)
+    self.assertEqual([summary[2] for summary in value_sampler.evicted.values()],
+                     [cold.__name__])
+
+  def test_filters(self):
+    code = ulam.func_code
+    try:
+      set_filters(exclude=["function:ul*"])
+      sys.settrace(self.trace_fn)
+      ulam(4)
+      identity(1)
+      sys.settrace(None)
+      self.assertNotIn(code.co_firstlineno,
+                       FunctionRef.all_fns[code.co_filename])
+      self.assertIn(identity.func_code.co_firstlineno,
+                    FunctionRef.all_fns[code.co_filename])
+      set_filters(include=["module:tests"], exclude=["*/nowhere/*"])
+      sys.settrace(self.trace_fn)
+      ulam(4)
+      sys.settrace(None)
+      self.assertIn(code.co_firstlineno, FunctionRef.all_fns[code.co_filename])
+      set_filters(include=["module:elsewhere", "file:/nowhere/"])
+      self.trace_fn(sys._getframe(), "call", None)
+      self.assertIsNone(value_sampler._decisions[id(sys._getframe().f_code)][1])
+    finally:
+      set_filters()
+
+  def test_parameters(self):
+    sys.settrace(self.trace_fn)
+    variadic(1, "a", 2.0, flag=True)
+    variadic(2)
+    sys.settrace(None)
+    code = variadic.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    # Only parameters are sampled, at their positions in the signature.
+    self.assertEqual([(arg.position, arg.argname, arg.kind)
+                      for arg in fn.get_sorted_arg_list()],
+                     [(-1, "", None), (0, "first", POSITIONAL),
+                      (1, "second", POSITIONAL), (2, "rest", VARARGS),
+                      (3, "options", VARKEYWORDS)])
+    self.assertEqual(ArgRef(fn, "rest").samples, [(2.0,), ()])
+    self.assertEqual(ArgRef(fn, "options").samples, [{"flag": True}, {}])
+
+  def test_receivers(self):
+    sys.settrace(self.trace_fn)
+    Shape().area()
+    Square().area()
+    Square.unit()
+    sys.settrace(None)
+    fns = dict([(fn.funcname, fn) for fns in FunctionRef.all_fns.values()
+                for fn in fns.values()])
+    area = fns["area"]
+    self.assertTrue(area.method)
+    self.assertEqual(area.classname, "Shape")
+    self.assertEqual(area.receivers, {Shape: 1, Square: 1})
+    self.assertNotIn("self", [arg.argname for arg in area.args.values()])
+    area.set_signature()
+    self.assertEqual(area.signature["self"], (0, TaggedUnion([Shape, Square])))
+    unit = fns["unit"]
+    self.assertEqual((unit.receiver, unit.classname, unit.receivers),
+                     ("cls", "Shape", {Square: 1}))
+    # Receivers can still be sampled like any other argument.
+    FunctionRef.all_fns = ValueCollectionDict(dict)
+    ArgRef.all_args = ValueCollectionDict(dict)
+    reset()
+    reset_receivers(False)
+    try:
+      sys.settrace(self.trace_fn)
+      Shape().area()
+      sys.settrace(None)
+    finally:
+      reset_receivers(True)
+    code = Shape.area.im_func.func_code
+    area = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    self.assertEqual(ArgRef(area, "self").get_type(), Shape)
+    self.assertFalse(area.receivers)
+
+  def test_callsites(self):
+    reset_callsites(True, maxcallsites=2)
+    try:
+      sys.settrace(self.trace_fn)
+      identity(1); identity(2)
+      identity("a")
+      identity(1.0)
+      sys.settrace(None)
+    finally:
+      reset_callsites(False, maxcallsites=16)
+    code = identity.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    self.assertEqual(len(fn.callsites), 3)
+    here = sys._getframe().f_code
+    ints, strs = sorted([s for k, s in fn.callsites.items() if k is not None],
+                        key=lambda s: s.lineno)
+    self.assertEqual((ints.filename, ints.caller), (here.co_filename,
+                                                    here.co_name))
+    self.assertEqual(ints.calls, 2)
+    self.assertEqual(ints.type_counts["x"], {int: 2})
+    self.assertEqual(ints.type_counts[""], {int: 2})
+    self.assertEqual(strs.type_counts["x"], {str: 1})
+    self.assertEqual(strs.lineno, ints.lineno + 1)
+    # Past maxcallsites, calls are counted together.
+    self.assertEqual(fn.callsites[None].type_counts["x"], {float: 1})
+
+  def test_latency(self):
+    reset_latency(True, by_signature=True)
+    try:
+      sys.settrace(self.trace_fn)
+      identity(1); identity(2.0); identity(3)
+      sys.settrace(None)
+    finally:
+      reset_latency(False)
+    code = identity.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    self.assertEqual(fn.calls, 3)
+    self.assertEqual(fn.latency.count, 3)
+    self.assertEqual(fn.latency_by_signature[(int,)].count, 2)
+    self.assertEqual(fn.latency_by_signature[(float,)].count, 1)
+    self.assertFalse(value_sampler._calls_in_progress)
+
+  def test_latency_generator(self):
+    reset_latency(True)
+    try:
+      sys.settrace(self.trace_fn)
+      list(pair(1))
+      sys.settrace(None)
+    finally:
+      reset_latency(False)
+    code = pair.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    # The last resumption starts with its return, and is timed too.
+    self.assertEqual(fn.calls, 3)
+    self.assertEqual(fn.latency.count, 3)
+    self.assertFalse(value_sampler._calls_in_progress)
+
+  def test_signatures(self):
+    reset_signatures(True)
+    try:
+      sys.settrace(self.trace_fn)
+      identity(1); identity("a"); identity(2)
+      sys.settrace(None)
+    finally:
+      reset_signatures(False)
+    code = identity.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    self.assertEqual(fn.signatures, {((int,), int): 2, ((str,), str): 1})
+    self.assertFalse(value_sampler._calls_in_progress)
+
+  def test_exceptions(self):
+    reset_signatures(True)
+    try:
+      sys.settrace(self.trace_fn)
+      try:
+        fail_through(1)
+      except ValueError:
+        pass
+      recover(2)
+      sys.settrace(None)
+    finally:
+      reset_signatures(False)
+    fns = dict([(f.funcname, f) for f in
+                FunctionRef.all_fns[fail.func_code.co_filename].values()])
+    # The exception raised by fail is counted once by each frame it unwinds.
+    self.assertEqual(fns["fail"].exceptions, {ValueError: 2})
+    self.assertEqual(fns["fail_through"].exceptions, {ValueError: 1})
+    self.assertEqual(fns["fail"].exceptions_by_signature,
+                     {((int,), ValueError): 2})
+    self.assertEqual(fns["fail"].signatures, {})
+    # recover handled it, and its return is still sampled.
+    self.assertEqual(fns["recover"].exceptions, {})
+    self.assertEqual(fns["recover"].signatures, {((int,), int): 1})
+    self.assertEqual(ArgRef(fns["recover"], "").samples, [2])
+    self.assertFalse(value_sampler._exceptions)
+    self.assertFalse(value_sampler._calls_in_progress)
+
+  def test_exceptions_finally(self):
+    sys.settrace(self.trace_fn)
+    try:
+      fail_finally(1)
+    except ValueError:
+      pass
+    recover_none(1)
+    sys.settrace(None)
+    fns = dict([(f.funcname, f) for f in
+                FunctionRef.all_fns[fail.func_code.co_filename].values()])
+    # A finally block runs line events, but the exception still unwinds.
+    self.assertEqual(fns["fail_finally"].exceptions, {ValueError: 1})
+    # A handled exception followed by an implicit return of None is not.
+    self.assertEqual(fns["recover_none"].exceptions, {})
+    self.assertFalse(value_sampler._exceptions)
+
+  def test_exceptions_thrown(self):
+    reset_signatures(True)
+    try:
+      sys.settrace(self.trace_fn)
+      generator = pair(1)
+      next(generator)
+      try:
+        generator.throw(ValueError)
+      except ValueError:
+        pass
+      sys.settrace(None)
+    finally:
+      reset_signatures(False)
+    code = pair.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    # The resumption starts with the exception, which unwinds it.
+    self.assertEqual(fn.exceptions, {ValueError: 1})
+    self.assertEqual([(argtypes, returntype) for argtypes, returntype, _
+                      in fn.get_signatures()], [((int,), int)])
+    self.assertFalse(value_sampler._calls_in_progress)
+    # A generator that handles it suspends at the same yield again.
+    sys.settrace(self.trace_fn)
+    generator = resilient()
+    next(generator)
+    generator.throw(ValueError)
+    sys.settrace(None)
+    code = resilient.func_code
+    fn = FunctionRef.all_fns[code.co_filename][code.co_firstlineno]
+    self.assertEqual(fn.exceptions, {})
+    self.assertFalse(value_sampler._exceptions)
+
+  def test_class_body(self):
+    sys.settrace(self.trace_fn)
+    class Vec(object):
+      def norm(self):
+        return 0
+    Vec().norm()
+    sys.settrace(None)
+    names = [f.funcname for f in
+             FunctionRef.all_fns[fail.func_code.co_filename].values()]
+    # A class body is run like a function, but only its methods are sampled.
+    self.assertIn("norm", names)
+    self.assertNotIn("Vec", names)
 
 
 class OutputTest(unittest.TestCase):
@@ -179,6 +729,7 @@ class OutputTest(unittest.TestCase):
   def setUp(self):
     FunctionRef.all_fns = ValueCollectionDict(dict)
     ArgRef.all_args = ValueCollectionDict(dict)
+    reset()
     self.trace_fn = lambda x, y, z: get_fn_arg_values(x, y, z, skipself=False)
 
   def test_jsonize(self):
@@ -192,6 +743,77 @@ class OutputTest(unittest.TestCase):
     self.assertIn("functions", json[0])
     self.assertIn("filename", json[0])
 
+  def test_jsonize_statistics(self):
+    reset_value_statistics(True)
+    sys.settrace(self.trace_fn)
+    ulam(10)
+    sys.settrace(None)
+    reset_value_statistics(False)
+    json = serialize(fmt="json")
+    ulam_json = [f for f in json[0]["functions"] if f["name"] == "ulam"][0]
+    n = [a for a in ulam_json["arguments"] if a["name"] == "n"][0]
+    self.assertEqual(n["types"][0]["name"], "int")
+    # ulam(10) visits 10, 5, 16, 8, 4, ... but saturates after minsamples calls.
+    self.assertEqual(n["statistics"]["magnitude"]["count"], minsamples)
+    self.assertEqual(n["statistics"]["magnitude"]["max"], 16)
+    self.assertEqual(n["statistics"]["magnitude"]["min"], 4)
+
+  def test_jsonize_callsites(self):
+    reset_callsites(True)
+    sys.settrace(self.trace_fn)
+    ulam(10)
+    sys.settrace(None)
+    reset_callsites(False)
+    json = serialize(fmt="json")
+    ulam_json = [f for f in json[0]["functions"] if f["name"] == "ulam"][0]
+    # ulam calls itself from two lines; the first call comes from this test.
+    callers = sorted([s["caller"] for s in ulam_json["callsites"]])
+    self.assertEqual(callers, ["test_jsonize_callsites", "ulam", "ulam"])
+    self.assertEqual(sum([s["calls"] for s in ulam_json["callsites"]]),
+                     minsamples)
+
+  def test_jsonize_latency(self):
+    reset_latency(True)
+    sys.settrace(self.trace_fn)
+    ulam(10)
+    sys.settrace(None)
+    reset_latency(False)
+    json = serialize(fmt="json")
+    ulam_json = [f for f in json[0]["functions"] if f["name"] == "ulam"][0]
+    self.assertEqual(ulam_json["calls"], minsamples)
+    # Calls still running when ulam saturated are timed too.
+    self.assertGreaterEqual(ulam_json["latency"]["count"], minsamples)
+    self.assertNotIn("latency_by_signature", ulam_json)
+
+  def test_jsonize_no_arguments(self):
+    sys.settrace(self.trace_fn)
+    try:
+      boom()
+    except ValueError:
+      pass
+    sys.settrace(None)
+    json = serialize(fmt="json")
+    boom_json = [f for m in json for f in m["functions"]
+                 if f["name"] == "boom"][0]
+    self.assertEqual(boom_json["arguments"], [])
+    self.assertEqual(boom_json["calls"], 1)
+    self.assertEqual(boom_json["exceptions"],
+                     [{"name": "ValueError", "count": 1}])
+
+  def test_jsonize_signatures(self):
+    reset_signatures(True)
+    sys.settrace(self.trace_fn)
+    newtons_method(20.25)
+    sys.settrace(None)
+    reset_signatures(False)
+    json = serialize(fmt="json")
+    helper = [f for f in json[0]["functions"] if f["name"] == "helper"][0]
+    # a stays the int 1 until the root is bracketed; b is always a float.
+    self.assertEqual(helper["signatures"][0],
+                     {"arguments": ["int", "float"], "return": "float",
+                      "count": 3})
+    self.assertEqual(helper["signatures"][1]["arguments"], ["float", "float"])
+
   def test_tuplize(self):
     sys.settrace(self.trace_fn)
     ulam(10)
@@ -199,6 +821,31 @@ class OutputTest(unittest.TestCase):
     tuples = serialize(fmt="table")
     self.assertIs(len(tuples), 3)
 
+  def test_jsonize_receivers(self):
+    sys.settrace(self.trace_fn)
+    Shape().area()
+    Square().area()
+    sys.settrace(None)
+    json = serialize(fmt="json")
+    area = [f for f in json[0]["functions"] if f["name"] == "area"][0]
+    self.assertEqual(area["class"], "Shape")
+    receiver = [a for a in area["arguments"] if a["name"] == "self"][0]
+    self.assertEqual(sorted([(t["name"], t["count"]) for t in receiver["types"]]),
+                     [("Shape", 1), ("Square", 1)])
+
+  def test_type_counts(self):
+    fn = FunctionRef("counts.py", 1, "counted")
+    for value in [1, 2, 3, "a"]:
+      ArgRef(fn, "x").add_sample(value)
+    json = serialize(fmt="json")
+    types = json[0]["functions"][0]["arguments"][0]["types"]
+    self.assertEqual(sorted([(t["name"], t["count"], t["empirical_probability"])
+                             for t in types]),
+                     [("int", 3, 0.75), ("str", 1, 0.25)])
+    self.assertEqual(sorted([(row[4], row[5], row[-1])
+                             for row in serialize(fmt="table")]),
+                     [(int, 0.75, 3), (str, 0.25, 1)])
+
 
 if __name__ == "__main__":
   unittest.main()